@@ -1,4 +1,6 @@
-from tennistools.single_elimination_competition import simulate_competition
+from tennistools.single_elimination_competition import simulate_competition, calculate_competition_probabilities
+from tennistools.solver import match_win_probability
+from tennistools.monte_carlo import simulate_competition_adaptive
 import math
 from tqdm import tqdm
 from collections import Counter
@@ -113,4 +115,24 @@ for _ in tqdm(range(1000)):
     winner, match_histories = simulate_competition(playerlist, probability_model1)
     winners.append(winner['name'])
 print('\nFrequency of winners in 1000 simulations')
-print(Counter(winners))
\ No newline at end of file
+print(Counter(winners))
+
+# Calculating the probabilities exactly, without simulation. probability_model1 only depends on who is serving so the
+# chance of each player beating each other player can be solved exactly, and then carried through the draw
+def sigmoid(x):
+    return 1 / (1 + math.exp(-x))
+
+win_probability_matrix = [[match_win_probability(sigmoid(player0['attack'] - player1['defence']),
+                                                 sigmoid(player1['attack'] - player0['defence']))
+                           for player1 in playerlist] for player0 in playerlist]
+competition_probabilities = calculate_competition_probabilities(playerlist, win_probability_matrix)
+print('\nExact probability of winning the competition')
+for player, probability in zip(playerlist, competition_probabilities[-1]):
+    print(f'{player["name"]}\t\t:{probability:.3f}')
+
+# Rather than a fixed number of simulations, simulate until every player's probability of winning is known to within
+# +/- 0.02 (95% confidence)
+aggregator, is_converged = simulate_competition_adaptive(playerlist, probability_model1, tolerance=0.04, seed=0)
+print(f'\nSimulated probability of winning the competition from {aggregator.n} simulations')
+for player, probability in zip(playerlist, aggregator.win_probabilities):
+    print(f'{player["name"]}\t\t:{probability:.3f}')
@@ -1,3 +1,6 @@
+import copy
+from collections import namedtuple
+
 import numpy as np
 SETS_REQUIRED = 3
 
@@ -6,6 +9,95 @@ POINTS_REQUIRED = 4 #In addition to win by 2
 POINTS_TIEBREAK_REQUIRED = 7 #In addition to win by 2
 
 
+def _is_won_table(points_required, size, margin):
+    """Table of whether a game (or tiebreak) is over at each score up to size - 1 points each"""
+    return tuple(tuple(max(player0, player1) >= points_required and abs(player0 - player1) >= margin
+                       for player1 in range(size)) for player0 in range(size))
+
+
+class MatchFormat(object):
+    """
+    A class to represent the rules of a match, with lookup tables of when a game, tiebreak, set and match is over so
+    the score keeping does not work it out on every point. The default is the format of SETS_REQUIRED,
+    GAMES_REQUIRED, POINTS_REQUIRED and POINTS_TIEBREAK_REQUIRED (best of five sets, advantage games, tiebreak at 6-6).
+    Formats are immutable and compare equal if their rules are the same
+
+    Attributes
+    ---------
+    sets_required: Sets needed to win the match, e.g. 2 for best of three
+    games_required: Games needed to win a set (by 2, with a tiebreak at games_required all)
+    points_required: Points needed to win a game
+    points_tiebreak_required: Points needed to win a tiebreak (by 2)
+    is_no_ad: Whether games are won by the first to points_required, with a deciding point at deuce
+    match_tiebreak_points: If given, a deciding set is replaced by a tiebreak to this many points (by 2), e.g. 10
+    game_over, tiebreak_over, match_tiebreak_over: tables of whether a game, tiebreak or match tiebreak is over,
+    indexed [player0 points][player1 points] up to one point past the first level score that can go on
+    game_level, tiebreak_level, match_tiebreak_level: points beyond which a level score (and a lead of one) has the
+    same future, so scores past the tables are looked up that many points on from the level score
+    set_over: table of whether a set is over, indexed [player0 games][player1 games]
+    is_tiebreak_score: table of whether the next game of a set is a tiebreak
+    match_over: table of whether the match is over, indexed [player0 sets][player1 sets]
+
+    Methods
+    ---------
+    is_deciding_set(player0_sets, player1_sets): whether the next set is the last one that can be played
+    """
+
+    def __init__(self, sets_required=SETS_REQUIRED, games_required=GAMES_REQUIRED, points_required=POINTS_REQUIRED,
+                 points_tiebreak_required=POINTS_TIEBREAK_REQUIRED, is_no_ad=False, match_tiebreak_points=None):
+        self.sets_required = sets_required
+        self.games_required = games_required
+        self.points_required = points_required
+        self.points_tiebreak_required = points_tiebreak_required
+        self.is_no_ad = is_no_ad
+        self.match_tiebreak_points = match_tiebreak_points
+
+        if is_no_ad:
+            # The game always ends by points_required all, so the table covers every score
+            self.game_level = points_required
+            self.game_over = _is_won_table(points_required, points_required + 1, 1)
+        else:
+            self.game_level = points_required - 1
+            self.game_over = _is_won_table(points_required, points_required + 2, 2)
+        self.tiebreak_level = points_tiebreak_required - 1
+        self.tiebreak_over = _is_won_table(points_tiebreak_required, points_tiebreak_required + 2, 2)
+        if match_tiebreak_points is not None:
+            self.match_tiebreak_level = match_tiebreak_points - 1
+            self.match_tiebreak_over = _is_won_table(match_tiebreak_points, match_tiebreak_points + 2, 2)
+
+        self.set_over = tuple(tuple((max(games0, games1) == games_required and abs(games0 - games1) >= 2) or
+                                    max(games0, games1) == games_required + 1
+                                    for games1 in range(games_required + 2)) for games0 in range(games_required + 2))
+        self.is_tiebreak_score = tuple(tuple(games0 == games_required and games1 == games_required
+                                             for games1 in range(games_required + 2))
+                                       for games0 in range(games_required + 2))
+        self.match_over = tuple(tuple(max(sets0, sets1) == sets_required for sets1 in range(sets_required + 1))
+                                for sets0 in range(sets_required + 1))
+
+    def _key(self):
+        return (self.sets_required, self.games_required, self.points_required, self.points_tiebreak_required,
+                self.is_no_ad, self.match_tiebreak_points)
+
+    def __eq__(self, other):
+        return isinstance(other, MatchFormat) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return 'MatchFormat(sets_required={}, games_required={}, points_required={}, points_tiebreak_required={}, ' \
+               'is_no_ad={}, match_tiebreak_points={})'.format(*self._key())
+
+    def is_deciding_set(self, player0_sets, player1_sets):
+        return player0_sets == player1_sets == self.sets_required - 1
+
+
+BEST_OF_FIVE = MatchFormat()
+BEST_OF_THREE = MatchFormat(sets_required=2)
+# Doubles on the ATP and WTA tours: no-ad games and a match tiebreak to 10 in place of a third set
+DOUBLES = MatchFormat(sets_required=2, is_no_ad=True, match_tiebreak_points=10)
+
+
 class Tgame(object):
     """
     A class to represent a game of tennis
@@ -13,8 +105,12 @@ class Tgame(object):
     Attributes
     ---------
     score_history: ordered list of points in the game so far
+    player0_points: running count of points won by player 0
+    player1_points: running count of points won by player 1
     game_winner: returns whether player 0 or player 1 won (once game is complete)
     is_player0_server: Is the first player listed serving. Needed to determine which player won the game
+    keep_history: Whether points are added to score_history. If False only the running score is kept
+    match_format: The MatchFormat of the match, BEST_OF_FIVE by default
 
     Methods
     ---------
@@ -22,26 +118,42 @@ class Tgame(object):
     get_current_score: returns score as tuple of points won by server, receiver
     _str_from_score(score): (private) method to convert score representation to human readable score
     play_point(is_player0_winner): Adds additional point to score_history
+    clone: copy of the game that can be played on separately
     __str__: string representation of the score_history
 
     """
 
-    def __init__(self, is_player0_server):#=True):
+    def __init__(self, is_player0_server, keep_history=True, match_format=None):#=True):
         self.score_history = []
+        self.player0_points = 0
+        self.player1_points = 0
         self.game_winner = None
         self.is_player0_server = is_player0_server
+        self.keep_history = keep_history
+        self.match_format = BEST_OF_FIVE if match_format is None else match_format
+        self._over = self.match_format.game_over
+        self._level = self.match_format.game_level
 
     def is_game_over(self):
-        score = self.get_current_score()
-        maxscore = max(score)
-        minscore = min(score)
-        return (maxscore >=POINTS_REQUIRED) & (maxscore > minscore + 1)
+        player0_points, player1_points = self.player0_points, self.player1_points
+        if player0_points > self._level and player1_points > self._level:
+            # Past deuce only the lead matters
+            extra_points = min(player0_points, player1_points) - self._level
+            player0_points, player1_points = player0_points - extra_points, player1_points - extra_points
+        return self._over[player0_points][player1_points]
 
     def get_current_score(self):
         """returns tuple of server points won, receiver points won"""
-        player0_score = sum([point==0 for point in self.score_history])
-        player1_score = sum([point==1 for point in self.score_history])
-        return (player0_score, player1_score)
+        return (self.player0_points, self.player1_points)
+
+    def _add_point(self, is_player0_point_winner):
+        """Records the point in score_history (0 for a player 0 point, 1 for a player 1 point) and the running score"""
+        if is_player0_point_winner:
+            self.player0_points += 1
+        else:
+            self.player1_points += 1
+        if self.keep_history:
+            self.score_history.append(int(not is_player0_point_winner))
 
     def _str_from_score(self, score):
         """Returns (semi)traditional score wording (e.g. 'Advantage player 0' from tuple of server, receiver points won
@@ -77,18 +189,23 @@ class Tgame(object):
 
     def play_point(self, is_player0_point_winner):
         """Gives either the server or the receiver an additional point"""
-        self.score_history.append(int(not is_player0_point_winner))
+        self._add_point(is_player0_point_winner)
         if self.is_game_over():
             self.finalise_game()
 
     def finalise_game(self):
         """sets the game_winner attribute so that set scores and match scores can be calculated more quickly"""
-        player0_points, player1_points = self.get_current_score()
-        if player0_points > player1_points:
+        if self.player0_points > self.player1_points:
             self.game_winner = 0
         else:
             self.game_winner = 1
 
+    def clone(self):
+        """Returns a copy of the game that can be played on without changing this one"""
+        game = copy.copy(self)
+        game.score_history = list(self.score_history)
+        return game
+
     def __str__(self):
         """string reprentation"""
         running_scores = [(0,0)]
@@ -109,8 +226,13 @@ class Ttiebreak(Tgame):
     Attributes
     ---------
     score_history: ordered list of points in the game so far
+    player0_points: running count of points won by player 0
+    player1_points: running count of points won by player 1
     game_winner: returns whether player 0 or player 1 won (once game is complete)
     is_player0_server: Is the first player listed serving. Needed to determine which player won the game
+    keep_history: Whether points are added to score_history. If False only the running score is kept
+    match_format: The MatchFormat of the match, BEST_OF_FIVE by default
+    is_match_tiebreak: Whether the tiebreak is played in place of a deciding set (see MatchFormat.match_tiebreak_points)
 
     Methods
     ---------
@@ -121,21 +243,24 @@ class Ttiebreak(Tgame):
     __str__: string representation of the score_history
 
     """
+    def __init__(self, is_player0_server, keep_history=True, match_format=None, is_match_tiebreak=False):
+        super().__init__(is_player0_server, keep_history, match_format)
+        self.is_match_tiebreak = is_match_tiebreak
+        if is_match_tiebreak:
+            self._over = self.match_format.match_tiebreak_over
+            self._level = self.match_format.match_tiebreak_level
+        else:
+            self._over = self.match_format.tiebreak_over
+            self._level = self.match_format.tiebreak_level
+
     def _str_from_score(self, score):
         """Tiebreaker scores same as the actual points scored"""
         return score
 
-    def is_game_over(self):
-        """Check to see if either player has won the tiebreaker"""
-        score = self.get_current_score()
-        maxscore = max(score)
-        minscore = min(score)
-        return (maxscore >= POINTS_TIEBREAK_REQUIRED) & (maxscore > minscore + 1)
-
     def play_point(self, is_player0_point_winner):
         """Gives either the server or the receiver an additional point, depending on winner"""
-        self.score_history.append(int(is_player0_point_winner))
-        if len(self.score_history) % 2 == 1:
+        self._add_point(is_player0_point_winner)
+        if (self.player0_points + self.player1_points) % 2 == 1:
             self.is_player0_server = not self.is_player0_server
         if self.is_game_over():
             self.finalise_game()
@@ -148,8 +273,13 @@ class Tset(object):
     Attributes
     ---------
     game_history: ordered list of games of tennis completed so far in set
+    player0_games: running count of games won by player 0
+    player1_games: running count of games won by player 1
     set_winner: returns who won the set, once complete.
     is_player0_server: Is the first player listed serving at the start of the current game
+    keep_history: Whether games are added to game_history. If False only the running score is kept
+    match_format: The MatchFormat of the match, BEST_OF_FIVE by default
+    is_match_tiebreak_set: Whether the set is a single match tiebreak (see MatchFormat.match_tiebreak_points)
 
     Methods
     ---------
@@ -158,42 +288,54 @@ class Tset(object):
     play_point(is_player0_winner): Adds additional point to score_history
     finalise_current_game: sets current game game_winner property and sets current_game to a new game/tiebreaker
     finalise_set: sets winner of the set to the person with the most points. To be called after is_set_over is True
+    clone: copy of the set that can be played on separately, sharing the completed games
     __str__: string representation of the score_history
 
     """
 
-    def __init__(self,is_player0_server):
+    def __init__(self,is_player0_server, keep_history=True, match_format=None, is_deciding_set=False):
         self.game_history = []
-        self.current_game = Tgame(is_player0_server)
+        self.player0_games = 0
+        self.player1_games = 0
+        self.match_format = BEST_OF_FIVE if match_format is None else match_format
+        self.is_match_tiebreak_set = is_deciding_set and self.match_format.match_tiebreak_points is not None
+        if self.is_match_tiebreak_set:
+            self.current_game = Ttiebreak(is_player0_server, keep_history, self.match_format, is_match_tiebreak=True)
+        else:
+            self.current_game = Tgame(is_player0_server, keep_history, self.match_format)
         self.set_winner = None
         self.is_player0_server = is_player0_server
+        self.keep_history = keep_history
 
     def get_current_score(self):
-        winners = [game.game_winner for game in self.game_history]
-        player0_sets = sum([winner==0 for winner in winners])
-        player1_sets = len(winners) - player0_sets
-        return (player0_sets, player1_sets)
+        return (self.player0_games, self.player1_games)
 
     def is_set_over(self):
-        player_0_games, player_1_games = self.get_current_score()
-        maxgames = max(player_0_games, player_1_games)
-        mingames = min(player_0_games, player_1_games)
-        return (maxgames == GAMES_REQUIRED) & (maxgames>= mingames+2) | maxgames == (GAMES_REQUIRED +1) #won during a tiebreaker
+        if self.is_match_tiebreak_set:
+            return self.player0_games + self.player1_games > 0
+        return self.match_format.set_over[self.player0_games][self.player1_games]
 
     def finalise_current_game(self):
         """On game finish, append game to game history and set up the next game"""
-        self.game_history.append(self.current_game)
-        if self.get_current_score() == (GAMES_REQUIRED,GAMES_REQUIRED):
+        if self.keep_history:
+            self.game_history.append(self.current_game)
+        if self.current_game.game_winner == 0:
+            self.player0_games += 1
+        else:
+            self.player1_games += 1
+        if self.is_match_tiebreak_set:
+            # The set was the match tiebreak, so there is no next game
+            self.is_player0_server = not self.is_player0_server
+        elif self.match_format.is_tiebreak_score[self.player0_games][self.player1_games]:
             # in the event of tiebreak the person who received in the previous set serves.
             self.is_player0_server = not self.is_player0_server
-            self.current_game = Ttiebreak(self.is_player0_server)
+            self.current_game = Ttiebreak(self.is_player0_server, self.keep_history, self.match_format)
         else:
             self.is_player0_server = not self.is_player0_server
-            self.current_game = Tgame(self.is_player0_server)
+            self.current_game = Tgame(self.is_player0_server, self.keep_history, self.match_format)
 
     def finalise_set(self):
-        player_0_games, player_1_games = self.get_current_score()
-        if player_0_games > player_1_games:
+        if self.player0_games > self.player1_games:
             self.set_winner = 0
         else:
             self.set_winner = 1
@@ -205,6 +347,14 @@ class Tset(object):
         if self.is_set_over():
             self.finalise_set()
 
+    def clone(self):
+        """Returns a copy of the set that can be played on without changing this one. Completed games are not changed
+        by playing on, so they are shared rather than copied"""
+        tset = copy.copy(self)
+        tset.game_history = list(self.game_history)
+        tset.current_game = self.current_game.clone()
+        return tset
+
     def __str__(self):
         return f'Result:{str(self.set_winner)}\n Setscore:{self.get_current_score()}\n\n'+'\n'.join([str(s) for s in self.game_history])
 
@@ -215,55 +365,143 @@ class Tmatch(object):
     Attributes
     ---------
     set_history: ordered list of sets of tennis completed so far in set
+    player0_sets: running count of sets won by player 0
+    player1_sets: running count of sets won by player 1
+    set_scores: ordered list of the games won by player 0, player 1 in each completed set
+    points_played: running count of points played (sets added with play_set are not included)
     current_set: The current set being played
     match_winner: returns who won the set, once complete.
     is_player0_server: Is the first player listed serving at the start of the current set
+    keep_history: Whether the sets, games and points played are kept. If False only the running score and set_scores
+    are kept, which is all that is needed to carry on playing and to report the result
+    match_format: The MatchFormat of the match, BEST_OF_FIVE by default
 
     Methods
     ---------
     is_match_over: determines if match is complete
     get_match_score: returns score as tuple of sets won by server, receiver
     play_point(is_player0_winner): Adds additional point to score_history of current game in current set
+    play_set(player0_games, player1_games): Adds a whole set with the given score, without playing its points
     finalise_current_set: sets current set set_winner property and sets current_set to a new set
     finalise_match: sets winner of the match to the person with the most sets. To be called after is_match_over is True
+    clone: copy of the match that can be played on separately, sharing the completed sets
+    snapshot: the score of the match as a TmatchSnapshot
+    from_snapshot(snapshot, keep_history, match_format): (static) creates a match at the score of a snapshot, ready to
+    play on
     __str__: string representation of the score_history
     """
-    def __init__(self, is_player0_server=True):
+    def __init__(self, is_player0_server=True, keep_history=True, match_format=None):
         self.set_history=[]
-        self.current_set = Tset(is_player0_server)
+        self.player0_sets = 0
+        self.player1_sets = 0
+        self.set_scores = []
+        self.points_played = 0
+        self.match_format = BEST_OF_FIVE if match_format is None else match_format
+        self.current_set = Tset(is_player0_server, keep_history, self.match_format,
+                                self.match_format.is_deciding_set(0, 0))
         self.match_winner = None
         self.is_player0_server = is_player0_server
+        self.keep_history = keep_history
 
     def is_match_over(self):
-        (player0score, player1score) = self.get_match_score()
-        return max(player0score, player1score)== SETS_REQUIRED
+        return self.match_format.match_over[self.player0_sets][self.player1_sets]
 
     def get_match_score(self):
-        winners = [tset.set_winner for tset in self.set_history]
-        player0_wins = sum([win==0 for win in winners])
-        player1_wins = len(winners) - player0_wins
-        return (player0_wins, player1_wins)
+        return (self.player0_sets, self.player1_sets)
 
     def finalise_current_set(self):
-        self.set_history.append(self.current_set)
+        if self.keep_history:
+            self.set_history.append(self.current_set)
+        self.set_scores.append(self.current_set.get_current_score())
+        if self.current_set.set_winner == 0:
+            self.player0_sets += 1
+        else:
+            self.player1_sets += 1
         self.is_player0_server = self.current_set.is_player0_server
-        self.current_set = Tset(self.is_player0_server)
+        self.current_set = Tset(self.is_player0_server, self.keep_history, self.match_format,
+                                self.match_format.is_deciding_set(self.player0_sets, self.player1_sets))
 
     def finalise_match(self):
-        player0_sets, player1_sets = self.get_match_score()
-        if player0_sets > player1_sets:
+        if self.player0_sets > self.player1_sets:
             self.match_winner = 0
         else:
             self.match_winner = 1
 
     def play_point(self, is_player1_point_winner):
+        self.points_played += 1
         self.current_set.play_point(is_player1_point_winner)
         if self.current_set.is_set_over():
             self.finalise_current_set()
         if self.is_match_over():
             self.finalise_match()
 
+    def play_set(self, player0_games, player1_games):
+        """Adds a whole set won with the given games, without playing its games or points. Used to build up a result
+        from sampled set scores, so it is only called between sets"""
+        self.current_set.player0_games = player0_games
+        self.current_set.player1_games = player1_games
+        if (player0_games + player1_games) % 2 == 1:
+            self.current_set.is_player0_server = not self.current_set.is_player0_server
+        self.current_set.finalise_set()
+        self.finalise_current_set()
+        if self.is_match_over():
+            self.finalise_match()
+
+    def clone(self):
+        """Returns a copy of the match that can be played on without changing this one. Completed sets are not changed
+        by playing on, so they are shared rather than copied"""
+        tmatch = copy.copy(self)
+        tmatch.set_history = list(self.set_history)
+        tmatch.set_scores = list(self.set_scores)
+        tmatch.current_set = self.current_set.clone()
+        return tmatch
+
+    def snapshot(self):
+        """Returns the score of the match as a TmatchSnapshot"""
+        tset = self.current_set
+        game = tset.current_game
+        return TmatchSnapshot(self.player0_sets, self.player1_sets, tset.player0_games, tset.player1_games,
+                              game.player0_points, game.player1_points, tset.is_player0_server,
+                              isinstance(game, Ttiebreak), tuple(self.set_scores), self.points_played)
+
+    @staticmethod
+    def from_snapshot(snapshot, keep_history=False, match_format=None):
+        """Returns a new match at the score of a TmatchSnapshot, ready to play on. None of the points before it are
+        played, so if keep_history is True the history starts from the snapshot. match_format is the MatchFormat of
+        the match, BEST_OF_FIVE by default"""
+        # The serve changes after every game, so the set was started by the server of the current game if an even
+        # number of games have been played
+        games_played = snapshot.player0_games + snapshot.player1_games
+        tmatch = Tmatch(snapshot.is_player0_server != (games_played % 2 == 1), keep_history, match_format)
+        tmatch.player0_sets, tmatch.player1_sets = snapshot.player0_sets, snapshot.player1_sets
+        tmatch.set_scores = list(snapshot.set_scores)
+        tmatch.points_played = snapshot.points_played
+
+        tset = Tset(tmatch.is_player0_server, keep_history, tmatch.match_format,
+                    tmatch.match_format.is_deciding_set(snapshot.player0_sets, snapshot.player1_sets))
+        tmatch.current_set = tset
+        tset.player0_games, tset.player1_games = snapshot.player0_games, snapshot.player1_games
+        tset.is_player0_server = snapshot.is_player0_server
+        if snapshot.is_tiebreak:
+            game = Ttiebreak(snapshot.is_player0_server, keep_history, tmatch.match_format, tset.is_match_tiebreak_set)
+            # As in Ttiebreak.play_point, the serve changes after the first point and then every two points
+            points_played = snapshot.player0_points + snapshot.player1_points
+            game.is_player0_server = snapshot.is_player0_server != (((points_played + 1) // 2) % 2 == 1)
+        else:
+            game = Tgame(snapshot.is_player0_server, keep_history, tmatch.match_format)
+        game.player0_points, game.player1_points = snapshot.player0_points, snapshot.player1_points
+        tset.current_game = game
+
+        if tmatch.is_match_over():
+            tmatch.finalise_match()
+        return tmatch
+
     def __str__(self):
         return f'Winner: {self.match_winner}\nScore:{self.get_match_score()}\n\n' + '\n'.join([str(tset) for tset in self.set_history])
 
 
+# An immutable record of the score of a match, from Tmatch.snapshot. is_player0_server is whether player 0 served the
+# first point of the current game (or tiebreak) and set_scores is a tuple of the games won in each completed set
+TmatchSnapshot = namedtuple('TmatchSnapshot', ['player0_sets', 'player1_sets', 'player0_games', 'player1_games',
+                                               'player0_points', 'player1_points', 'is_player0_server', 'is_tiebreak',
+                                               'set_scores', 'points_played'])
@@ -0,0 +1,165 @@
+#########################################################################################################
+### Benchmarks
+### Measures the throughput of the engine: points per second through Tmatch.play_point, matches per second
+### through stochastic_simulation_match and competitions per second through simulate_competition for a range
+### of draw sizes, along with the peak memory of each. Results are written as JSON and can be compared with a
+### saved baseline to catch performance regressions. Run with
+###     python -m tennistools.benchmarks --output results.json [--baseline baseline.json]
+#########################################################################################################
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from tennistools import Tmatch
+from tennistools.simulation import stochastic_simulation_match
+from tennistools.single_elimination_competition import simulate_competition
+
+DRAW_SIZES = [8, 16, 32, 64, 128, 256]
+
+
+def _benchmark_probability(tmatch, player0, player1):
+    """A fixed point win probability for the server, so the benchmarks measure the engine rather than a model"""
+    return 0.62 if tmatch.current_set.current_game.is_player0_server else 0.38
+
+
+def _play_points(n_points):
+    is_player0_point_winner = np.random.uniform(size=n_points) < 0.5
+    tmatch = Tmatch()
+    for is_player0_winner in is_player0_point_winner.tolist():
+        tmatch.play_point(is_player0_winner)
+        if tmatch.match_winner is not None:
+            tmatch = Tmatch()
+
+
+def _play_matches(n_matches):
+    for _ in range(n_matches):
+        stochastic_simulation_match(_benchmark_probability)
+
+
+def _play_competitions(n_competitions, playerlist):
+    for _ in range(n_competitions):
+        simulate_competition(playerlist, _benchmark_probability)
+
+
+def _measure(function, n, unit, repeat):
+    """Best rate of repeat timed runs of function(n), then the peak memory of one more run under tracemalloc (which
+    is kept out of the timings as it slows allocation down)"""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(n)
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function(n)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'unit': unit, 'n': n, 'seconds': min(seconds), 'rate': n / min(seconds), 'peak_memory_bytes': peak_memory}
+
+
+def run_benchmarks(n_points=100000, n_matches=200, n_competition_matches=1000, draw_sizes=None, repeat=3, seed=0):
+    """
+    Runs the benchmarks.
+
+    :param n_points: Number of points played through Tmatch.play_point per run
+    :param n_matches: Number of matches played through stochastic_simulation_match per run
+    :param n_competition_matches: Rough number of matches per run of a competition benchmark. Each draw size plays
+    enough competitions to reach it (at least one)
+    :param draw_sizes: Numbers of players in the competitions. Default DRAW_SIZES
+    :param repeat: Number of timed runs of each benchmark, the fastest is reported
+    :param seed: Seed for the global numpy random state, which is put back afterwards
+    :return: dictionary of 'machine' (python, numpy, platform) and 'results', a dictionary of benchmark name to
+    unit, n, seconds, rate (n per second) and peak_memory_bytes
+    """
+    if draw_sizes is None:
+        draw_sizes = DRAW_SIZES
+
+    random_state = np.random.get_state()
+    np.random.seed(seed)
+    try:
+        results = {'points': _measure(_play_points, n_points, 'points', repeat),
+                   'matches': _measure(_play_matches, n_matches, 'matches', repeat)}
+        for draw_size in draw_sizes:
+            playerlist = [{'name': 'player' + str(i)} for i in range(draw_size)]
+            results['competition_' + str(draw_size)] = _measure(lambda n: _play_competitions(n, playerlist),
+                                                                max(1, n_competition_matches // (draw_size - 1)),
+                                                                'competitions', repeat)
+    finally:
+        np.random.set_state(random_state)
+
+    machine = {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform()}
+    return {'machine': machine, 'results': results}
+
+
+def save_results(benchmarks, path):
+    with open(path, 'w') as f:
+        json.dump(benchmarks, f, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(benchmarks, baseline, tolerance=0.2):
+    """
+    Compares the rates of benchmarks with a baseline (both as returned by run_benchmarks or load_results).
+
+    :param tolerance: Fraction the rate can fall below the baseline before it is a regression
+    :return: list of dictionaries of name, rate, baseline_rate, ratio (rate / baseline_rate) and is_regression, for
+    every benchmark in both
+    """
+    comparison = []
+    for name, result in sorted(benchmarks['results'].items()):
+        if name not in baseline['results']:
+            continue
+        baseline_rate = baseline['results'][name]['rate']
+        ratio = result['rate'] / baseline_rate
+        comparison.append({'name': name, 'rate': result['rate'], 'baseline_rate': baseline_rate, 'ratio': ratio,
+                           'is_regression': ratio < 1 - tolerance})
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the tennis simulation engine')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--baseline', help='JSON file of earlier results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Fraction a rate can fall below the baseline before it is reported as a regression')
+    parser.add_argument('--points', type=int, default=100000, help='Points played per run')
+    parser.add_argument('--matches', type=int, default=200, help='Matches played per run')
+    parser.add_argument('--competition-matches', type=int, default=1000,
+                        help='Rough number of matches played per run of each competition benchmark')
+    parser.add_argument('--draw-sizes', type=int, nargs='+', default=DRAW_SIZES)
+    parser.add_argument('--repeat', type=int, default=3)
+    arguments = parser.parse_args(argv)
+
+    benchmarks = run_benchmarks(arguments.points, arguments.matches, arguments.competition_matches,
+                                arguments.draw_sizes, arguments.repeat)
+    for name, result in benchmarks['results'].items():
+        print(f"{name:>18}: {result['rate']:12.1f} {result['unit']}/sec, "
+              f"peak memory {result['peak_memory_bytes'] / 2 ** 20:.1f} MiB")
+    if arguments.output:
+        save_results(benchmarks, arguments.output)
+
+    if arguments.baseline:
+        comparison = compare_results(benchmarks, load_results(arguments.baseline), arguments.tolerance)
+        for row in comparison:
+            flag = 'REGRESSION' if row['is_regression'] else ''
+            print(f"{row['name']:>18}: {row['ratio']:6.2f} x baseline {flag}")
+        if any(row['is_regression'] for row in comparison):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
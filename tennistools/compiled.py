@@ -0,0 +1,155 @@
+#########################################################################################################
+### Compiled kernels
+### Loops over points and matches compiled with Numba when it is installed. Matches of a serve probability
+### function are played through the score state tables (see tennistools.state_machine), and competitions
+### of a match probability cache are decided from a matrix of the cached probabilities. Both draw the same
+### random numbers in the same order as the Python functions they stand in for, so the same seed gives the
+### same results with or without Numba. Without it the kernels still run, as plain (slow) Python, and the
+### simulation functions use their usual Python paths instead.
+#########################################################################################################
+
+from functools import lru_cache
+
+import numpy as np
+
+from tennistools import BEST_OF_FIVE
+from tennistools.state_machine import match_state_tables, MatchStateResult
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        """Leaves the function as Python when Numba is not installed"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda function: function
+
+
+@lru_cache(maxsize=None)
+def kernel_tables(match_format=BEST_OF_FIVE):
+    """The tables of match_state_tables as arrays: next_state, set_player0_games and set_player1_games (-1 if the
+    transition does not finish a set), is_player0_serving, start and match_over"""
+    tables = match_state_tables(match_format)
+    set_scores = [(-1, -1) if set_score is None else set_score for set_score in tables['set_score']]
+    return {'next_state': np.array(tables['next_state'], dtype=np.int64),
+            'set_player0_games': np.array([player0_games for player0_games, _ in set_scores], dtype=np.int64),
+            'set_player1_games': np.array([player1_games for _, player1_games in set_scores], dtype=np.int64),
+            'is_player0_serving': np.array(tables['is_player0_serving'], dtype=np.bool_),
+            'start': np.array(tables['start'], dtype=np.int64),
+            'match_over': tables['match_over']}
+
+
+@njit(cache=True)
+def _play_matches_kernel(next_state, set_player0_games, set_player1_games, is_player0_serving, start, match_over,
+                         player0_serve_win_probability, player1_serve_win_probability, is_antithetic, uniforms,
+                         match, state, is_player0_first_server, match_winner, set_scores, n_sets, points_played):
+    """
+    Plays matches one after another from uniforms, as stochastic_simulation_match does: a number for the first server
+    and then one per point. Stops when the matches are finished or the numbers run out, and returns the match and
+    state reached (-1 before the first server is drawn) and the numbers used, to carry on from with the next block
+    """
+    position = 0
+    while match < len(player0_serve_win_probability):
+        if state < 0:
+            if position == len(uniforms):
+                return match, state, position
+            uniform = 1 - uniforms[position] if is_antithetic else uniforms[position]
+            position += 1
+            is_player0_first_server[match] = uniform < 0.5
+            state = start[1] if is_player0_first_server[match] else start[0]
+        player0_receive_win_probability = 1 - player1_serve_win_probability[match]
+        while state < match_over:
+            if position == len(uniforms):
+                return match, state, position
+            uniform = 1 - uniforms[position] if is_antithetic else uniforms[position]
+            position += 1
+            if is_player0_serving[state]:
+                is_player0_point_winner = uniform < player0_serve_win_probability[match]
+            else:
+                is_player0_point_winner = uniform < player0_receive_win_probability
+            transition = 2 * state + 1 if is_player0_point_winner else 2 * state
+            state = next_state[transition]
+            points_played[match] += 1
+            if set_player0_games[transition] >= 0:
+                set_scores[match, n_sets[match], 0] = set_player0_games[transition]
+                set_scores[match, n_sets[match], 1] = set_player1_games[transition]
+                n_sets[match] += 1
+        match_winner[match] = state - match_over
+        match += 1
+        state = -1
+    return match, state, position
+
+
+def play_matches_compiled(player0_serve_win_probabilities, player1_serve_win_probabilities, rng, match_format=None,
+                          is_antithetic=False):
+    """
+    Plays a match for each pair of serve win probabilities with the compiled kernel. Gives the same matches as calling
+    stochastic_simulation_match for each pair in turn with the same UniformStream.
+
+    :param player0_serve_win_probabilities: Probability player 0 wins a point on their serve, one per match
+    :param player1_serve_win_probabilities: Probability player 1 wins a point on their serve, one per match
+    :param rng: tennistools.simulation.UniformStream to draw the random numbers from
+    :param match_format: The tennistools.MatchFormat of the matches, BEST_OF_FIVE by default
+    :param is_antithetic: Whether to use 1 - u in place of each random number u (see antithetic_draws)
+    :return: list of tuples of the MatchStateResult (without points) and whether player 0 served first, as
+    stochastic_simulation_match_states returns
+    """
+    tables = kernel_tables(BEST_OF_FIVE if match_format is None else match_format)
+    player0_serve_win_probabilities = np.asarray(player0_serve_win_probabilities, dtype=float).reshape(-1)
+    player1_serve_win_probabilities = np.asarray(player1_serve_win_probabilities, dtype=float).reshape(-1)
+    n_matches = len(player0_serve_win_probabilities)
+    max_sets = 2 * (BEST_OF_FIVE if match_format is None else match_format).sets_required - 1
+    is_player0_first_server = np.zeros(n_matches, dtype=np.bool_)
+    match_winner = np.zeros(n_matches, dtype=np.int64)
+    set_scores = np.zeros((n_matches, max_sets, 2), dtype=np.int64)
+    n_sets = np.zeros(n_matches, dtype=np.int64)
+    points_played = np.zeros(n_matches, dtype=np.int64)
+
+    match, state = 0, -1
+    while match < n_matches:
+        match, state, n_used = _play_matches_kernel(
+            tables['next_state'], tables['set_player0_games'], tables['set_player1_games'],
+            tables['is_player0_serving'], tables['start'], tables['match_over'], player0_serve_win_probabilities,
+            player1_serve_win_probabilities, is_antithetic, rng.peek_block(), match, state, is_player0_first_server,
+            match_winner, set_scores, n_sets, points_played)
+        rng.advance(n_used)
+
+    return [(MatchStateResult(winner, [tuple(set_score) for set_score in match_set_scores[:sets]], points, None),
+             is_first_server)
+            for winner, match_set_scores, sets, points, is_first_server in zip(
+                match_winner.tolist(), set_scores.tolist(), n_sets.tolist(), points_played.tolist(),
+                is_player0_first_server.tolist())]
+
+
+@njit(cache=True)
+def _competitions_kernel(win_probability, slots, uniforms, is_antithetic, reach_counts):
+    """
+    Plays competitions one after another from uniforms, as simulate_competition does with a match probability cache:
+    one number per match that is not a bye, round by round in bracket order, adding up how often each player reached
+    each round. Player 0 of every match is the player earlier in the draw, and win_probability[i, j] is the
+    probability player i beats player j for i < j
+    """
+    n_slots = len(slots)
+    remaining = np.empty(n_slots, dtype=np.int64)
+    position = 0
+    while position < len(uniforms):
+        remaining[:] = slots
+        n_remaining = n_slots
+        round_number = 0
+        while n_remaining > 1:
+            round_number += 1
+            for i in range(n_remaining // 2):
+                player0, player1 = remaining[2 * i], remaining[2 * i + 1]
+                if player1 < 0:
+                    winner = player0
+                else:
+                    uniform = 1 - uniforms[position] if is_antithetic else uniforms[position]
+                    position += 1
+                    winner = player0 if uniform < win_probability[player0, player1] else player1
+                remaining[i] = winner
+                reach_counts[round_number, winner] += 1
+            n_remaining //= 2
+    return reach_counts
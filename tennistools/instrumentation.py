@@ -0,0 +1,132 @@
+#########################################################################################################
+### Instrumentation
+### Optional counters and timings from inside the simulation functions, to see whether the time of a run goes
+### on the point win probability function, the random numbers or the score keeping, and how many points,
+### games, tiebreaks, sets and matches were played. Nothing is collected unless it is switched on, e.g.
+###     with instrumented() as collector:
+###         simulate_competition(playerlist, probability_model)
+###     print(collector.as_dict())
+###     pstats.Stats(collector).sort_stats('cumulative').print_stats()
+#########################################################################################################
+
+import marshal
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# The Instrumentation collecting counters and timings, or None when instrumentation is switched off. The simulation
+# functions check it once per point (or once per batch step), which is all they cost when it is off
+collector = None
+
+
+class Instrumentation(object):
+    """
+    A class to collect counters and timings of phases of a simulation
+
+    Attributes
+    ---------
+    counters: dictionary of counter name to count, e.g. points, games, tiebreaks, sets, matches
+    timings: dictionary of phase name to [number of calls, total seconds]. Phases can be nested, e.g.
+    competition_round includes the probability_function, random and score_keeping time of its matches
+    stats: the timings in the format of cProfile.Profile.stats (set by create_stats) so pstats.Stats can read it
+
+    Methods
+    ---------
+    count(name, n): adds n to a counter
+    add_time(phase, seconds, calls): adds to the timing of a phase
+    timer(phase): context manager timing a block of code as a phase
+    as_dict: the counters and timings as a dictionary
+    create_stats: sets stats, called by pstats.Stats
+    dump_stats(path): saves stats in the format of cProfile.Profile.dump_stats
+    reset: clears the counters and timings
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.timings = {}
+        self.stats = {}
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, phase, seconds, calls=1):
+        timing = self.timings.setdefault(phase, [0, 0.0])
+        timing[0] += calls
+        timing[1] += seconds
+
+    def seconds(self, phase):
+        """Total seconds recorded for a phase so far"""
+        return self.timings.get(phase, [0, 0.0])[1]
+
+    @contextmanager
+    def timer(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def as_dict(self):
+        return {'counters': dict(self.counters),
+                'timings': {phase: {'calls': calls, 'seconds': seconds}
+                            for phase, (calls, seconds) in self.timings.items()}}
+
+    def create_stats(self):
+        """Sets stats to the timings in the format of cProfile, one function entry per phase"""
+        self.stats = {('tennistools', 0, phase): (calls, calls, seconds, seconds, {})
+                      for phase, (calls, seconds) in self.timings.items()}
+
+    def dump_stats(self, path):
+        """Saves the timings to a file pstats.Stats can load, like cProfile.Profile.dump_stats"""
+        self.create_stats()
+        with open(path, 'wb') as f:
+            marshal.dump(self.stats, f)
+
+    def reset(self):
+        self.counters.clear()
+        self.timings.clear()
+        self.stats = {}
+
+
+def enable(instrumentation=None):
+    """Switches instrumentation on, collecting into instrumentation (a new Instrumentation if None), and returns it"""
+    global collector
+    collector = Instrumentation() if instrumentation is None else instrumentation
+    return collector
+
+
+def disable():
+    """Switches instrumentation off and returns the Instrumentation that was collecting, if any"""
+    global collector
+    instrumentation, collector = collector, None
+    return instrumentation
+
+
+@contextmanager
+def instrumented(instrumentation=None):
+    """Context manager that switches instrumentation on for a block of code and yields the Instrumentation. Whatever
+    was collecting before is put back afterwards"""
+    global collector
+    previous = collector
+    instrumentation = enable(instrumentation)
+    try:
+        yield instrumentation
+    finally:
+        collector = previous
+
+
+def timed(phase, counter=None):
+    """Decorator that records the time of each call of a function as a phase, and counts the calls in counter, when
+    instrumentation is on. Only for functions called a few times per match or less, e.g. a competition round"""
+    def decorator(function):
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            if collector is None:
+                return function(*args, **kwargs)
+            instrumentation = collector
+            if counter is not None:
+                instrumentation.count(counter)
+            with instrumentation.timer(phase):
+                return function(*args, **kwargs)
+        return timed_function
+    return decorator
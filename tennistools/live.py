@@ -0,0 +1,74 @@
+#########################################################################################################
+### Live probabilities
+### The probability player 0 wins a match from the current score of a match in play, to re-price after
+### every point. The score is read from a Tmatch, or given as a compact score tuple of
+###     (player0_sets, player1_sets, player0_games, player1_games, player0_points, player1_points,
+###      is_player0_server)
+### where is_player0_server is whether player 0 served the first point of the current game (or tiebreak).
+#########################################################################################################
+
+from tennistools import Tmatch, TmatchSnapshot, BEST_OF_FIVE
+from tennistools.simulation import is_serve_probability_function, stochastical_simulation_next_point
+from tennistools.solver import match_win_probability_from_score
+
+
+def score_state(tmatch):
+    """Returns the score tuple of a Tmatch"""
+    return tuple(tmatch.snapshot()[:7])
+
+
+def tmatch_from_score(score, set_scores=None, keep_history=False, match_format=None):
+    """
+    Returns a Tmatch at the given score, ready to carry on playing (see Tmatch.from_snapshot).
+
+    :param score: score tuple (see score_state)
+    :param set_scores: games won by player 0, player 1 in each completed set, if known
+    :param keep_history: Whether to keep the sets, games and points played from this score on
+    :param match_format: The tennistools.MatchFormat of the match, BEST_OF_FIVE by default
+    """
+    if match_format is None:
+        match_format = BEST_OF_FIVE
+    player0_sets, player1_sets, player0_games, player1_games, _, _, _ = score
+    is_tiebreak = match_format.is_tiebreak_score[player0_games][player1_games] or \
+        (match_format.match_tiebreak_points is not None and match_format.is_deciding_set(player0_sets, player1_sets))
+    snapshot = TmatchSnapshot(*score, is_tiebreak, tuple(set_scores) if set_scores is not None else (), 0)
+    return Tmatch.from_snapshot(snapshot, keep_history, match_format)
+
+
+def live_win_probability(player0_win_probability_function, tmatch, player0=None, player1=None, n_samples=1000,
+                         match_format=None, **kwargs):
+    """
+    Returns the probability player 0 wins a match in play from its current score.
+
+    If player0_win_probability_function was created with serve_probability_function and the match is best of five
+    sets the probability is exact (see
+    tennistools.solver.match_win_probability_from_score), and takes microseconds for serve probabilities seen recently
+    and around a millisecond for a new pair. Otherwise it is the fraction of n_samples matches won by
+    player 0 when playing on from the score, each restored without history from a snapshot (see Tmatch.from_snapshot)
+    rather than a copy of the match.
+
+    :param player0_win_probability_function: A function that takes TMatch, player0, player1 as inputs and returns
+    a probability
+    :param tmatch: The Tmatch in play, or its score tuple (see score_state)
+    :param match_format: The tennistools.MatchFormat of a score tuple, BEST_OF_FIVE by default. A Tmatch has its own
+    :param kwargs: Any other features that are used in the player0_win_probability_function
+    """
+    if isinstance(tmatch, Tmatch):
+        snapshot = tmatch.snapshot()
+        match_format = tmatch.match_format
+    else:
+        snapshot = tmatch_from_score(tmatch, match_format=match_format).snapshot()
+        match_format = BEST_OF_FIVE if match_format is None else match_format
+
+    if is_serve_probability_function(player0_win_probability_function) and match_format == BEST_OF_FIVE:
+        serve_win_probabilities = player0_win_probability_function.serve_probabilities(player0, player1, **kwargs)
+        return match_win_probability_from_score(*serve_win_probabilities, *snapshot[:7])
+
+    player0_wins = 0
+    for _ in range(n_samples):
+        simulated_match = Tmatch.from_snapshot(snapshot, match_format=match_format)
+        while not simulated_match.is_match_over():
+            stochastical_simulation_next_point(simulated_match, player0_win_probability_function, player0, player1,
+                                               **kwargs)
+        player0_wins += simulated_match.match_winner == 0
+    return player0_wins / n_samples
@@ -0,0 +1,156 @@
+#########################################################################################################
+### Match probability cache
+### In a competition the same pairings are played again and again, across rounds and across replications.
+### MatchProbabilityCache keeps the probability each pairing is won by player 0 so it is worked out once, and
+### a round can then be decided with a single random number per match.
+#########################################################################################################
+
+from collections import OrderedDict
+
+import numpy as np
+
+from tennistools import BEST_OF_FIVE
+from tennistools.simulation import is_serve_probability_function, stochastic_simulation_matches
+from tennistools.solver import match_win_probability, match_win_probabilities
+
+
+def _freeze(value):
+    """Turns a player (or keyword argument) into something hashable that compares equal for equal parameters"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, set):
+        return frozenset(_freeze(item) for item in value)
+    if isinstance(value, np.ndarray):
+        return (value.dtype.str, value.shape, value.tobytes())
+    return value
+
+
+class MatchProbabilityCache(object):
+    """
+    A least recently used cache of the probability player 0 wins a match against player 1
+
+    The key is the point win probability function together with the parameters of both players and any keyword
+    arguments, so the same cache can be shared between models, player lists and match formats. Functions created with
+    serve_probability_function are solved exactly (see tennistools.solver.match_win_probability) for best of five set
+    matches. Other functions and formats can only be used if allow_sampled is True, when the probability is the fraction of n_samples simulated matches that
+    player 0 won. That estimate is then reused for every lookup, so its error does not average out over replications.
+
+    Attributes
+    ---------
+    maxsize: Maximum number of pairings kept. The least recently used pairing is dropped when it is full
+    allow_sampled: Whether pairings that cannot be solved exactly are estimated by simulation
+    n_samples: Number of matches simulated for a pairing that cannot be solved exactly
+    hits: Number of lookups found in the cache
+    misses: Number of lookups that had to be worked out
+
+    Methods
+    ---------
+    can_calculate(player0_win_probability_function, match_format): whether the cache can give probabilities for the
+    function and format
+    get(player0_win_probability_function, player0, player1, match_format, **kwargs): probability player 0 wins the
+    match
+    get_many(player0_win_probability_function, players0, players1, match_format, **kwargs): array of the probability
+    player 0 wins each match, solving the pairings not in the cache together
+    cache_info: dictionary of hits, misses, maxsize and currsize
+    clear: empties the cache and resets hits and misses
+    """
+
+    def __init__(self, maxsize=65536, allow_sampled=False, n_samples=1000):
+        self.maxsize = maxsize
+        self.allow_sampled = allow_sampled
+        self.n_samples = n_samples
+        self.hits = 0
+        self.misses = 0
+        self._probabilities = OrderedDict()
+
+    def __len__(self):
+        return len(self._probabilities)
+
+    def can_calculate(self, player0_win_probability_function, match_format=None):
+        """Whether the function can be solved exactly in the format (None is BEST_OF_FIVE), or estimated by simulation
+        if allow_sampled"""
+        return self.allow_sampled or (is_serve_probability_function(player0_win_probability_function) and
+                                      match_format in (None, BEST_OF_FIVE))
+
+    def get(self, player0_win_probability_function, player0, player1, match_format=None, **kwargs):
+        """Returns the probability player0 wins the match, working it out if the pairing is not in the cache. Raises
+        ValueError if the function cannot be solved exactly and allow_sampled is False"""
+        match_format = self._check(player0_win_probability_function, match_format)
+        key = (player0_win_probability_function, _freeze(player0), _freeze(player1), match_format, _freeze(kwargs))
+        probability = self._lookup(key)
+        if probability is not None:
+            return probability
+
+        self.misses += 1
+        probability = self._calculate(player0_win_probability_function, player0, player1, match_format, **kwargs)
+        self._store(key, probability)
+        return probability
+
+    def get_many(self, player0_win_probability_function, players0, players1, match_format=None, **kwargs):
+        """get for each pairing of players0[i] and players1[i]. The pairings that are solved exactly and not in the
+        cache are solved together with tennistools.solver.match_win_probabilities rather than one at a time"""
+        match_format = self._check(player0_win_probability_function, match_format)
+        if not (is_serve_probability_function(player0_win_probability_function) and match_format == BEST_OF_FIVE):
+            return np.array([self.get(player0_win_probability_function, player0, player1, match_format, **kwargs)
+                             for player0, player1 in zip(players0, players1)], dtype=float)
+
+        frozen_kwargs = _freeze(kwargs)
+        keys = [(player0_win_probability_function, _freeze(player0), _freeze(player1), match_format, frozen_kwargs)
+                for player0, player1 in zip(players0, players1)]
+        probabilities = {}
+        missing = OrderedDict()
+        for key, player0, player1 in zip(keys, players0, players1):
+            if key in probabilities or key in missing:
+                continue
+            probability = self._lookup(key)
+            if probability is None:
+                missing[key] = player0_win_probability_function.serve_probabilities(player0, player1, **kwargs)
+            else:
+                probabilities[key] = probability
+
+        if missing:
+            self.misses += len(missing)
+            serve_win_probabilities = np.array(list(missing.values()), dtype=float)
+            solved = match_win_probabilities(serve_win_probabilities[:, 0], serve_win_probabilities[:, 1])
+            for key, probability in zip(missing, solved.tolist()):
+                probabilities[key] = probability
+                self._store(key, probability)
+        return np.array([probabilities[key] for key in keys], dtype=float)
+
+    def _check(self, player0_win_probability_function, match_format):
+        if not self.can_calculate(player0_win_probability_function, match_format):
+            raise ValueError('Match win probabilities can only be solved exactly for best of five set matches with '
+                             'functions created with serve_probability_function, set allow_sampled to estimate them '
+                             'by simulation')
+        return BEST_OF_FIVE if match_format is None else match_format
+
+    def _lookup(self, key):
+        probability = self._probabilities.get(key)
+        if probability is not None:
+            self.hits += 1
+            self._probabilities.move_to_end(key)
+        return probability
+
+    def _store(self, key, probability):
+        self._probabilities[key] = probability
+        if len(self._probabilities) > self.maxsize:
+            self._probabilities.popitem(last=False)
+
+    def _calculate(self, player0_win_probability_function, player0, player1, match_format, **kwargs):
+        if is_serve_probability_function(player0_win_probability_function) and match_format == BEST_OF_FIVE:
+            return match_win_probability(*player0_win_probability_function.serve_probabilities(player0, player1,
+                                                                                                **kwargs))
+        tmatches = stochastic_simulation_matches(player0_win_probability_function, [player0] * self.n_samples,
+                                                 [player1] * self.n_samples, keep_history=False,
+                                                 match_format=match_format, **kwargs)
+        return sum(tmatch.match_winner == 0 for tmatch in tmatches) / self.n_samples
+
+    def cache_info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'maxsize': self.maxsize, 'currsize': len(self)}
+
+    def clear(self):
+        self._probabilities.clear()
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,476 @@
+#########################################################################################################
+### Monte Carlo functions
+### These functions repeat simulate_competition many times and keep only compact results: how often each
+### player reached each round of the competition. Replications can be streamed one at a time from
+### iterate_competitions and summarised in constant memory with CompetitionAggregator.
+#########################################################################################################
+
+import math
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count, islice
+
+import numpy as np
+
+from tennistools import simulation
+from tennistools.compiled import HAS_NUMBA, _competitions_kernel
+from tennistools.simulation import UniformStream, random_stream, _uniform
+from tennistools.single_elimination_competition import simulate_competition, calculate_rounds_won, \
+    calculate_bracket_slots
+
+
+def iterate_competitions(playerlist, player0_win_probability_function, n_replications=None, seed=None,
+                         common_random_numbers=False, antithetic=False, **kwargs):
+    """
+    Generator that simulates a competition n_replications times, yielding a compact record of each replication.
+    Only one competition is held in memory at a time.
+
+    :param playerlist: A list of dictionary objects that represent a player.
+    :param player0_win_probability_function: A function that takes TMatch, player0, player1 as inputs and returns
+    a probability
+    :param n_replications: Number of competitions to simulate. If None, the generator never ends
+    :param seed: Seed (or numpy.random.SeedSequence) for the random streams of the generator, which are its own
+    (see tennistools.simulation.UniformStream), so the global numpy random state is not used. If None, fresh entropy is
+    used
+    :param common_random_numbers: If True, each replication gets its own random stream spawned from the seed, so
+    replication i of two runs with the same seed starts from the same random numbers even if the players or the model
+    differ. Comparing scenarios replication by replication then has a far lower variance (see compare_scenarios).
+    Needs a seed
+    :param antithetic: If True, replications are simulated in pairs, each pair from its own random stream spawned from
+    the seed and the second of the pair from the antithetic copy of the stream (1 - u for every number u). The pairs
+    are negatively correlated, so averages have a lower variance (and confidence intervals that treat the replications
+    as independent are conservative)
+    :param kwargs: Any other features that are used in the player0_win_probability_function
+    :return: yields dictionaries of
+        winner: position of the winner in playerlist
+        rounds_won: int8 array of the number of rounds won by each player (see calculate_rounds_won)
+        games: total games played, or None if the results do not include set scores
+        points: total points played, or None if the results do not include points
+    """
+    if seed is None:
+        if common_random_numbers:
+            raise ValueError('Common random numbers need a seed')
+        seed = np.random.SeedSequence()
+    elif not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+
+    rng = UniformStream(seed)
+    replications = count() if n_replications is None else range(n_replications)
+    for replication in replications:
+        if common_random_numbers or antithetic:
+            # The second of an antithetic pair draws 1 - u from the stream of the first
+            stream = replication // 2 if antithetic else replication
+            rng = UniformStream(np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (stream,)),
+                                is_antithetic=antithetic and replication % 2 == 1)
+        _, match_history = simulate_competition(playerlist, player0_win_probability_function, results_only=True,
+                                                rng=rng, **kwargs)
+        yield _competition_record(playerlist, match_history)
+
+
+def _competition_record(playerlist, match_history):
+    rounds_won = calculate_rounds_won(playerlist, match_history).astype(np.int8)
+    matches = [match for round_matches in match_history.values() for match in round_matches.values()]
+    games = points = None
+    if all('set_scores' in match for match in matches):
+        games = sum(player0_games + player1_games for match in matches for player0_games, player1_games in
+                    match['set_scores'])
+    if all('points_played' in match for match in matches):
+        points = sum(match['points_played'] for match in matches)
+    return {'winner': int(np.argmax(rounds_won)), 'rounds_won': rounds_won, 'games': games, 'points': points}
+
+
+def _normal_quantile(probability):
+    """Inverse of the standard normal distribution function, by bisection"""
+    low, high = -40.0, 40.0
+    for _ in range(100):
+        middle = (low + high) / 2
+        if 0.5 * (1 + math.erf(middle / math.sqrt(2))) < probability:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def proportion_confidence_interval(successes, n, confidence=0.95):
+    """
+    Wilson score confidence interval of a proportion, which stays within [0, 1] and is not empty for proportions of
+    0 or 1.
+
+    :param successes: Number of successes, a number or an array
+    :param n: Number of trials
+    :return: tuple of lower and upper bounds
+    """
+    z = _normal_quantile(0.5 + confidence / 2)
+    proportion = np.asarray(successes, dtype=float) / n
+    centre = (proportion + z ** 2 / (2 * n)) / (1 + z ** 2 / n)
+    half_width = z / (1 + z ** 2 / n) * np.sqrt(proportion * (1 - proportion) / n + z ** 2 / (4 * n ** 2))
+    return centre - half_width, centre + half_width
+
+
+class RunningMoments(object):
+    """
+    A class to keep the mean and variance of a stream of numbers (or of equally shaped arrays, element by element) in
+    constant memory (Welford's method)
+
+    Attributes
+    ---------
+    n: number of values
+    mean: mean of the values
+    variance: sample variance of the values (0 until there are 2 values)
+
+    Methods
+    ---------
+    update(value): adds a value
+    confidence_interval(confidence): normal confidence interval of the mean
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._sum_squared_deviations = 0.0
+
+    def update(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self._sum_squared_deviations += delta * (value - self.mean)
+
+    @property
+    def variance(self):
+        return self._sum_squared_deviations / (self.n - 1) if self.n > 1 else 0.0
+
+    def confidence_interval(self, confidence=0.95):
+        half_width = _normal_quantile(0.5 + confidence / 2) * np.sqrt(self.variance / self.n)
+        return self.mean - half_width, self.mean + half_width
+
+
+class CompetitionAggregator(object):
+    """
+    A class to summarise the records of iterate_competitions in constant memory
+
+    Attributes
+    ---------
+    n: number of replications
+    reach_counts: array of shape (rounds + 1) x n_players of counts of each player reaching each round, the last row
+    is the count of competition wins
+    games: RunningMoments of the total games played in a competition
+    points: RunningMoments of the total points played in a competition
+
+    Methods
+    ---------
+    update(record): adds a record from iterate_competitions
+    update_all(records): adds every record of an iterable, e.g. iterate_competitions, and returns self
+    win_counts: number of competitions won by each player
+    reach_probabilities: reach_counts / n
+    win_probabilities: probability of each player winning the competition
+    win_confidence_intervals(confidence): confidence intervals of win_probabilities
+    reach_confidence_intervals(confidence): confidence intervals of reach_probabilities
+    """
+
+    def __init__(self, n_players):
+        rounds = math.ceil(math.log2(n_players))
+        self.n = 0
+        self.reach_counts = np.zeros((rounds + 1, n_players), dtype=np.int64)
+        self._rounds = np.arange(rounds + 1)[:, None]
+        self.games = RunningMoments()
+        self.points = RunningMoments()
+
+    def update(self, record):
+        self.n += 1
+        self.reach_counts += record['rounds_won'] >= self._rounds
+        if record['games'] is not None:
+            self.games.update(record['games'])
+        if record['points'] is not None:
+            self.points.update(record['points'])
+
+    def update_all(self, records):
+        for record in records:
+            self.update(record)
+        return self
+
+    @property
+    def win_counts(self):
+        return self.reach_counts[-1]
+
+    @property
+    def reach_probabilities(self):
+        return self.reach_counts / self.n
+
+    @property
+    def win_probabilities(self):
+        return self.win_counts / self.n
+
+    def win_confidence_intervals(self, confidence=0.95):
+        return proportion_confidence_interval(self.win_counts, self.n, confidence)
+
+    def reach_confidence_intervals(self, confidence=0.95):
+        return proportion_confidence_interval(self.reach_counts, self.n, confidence)
+
+
+def simulate_competition_adaptive(playerlist, player0_win_probability_function, tolerance=0.01, confidence=0.95,
+                                  batch_size=100, max_replications=100000, seed=None, **kwargs):
+    """
+    Simulates a competition in batches of batch_size replications until the confidence interval of every player's
+    probability of winning the competition is narrower than tolerance, or max_replications is reached.
+
+    :param playerlist: A list of dictionary objects that represent a player.
+    :param player0_win_probability_function: A function that takes TMatch, player0, player1 as inputs and returns
+    a probability
+    :param tolerance: Largest width (upper - lower bound) of the confidence intervals at which to stop
+    :param confidence: Confidence level of the intervals (see proportion_confidence_interval)
+    :param batch_size: Number of replications between checks of the intervals
+    :param max_replications: Largest number of replications to simulate
+    :param seed: Seed for the random stream (see iterate_competitions). If None, fresh entropy is used
+    :param kwargs: Any other features that are used in the player0_win_probability_function
+    :return: tuple of the CompetitionAggregator of the replications (its n is the number of replications used) and
+    whether the tolerance was reached
+    """
+    aggregator = CompetitionAggregator(len(playerlist))
+    records = iterate_competitions(playerlist, player0_win_probability_function, max_replications, seed, **kwargs)
+    while aggregator.n < max_replications:
+        aggregator.update_all(islice(records, batch_size))
+        lower, upper = aggregator.win_confidence_intervals(confidence)
+        if (upper - lower).max() < tolerance:
+            return aggregator, True
+    return aggregator, False
+
+
+def compare_scenarios(scenarios, player0_win_probability_function, n_replications, seed, antithetic=False, **kwargs):
+    """
+    Simulates each scenario n_replications times with common random numbers (see iterate_competitions), so differences
+    between the scenarios are estimated from paired replications rather than independent runs.
+    The random streams stay in step best when each match uses the same number of random numbers whatever its result,
+    i.e. with a match_probability_cache in kwargs, where a match is one random number. Played point by point, the
+    streams of two scenarios drift apart once a match in one lasts longer than in the other.
+
+    :param scenarios: A list of player lists, one per scenario, all the same length (e.g. the same players with one
+    player's attack changed)
+    :param player0_win_probability_function: A function that takes TMatch, player0, player1 as inputs and returns
+    a probability
+    :param n_replications: Number of competitions to simulate for each scenario
+    :param seed: Seed for the random streams, shared by every scenario
+    :param antithetic: Whether replications are simulated in antithetic pairs (see iterate_competitions)
+    :param kwargs: Any other features that are used in the player0_win_probability_function
+    :return: tuple of a CompetitionAggregator for each scenario, and a RunningMoments for each scenario of the
+    difference from the first scenario of whether each player reached each round ((rounds + 1) x n arrays, the last
+    row is winning the competition). With antithetic pairs, each value of the RunningMoments is the average of a pair
+    """
+    records = zip(*[iterate_competitions(playerlist, player0_win_probability_function, n_replications, seed,
+                                         common_random_numbers=True, antithetic=antithetic, **kwargs)
+                    for playerlist in scenarios])
+    aggregators = [CompetitionAggregator(len(playerlist)) for playerlist in scenarios]
+    differences = [RunningMoments() for _ in scenarios]
+    rounds = aggregators[0]._rounds
+    pair = []
+    for replication, scenario_records in enumerate(records):
+        for aggregator, record in zip(aggregators, scenario_records):
+            aggregator.update(record)
+        reached = [(record['rounds_won'] >= rounds).astype(float) for record in scenario_records]
+        pair.append([scenario_reached - reached[0] for scenario_reached in reached])
+        if not antithetic or replication % 2 == 1:
+            for moments, scenario_differences in zip(differences, zip(*pair)):
+                moments.update(sum(scenario_differences) / len(pair))
+            pair = []
+    return aggregators, differences
+
+
+def simulate_competition_stratified(playerlist, player0_win_probability_function, match_probability_cache,
+                                    n_replications, rng=None, **kwargs):
+    """
+    Simulates a competition n_replications times, all at once, deciding each match from its cached win probability
+    (see tennistools.match_cache.MatchProbabilityCache) with stratified random numbers. For each match of the bracket,
+    the n_replications uniform random numbers are one from each of n_replications equal strata of [0, 1), in a random
+    order, rather than independent. The reach probabilities have a lower variance than independent replications.
+
+    :param playerlist: A list of dictionary objects that represent a player.
+    :param player0_win_probability_function: A function that the cache can calculate probabilities for (see
+    MatchProbabilityCache.can_calculate)
+    :param match_probability_cache: The MatchProbabilityCache
+    :param n_replications: Number of competitions to simulate
+    :param rng: A seed, numpy Generator or tennistools.simulation.UniformStream to draw the random numbers from, the
+    global numpy random state if None
+    :param kwargs: Any other features that are used in the player0_win_probability_function
+    :return: array of shape (rounds + 1) x n of counts of each player reaching each round (as
+    simulate_competition_parallel)
+    """
+    if not match_probability_cache.can_calculate(player0_win_probability_function):
+        raise ValueError('The match probability cache cannot calculate probabilities for this function')
+    rng = random_stream(rng)
+    n_players = len(playerlist)
+    slots = calculate_bracket_slots(n_players)
+    rounds = int(math.log2(len(slots)))
+    reach_counts = np.zeros((rounds + 1, n_players), dtype=int)
+    reach_counts[0] = n_replications
+
+    # Players still in the competition, a row per replication and a column per bracket position. Byes are -1
+    remaining = np.tile(slots, (n_replications, 1))
+    for round_number in range(rounds):
+        players0, players1 = remaining[:, ::2], remaining[:, 1::2]
+        win_probability = np.ones(players0.shape)
+        is_match = players1 >= 0
+        pairings, pairing_index = np.unique(players0[is_match] * n_players + players1[is_match], return_inverse=True)
+        pairing_probability = np.array([match_probability_cache.get(player0_win_probability_function,
+                                                                    playerlist[pairing // n_players],
+                                                                    playerlist[pairing % n_players], **kwargs)
+                                        for pairing in pairings.tolist()])
+        win_probability[is_match] = pairing_probability[pairing_index.ravel()]
+
+        strata = np.argsort(_uniform(size=players0.shape, rng=rng), axis=0)
+        uniforms = (strata + _uniform(size=players0.shape, rng=rng)) / n_replications
+        remaining = np.where(uniforms < win_probability, players0, players1)
+        reach_counts[round_number + 1] = np.bincount(remaining.ravel(), minlength=n_players)
+    return reach_counts
+
+
+def cached_win_probability_matrix(playerlist, player0_win_probability_function, match_probability_cache,
+                                  match_format=None, **kwargs):
+    """Matrix of the probability player i beats player j, from the cache (see
+    tennistools.match_cache.MatchProbabilityCache.get_many, which solves the pairings not in the cache together).
+    Entries with i < j are looked up and the rest mirrored, [j, i] = 1 - [i, j], with 0.5 on the diagonal"""
+    n_players = len(playerlist)
+    players0, players1 = np.triu_indices(n_players, 1)
+    win_probability = np.full((n_players, n_players), 0.5)
+    win_probability[players0, players1] = match_probability_cache.get_many(
+        player0_win_probability_function, [playerlist[i] for i in players0.tolist()],
+        [playerlist[j] for j in players1.tolist()], match_format, **kwargs)
+    win_probability[players1, players0] = 1 - win_probability[players0, players1]
+    return win_probability
+
+
+def simulate_competition_cached(playerlist, player0_win_probability_function, match_probability_cache,
+                                n_replications, rng, match_format=None, is_compiled=None, **kwargs):
+    """
+    Simulates a competition n_replications times, deciding every match from its cached win probability as
+    simulate_competition does with a match_probability_cache, and counts how often each player reached each round.
+    If Numba is installed the competitions are played by a compiled kernel (see tennistools.compiled), otherwise by
+    simulate_competition. Both give the same counts from the same random stream.
+
+    :param playerlist: A list of dictionary objects that represent a player.
+    :param player0_win_probability_function: A function that the cache can calculate probabilities for (see
+    MatchProbabilityCache.can_calculate)
+    :param match_probability_cache: The MatchProbabilityCache
+    :param n_replications: Number of competitions to simulate
+    :param rng: A seed, numpy Generator or tennistools.simulation.UniformStream to draw the random numbers from
+    :param match_format: The tennistools.MatchFormat of the matches, BEST_OF_FIVE by default
+    :param is_compiled: Whether to use the compiled kernel. By default it is used if Numba is installed
+    :param kwargs: Any other features that are used in the player0_win_probability_function
+    :return: array of shape (rounds + 1) x n of counts of each player reaching each round (as
+    simulate_competition_parallel)
+    """
+    if not match_probability_cache.can_calculate(player0_win_probability_function, match_format):
+        raise ValueError('The match probability cache cannot calculate probabilities for this function')
+    if rng is None:
+        raise ValueError('simulate_competition_cached needs a seed, Generator or UniformStream')
+    if is_compiled is None:
+        is_compiled = HAS_NUMBA
+    rng = random_stream(rng)
+    n_players = len(playerlist)
+
+    if not is_compiled:
+        aggregator = CompetitionAggregator(n_players)
+        for _ in range(n_replications):
+            _, match_history = simulate_competition(playerlist, player0_win_probability_function, results_only=True,
+                                                    match_probability_cache=match_probability_cache, rng=rng,
+                                                    match_format=match_format, **kwargs)
+            aggregator.update(_competition_record(playerlist, match_history))
+        return aggregator.reach_counts
+
+    win_probability = cached_win_probability_matrix(playerlist, player0_win_probability_function,
+                                                    match_probability_cache, match_format, **kwargs)
+    reach_counts = np.zeros((math.ceil(math.log2(n_players)) + 1, n_players), dtype=np.int64)
+    reach_counts[0] = n_replications
+    # Every player but the winner loses one match, so a competition takes one random number per player less one
+    uniforms = rng.take(n_replications * (n_players - 1))
+    return _competitions_kernel(win_probability, calculate_bracket_slots(n_players).astype(np.int64), uniforms,
+                                simulation._is_antithetic, reach_counts)
+
+
+def simulate_competition_vectorized(playerlist, win_probability_matrix, n_replications, rng=None, batch_size=8192):
+    """
+    Simulates a competition n_replications times from a matrix of match win probabilities, with the brackets of a
+    batch of replications held as one array. Each row is a replication and each column a position in the bracket,
+    holding the player there, and a round decides every match of every replication at once. Byes are placed as in
+    calculate_bye_rounds and always lose.
+
+    :param playerlist: A list of dictionary objects that represent a player, in the order given to simulate_competition
+    :param win_probability_matrix: n x n array where entry [i, j] is the probability player i beats player j (as
+    calculate_competition_probabilities). Player i always comes before player j in the bracket, so only entries with
+    i < j are used and cached_win_probability_matrix can be given
+    :param n_replications: Number of competitions to simulate
+    :param rng: A seed, numpy Generator or tennistools.simulation.UniformStream to draw the random numbers from, the
+    global numpy random state if None
+    :param batch_size: Number of replications played together, small enough for the arrays to stay in cache
+    :return: array of shape (rounds + 1) x n of counts of each player reaching each round (as
+    simulate_competition_parallel)
+    """
+    n_players = len(playerlist)
+    win_probability = np.asarray(win_probability_matrix, dtype=float).ravel()
+    rng = random_stream(rng)
+    slots = calculate_bracket_slots(n_players).astype(np.int32)
+    rounds = int(math.log2(len(slots)))
+    reach_counts = np.zeros((rounds + 1, n_players), dtype=np.int64)
+    reach_counts[0] = n_replications
+
+    # The first round is the same in every replication. A bye (-1) is beaten with probability 1
+    first_players0, first_players1 = slots[::2], slots[1::2]
+    first_win_probability = np.where(first_players1 >= 0,
+                                     win_probability[first_players0 * n_players + np.maximum(first_players1, 0)], 1)
+    for start in range(0, n_replications, batch_size):
+        n = min(batch_size, n_replications - start)
+        # Arithmetic rather than np.where, which is slow on an unpredictable mask
+        remaining = first_players1 + (_uniform(size=(n, len(first_players0)), rng=rng) < first_win_probability) * \
+            (first_players0 - first_players1)
+        reach_counts[1] += np.bincount(remaining.ravel(), minlength=n_players)
+        for round_number in range(1, rounds):
+            players0, players1 = remaining[:, ::2], remaining[:, 1::2]
+            is_player0_winner = _uniform(size=players0.shape, rng=rng) < \
+                win_probability[players0 * n_players + players1]
+            remaining = players1 + is_player0_winner * (players0 - players1)
+            reach_counts[round_number + 1] += np.bincount(remaining.ravel(), minlength=n_players)
+    return reach_counts
+
+
+def _simulate_competition_chunk(playerlist, player0_win_probability_function, seed_sequence, n_replications,
+                                kwargs):
+    """Simulates n_replications competitions drawing from the random stream of seed_sequence and returns the reach
+    counts. The global numpy random state is not used, so chunks can run side by side in processes or threads"""
+    records = iterate_competitions(playerlist, player0_win_probability_function, n_replications, seed_sequence,
+                                   **kwargs)
+    return CompetitionAggregator(len(playerlist)).update_all(records).reach_counts
+
+
+def simulate_competition_parallel(playerlist, player0_win_probability_function, n_replications, seed=None,
+                                  n_workers=None, chunk_size=100, **kwargs):
+    """
+    Simulates a competition n_replications times across a pool of processes and counts how often each player reached
+    each round.
+
+    The replications are split into chunks of chunk_size, and each chunk gets its own random stream spawned from the
+    seed. The results for a given seed are therefore the same whatever the number of workers.
+
+    :param playerlist: A list of dictionary objects that represent a player.
+    :param player0_win_probability_function: A function that takes TMatch, player0, player1 as inputs and returns
+    a probability. It is sent to the worker processes so has to be picklable (e.g. not a lambda)
+    :param n_replications: Number of competitions to simulate
+    :param seed: Seed for numpy.random.SeedSequence. If None, fresh entropy is used
+    :param n_workers: Number of processes. If None, one per CPU. If 1, the simulations run in this process
+    :param chunk_size: Number of competitions simulated by a worker from a single random stream
+    :param kwargs: Any other features that are used in the player0_win_probability_function
+    :return: array of shape (rounds + 1) x n of counts of each player reaching each round (see
+    calculate_competition_probabilities). The last row is the count of competition wins
+    """
+    chunk_sizes = [min(chunk_size, n_replications - start) for start in range(0, n_replications, chunk_size)]
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    chunk_arguments = [(playerlist, player0_win_probability_function, seed_sequence, n, kwargs)
+                       for seed_sequence, n in zip(seed_sequences, chunk_sizes)]
+
+    rounds = math.ceil(math.log2(len(playerlist)))
+    reach_counts = np.zeros((rounds + 1, len(playerlist)), dtype=int)
+    if n_workers == 1:
+        for arguments in chunk_arguments:
+            reach_counts += _simulate_competition_chunk(*arguments)
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(_simulate_competition_chunk, *arguments) for arguments in chunk_arguments]
+            for future in futures:
+                reach_counts += future.result()
+    return reach_counts
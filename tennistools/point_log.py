@@ -0,0 +1,156 @@
+#########################################################################################################
+### Point log
+### A compact, columnar store of the point by point history of many matches. Instead of nested
+### Tmatch -> Tset -> Tgame objects it holds a handful of flat numpy arrays, which can be saved to .npy/.npz
+### files and memory-mapped back for analysis.
+#########################################################################################################
+
+import os
+
+import numpy as np
+
+from tennistools import Tmatch, Ttiebreak, MatchFormat, BEST_OF_FIVE
+
+_ARRAY_NAMES = ['point_winners', 'is_player0_server', 'game_offsets', 'set_offsets', 'match_offsets',
+                'is_player0_first_server', 'match_formats']
+
+
+def _format_row(match_format):
+    """The rules of a MatchFormat as a row of match_formats, with -1 for no match tiebreak"""
+    return [match_format.sets_required, match_format.games_required, match_format.points_required,
+            match_format.points_tiebreak_required, int(match_format.is_no_ad),
+            -1 if match_format.match_tiebreak_points is None else match_format.match_tiebreak_points]
+
+
+def _format_from_row(row):
+    sets_required, games_required, points_required, points_tiebreak_required, is_no_ad, match_tiebreak_points = row
+    return MatchFormat(sets_required, games_required, points_required, points_tiebreak_required, bool(is_no_ad),
+                       None if match_tiebreak_points < 0 else match_tiebreak_points)
+
+
+def _is_started(tset):
+    return len(tset.game_history) > 0 or len(tset.current_game.score_history) > 0
+
+
+class PointLog(object):
+    """
+    A class to hold the point by point history of a number of matches as flat arrays
+
+    Attributes
+    ---------
+    point_winners: int8 array with an entry for each point, 0 if player 0 won the point, 1 if player 1 won (as in
+    Tgame.score_history)
+    is_player0_server: int8 array with an entry for each point, 1 if player 0 served the point
+    game_offsets: index of the first point of each game in point_winners, with the total number of points at the end
+    set_offsets: index of the first game of each set in game_offsets, with the total number of games at the end
+    match_offsets: index of the first set of each match in set_offsets, with the total number of sets at the end
+    is_player0_first_server: int8 array with an entry for each match, 1 if player 0 served first
+    match_formats: int16 array with a row for each match of the rules of its MatchFormat (sets_required,
+    games_required, points_required, points_tiebreak_required, is_no_ad, match_tiebreak_points or -1 if None)
+
+    Methods
+    ---------
+    from_tmatches(tmatches): (static) creates a PointLog from a list of Tmatch objects
+    to_tmatches: replays the points into a list of Tmatch objects
+    get_tmatch(match_number): replays the points of a single match into a Tmatch
+    save(path): saves the arrays to a .npz file, or a directory of .npy files
+    load(path, mmap_mode): (static) loads a PointLog saved with save
+    """
+
+    def __init__(self, point_winners, is_player0_server, game_offsets, set_offsets, match_offsets,
+                 is_player0_first_server, match_formats=None):
+        self.point_winners = point_winners
+        self.is_player0_server = is_player0_server
+        self.game_offsets = game_offsets
+        self.set_offsets = set_offsets
+        self.match_offsets = match_offsets
+        self.is_player0_first_server = is_player0_first_server
+        if match_formats is None:
+            # Logs saved before formats were logged are all best of five sets
+            match_formats = np.tile(np.array(_format_row(BEST_OF_FIVE), dtype=np.int16), (len(match_offsets) - 1, 1))
+        self.match_formats = match_formats
+
+    def __len__(self):
+        return len(self.match_offsets) - 1
+
+    @staticmethod
+    def from_tmatches(tmatches):
+        """Creates a PointLog from a list of Tmatch objects, including any game or set still in play. The matches have
+        to have been played with keep_history"""
+        point_winners = []
+        is_player0_server = []
+        game_offsets = [0]
+        set_offsets = [0]
+        match_offsets = [0]
+        is_player0_first_server = []
+        match_formats = []
+        for tmatch in tmatches:
+            if not tmatch.keep_history:
+                raise ValueError('Match was played without keep_history so has no points to log')
+            tsets = tmatch.set_history + ([tmatch.current_set] if _is_started(tmatch.current_set) else [])
+            first_server = None
+            for tset in tsets:
+                games = tset.game_history + ([tset.current_game] if len(tset.current_game.score_history) > 0 else [])
+                for game in games:
+                    points_played = len(game.score_history)
+                    if isinstance(game, Ttiebreak):
+                        # A tiebreak changes is_player0_server as it is played, so work back to the first server
+                        game_server = game.is_player0_server != (((points_played + 1) // 2) % 2 == 1)
+                        servers = [game_server != (((point + 1) // 2) % 2 == 1) for point in range(points_played)]
+                    else:
+                        servers = [game.is_player0_server] * points_played
+                    if first_server is None:
+                        first_server = servers[0]
+                    point_winners.extend(game.score_history)
+                    is_player0_server.extend(servers)
+                    game_offsets.append(len(point_winners))
+                set_offsets.append(len(game_offsets) - 1)
+            match_offsets.append(len(set_offsets) - 1)
+            is_player0_first_server.append(tmatch.is_player0_server if first_server is None else first_server)
+            match_formats.append(_format_row(tmatch.match_format))
+
+        return PointLog(np.array(point_winners, dtype=np.int8), np.array(is_player0_server, dtype=np.int8),
+                        np.array(game_offsets, dtype=np.int64), np.array(set_offsets, dtype=np.int64),
+                        np.array(match_offsets, dtype=np.int64), np.array(is_player0_first_server, dtype=np.int8),
+                        np.array(match_formats, dtype=np.int16).reshape(-1, 6))
+
+    def get_tmatch(self, match_number):
+        """Replays the points of a single match into a new Tmatch"""
+        first_set, last_set = self.match_offsets[match_number], self.match_offsets[match_number + 1]
+        first_point = self.game_offsets[self.set_offsets[first_set]]
+        last_point = self.game_offsets[self.set_offsets[last_set]]
+        tmatch = Tmatch(bool(self.is_player0_first_server[match_number]),
+                        match_format=_format_from_row(self.match_formats[match_number].tolist()))
+        for point_winner in self.point_winners[first_point:last_point].tolist():
+            tmatch.play_point(point_winner == 0)
+        return tmatch
+
+    def to_tmatches(self):
+        """Replays the points of every match into a list of Tmatch objects"""
+        return [self.get_tmatch(match_number) for match_number in range(len(self))]
+
+    def save(self, path):
+        """Saves the arrays uncompressed to path. If path ends in .npz a single .npz file is written, otherwise path is
+        a directory of .npy files, one for each array, which load can memory-map"""
+        arrays = {name: getattr(self, name) for name in _ARRAY_NAMES}
+        if path.endswith('.npz'):
+            np.savez(path, **arrays)
+        else:
+            os.makedirs(path, exist_ok=True)
+            for name, array in arrays.items():
+                np.save(os.path.join(path, name + '.npy'), array)
+
+    @staticmethod
+    def load(path, mmap_mode=None):
+        """
+        Loads a PointLog saved with save.
+
+        :param path: The .npz file or directory of .npy files given to save
+        :param mmap_mode: For a directory of .npy files, the numpy memory-map mode (e.g. 'r'). The arrays are then
+        mapped from disk rather than read into memory. .npz files are always read into memory
+        """
+        if path.endswith('.npz'):
+            with np.load(path) as arrays:
+                return PointLog(*[arrays[name] if name in arrays.files else None for name in _ARRAY_NAMES])
+        return PointLog(*[np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+                          if os.path.exists(os.path.join(path, name + '.npy')) else None for name in _ARRAY_NAMES])
@@ -0,0 +1,148 @@
+#########################################################################################################
+### Sensitivities
+### Derivatives of match and competition win probabilities with respect to each player's parameters, for
+### the attack / defence model of tennis_simulation_example.py, where the probability of winning a point on
+### serve is sigmoid(server attack - receiver defence). Match win probabilities are differentiated exactly
+### with the complex step method on the array solver (tennistools.solver.match_win_probabilities), and the
+### derivatives are carried forward through the draw alongside the probabilities of reaching each round, so
+### every sensitivity of a competition comes out of one pass rather than one simulation per parameter.
+###
+### For a small change d in a parameter, a probability moves by about d times its sensitivity, e.g. a serve
+### 0.1 stronger moves the chance of winning the competition by about 0.1 * attack sensitivity.
+#########################################################################################################
+
+import math
+
+import numpy as np
+
+from tennistools.simulation import serve_probability_function
+from tennistools.single_elimination_competition import calculate_bracket_slots
+from tennistools.solver import match_win_probabilities
+
+# Step of the complex step method. There is no subtraction, so it can be tiny and the derivatives are exact to
+# machine precision
+_COMPLEX_STEP = 1e-20
+
+
+def _sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+@serve_probability_function
+def attack_defence_model(player0, player1):
+    """The model of tennis_simulation_example.py: a serve is won with probability sigmoid(server attack - receiver
+    defence). Can be used with the simulation functions, the match probability cache and the solver"""
+    return (1 / (1 + math.exp(-(player0['attack'] - player1['defence']))),
+            1 / (1 + math.exp(-(player1['attack'] - player0['defence']))))
+
+
+def match_win_probability_gradient(player0_serve_win_probabilities, player1_serve_win_probabilities):
+    """
+    Returns the probability player 0 wins each match and its derivatives with respect to both serve win probabilities.
+
+    :param player0_serve_win_probabilities: Probability player 0 wins a point on their serve, a float or an array
+    :param player1_serve_win_probabilities: Probability player 1 wins a point on their serve, a float or an array
+    :return: tuple of arrays of the win probability, its derivative with respect to the player 0 serve win
+    probability and its derivative with respect to the player 1 serve win probability
+    """
+    a = np.asarray(player0_serve_win_probabilities, dtype=float)
+    b = np.asarray(player1_serve_win_probabilities, dtype=float)
+    by_a = np.asarray(match_win_probabilities(a + _COMPLEX_STEP * 1j, b + 0j))
+    by_b = np.asarray(match_win_probabilities(a + 0j, b + _COMPLEX_STEP * 1j))
+    return by_a.real, by_a.imag / _COMPLEX_STEP, by_b.imag / _COMPLEX_STEP
+
+
+def _win_probability_gradients(attack, defence):
+    """Win probability matrix of the attack / defence model and its derivatives. [i, j] is for player i against
+    player j: win_probability, by_own_attack (the derivative with respect to the attack of player i, or minus the
+    derivative with respect to the defence of player j) and by_opponent_attack (with respect to the attack of player j,
+    or minus with respect to the defence of player i)"""
+    player0_serve = _sigmoid(attack[:, None] - defence[None, :])
+    player1_serve = player0_serve.T
+    win_probability, by_player0_serve, by_player1_serve = match_win_probability_gradient(player0_serve, player1_serve)
+    return (win_probability, by_player0_serve * player0_serve * (1 - player0_serve),
+            by_player1_serve * player1_serve * (1 - player1_serve))
+
+
+def match_win_sensitivities(player0, player1):
+    """
+    Returns the probability player 0 wins the match under attack_defence_model and its derivatives with respect to the
+    parameters of both players.
+
+    :param player0: dictionary with 'attack' and 'defence'
+    :param player1: dictionary with 'attack' and 'defence'
+    :return: dictionary of win_probability, player0_attack, player0_defence, player1_attack and player1_defence (the
+    derivative of the win probability with respect to each parameter)
+    """
+    player0_serve, player1_serve = attack_defence_model.serve_probabilities(player0, player1)
+    win_probability, by_player0_serve, by_player1_serve = match_win_probability_gradient(player0_serve, player1_serve)
+    by_player0_serve = float(by_player0_serve) * player0_serve * (1 - player0_serve)
+    by_player1_serve = float(by_player1_serve) * player1_serve * (1 - player1_serve)
+    return {'win_probability': float(win_probability),
+            'player0_attack': by_player0_serve, 'player1_defence': -by_player0_serve,
+            'player1_attack': by_player1_serve, 'player0_defence': -by_player1_serve}
+
+
+def competition_sensitivities(playerlist):
+    """
+    Calculates exactly, as calculate_competition_probabilities does for attack_defence_model, the probability of each
+    player reaching each round of the competition, together with its derivatives with respect to the attack and defence
+    of every player.
+
+    :param playerlist: A list of dictionaries with 'attack' and 'defence', in the order given to simulate_competition
+    :return: tuple of probabilities, attack_sensitivities and defence_sensitivities. probabilities is (rounds + 1) x n
+    as returned by calculate_competition_probabilities. The sensitivities are (rounds + 1) x n x n arrays, where
+    [r, i, k] is the derivative of the probability of player i reaching round r with respect to the attack (or
+    defence) of player k. The last row is winning the competition
+    """
+    slots = calculate_bracket_slots(len(playerlist))
+    is_player = slots >= 0
+    n_slots = len(slots)
+    rounds = int(math.log2(n_slots))
+
+    attack = np.array([player['attack'] for player in playerlist], dtype=float)
+    defence = np.array([player['defence'] for player in playerlist], dtype=float)
+    win_probability, by_own_attack, by_opponent_attack = _win_probability_gradients(attack, defence)
+
+    # Matrices between the slots, a bye never wins and has no parameters
+    slot_players = np.where(is_player, slots, 0)
+    slot_index = np.ix_(slot_players, slot_players)
+    is_pairing = np.outer(is_player, is_player)
+    slot_win_probability = win_probability[slot_index] * is_pairing
+    slot_by_own_attack = by_own_attack[slot_index] * is_pairing
+    slot_by_opponent_attack = by_opponent_attack[slot_index] * is_pairing
+
+    # reach[r, s] is the probability the player in slot s reaches round r. tangents[r, 0 or 1, u, s] is its
+    # derivative with respect to the attack (0) or defence (1) of the player in slot u
+    reach = np.zeros((rounds + 1, n_slots))
+    tangents = np.zeros((rounds + 1, 2, n_slots, n_slots))
+    reach[0] = is_player
+    slot_numbers = np.arange(n_slots)
+    for round_number in range(rounds):
+        block = slot_numbers // 2 ** round_number
+        is_opponent = ((block[:, None] ^ 1) == block[None, :]).astype(float)
+        opponent_win_probability = slot_win_probability * is_opponent
+        round_reach, round_tangents = reach[round_number], tangents[round_number]
+
+        opponent_reach = is_opponent @ round_reach
+        beat_opponent = opponent_win_probability @ round_reach
+        reach[round_number + 1] = round_reach * (beat_opponent + 1 - opponent_reach)
+
+        # Derivative of beat_opponent from the win probabilities themselves: a player's parameters move their own
+        # row of the win probability matrix (summed over opponents) and their column (one entry per opponent)
+        own = np.diag((slot_by_own_attack * is_opponent) @ round_reach)
+        opponent = (slot_by_opponent_attack * is_opponent * round_reach[None, :]).T
+        own_defence = np.diag((slot_by_opponent_attack * is_opponent) @ round_reach)
+        opponent_defence = (slot_by_own_attack * is_opponent * round_reach[None, :]).T
+        direct = np.stack([own + opponent, -(own_defence + opponent_defence)])
+
+        tangents[round_number + 1] = round_tangents * (beat_opponent + 1 - opponent_reach) + \
+            round_reach * (round_tangents @ opponent_win_probability.T + direct - round_tangents @ is_opponent.T)
+
+    probabilities = np.zeros((rounds + 1, len(playerlist)))
+    probabilities[:, slots[is_player]] = reach[:, is_player]
+    sensitivities = np.zeros((2, rounds + 1, len(playerlist), len(playerlist)))
+    player_tangents = tangents[:, :, is_player][:, :, :, is_player]
+    sensitivities[np.ix_([0, 1], range(rounds + 1), slots[is_player], slots[is_player])] = \
+        player_tangents.transpose(1, 0, 3, 2)
+    return probabilities, sensitivities[0], sensitivities[1]
@@ -0,0 +1,185 @@
+#########################################################################################################
+### Simulation service
+### An asyncio front end to the competition simulations for a service answering many pricing requests at
+### once. The simulations run in chunks on a shared process (or thread) pool, so the event loop is never
+### blocked, and each request can stream its reach probabilities as the chunks finish. Identical requests
+### in flight at the same time share one simulation. A request only has a few chunks in the pool at a time,
+### so a large request does not hold up the requests that arrive after it.
+#########################################################################################################
+
+import asyncio
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from tennistools.match_cache import _freeze
+from tennistools.monte_carlo import proportion_confidence_interval, _simulate_competition_chunk
+
+
+class _Job(object):
+    """A simulation in flight and the queues of the requests waiting on it"""
+
+    def __init__(self, n_players, n_replications, confidence):
+        self.reach_counts = np.zeros((math.ceil(math.log2(n_players)) + 1, n_players), dtype=np.int64)
+        self.n = 0
+        self.n_replications = n_replications
+        self.confidence = confidence
+        self.queues = []
+        self.latest = None
+        self.task = None
+
+    def partial_result(self):
+        lower, upper = proportion_confidence_interval(self.reach_counts, self.n, self.confidence)
+        return {'n': self.n, 'reach_counts': self.reach_counts.copy(), 'probabilities': self.reach_counts / self.n,
+                'lower': lower, 'upper': upper, 'is_complete': self.n == self.n_replications}
+
+    def add_chunk(self, n, reach_counts):
+        self.n += n
+        self.reach_counts += reach_counts
+        self.publish(self.partial_result())
+
+    def publish(self, item):
+        self.latest = item
+        for queue in self.queues:
+            queue.put_nowait(item)
+
+
+class SimulationService(object):
+    """
+    An asyncio service that simulates competitions on a shared executor
+
+    Attributes
+    ---------
+    executor: The concurrent.futures executor the chunks run on. A ProcessPoolExecutor is made if none is given, and
+    then the player0_win_probability_function has to be picklable (e.g. not a lambda)
+    chunk_size: Number of competitions in a chunk, the unit of work sent to the executor and of partial results
+    chunks_in_flight: Most chunks of one request in the executor at a time
+    coalesced: Number of requests that were answered by a simulation already in flight
+
+    Methods
+    ---------
+    stream(playerlist, player0_win_probability_function, n_replications, seed, confidence, **kwargs): (async
+    generator) yields the results so far each time a chunk finishes
+    price(playerlist, player0_win_probability_function, n_replications, seed, confidence, **kwargs): (coroutine) the
+    results once every chunk has finished
+    in_flight: number of simulations running
+    close: shuts down the executor if the service made it
+    """
+
+    def __init__(self, executor=None, max_workers=None, chunk_size=100, chunks_in_flight=None):
+        self._owns_executor = executor is None
+        self.executor = ProcessPoolExecutor(max_workers=max_workers) if executor is None else executor
+        self.chunk_size = chunk_size
+        if chunks_in_flight is None:
+            chunks_in_flight = max_workers if max_workers is not None else os.cpu_count() or 1
+        self.chunks_in_flight = chunks_in_flight
+        self.coalesced = 0
+        self._jobs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def in_flight(self):
+        return len(self._jobs)
+
+    def close(self):
+        for job in list(self._jobs.values()):
+            job.task.cancel()
+        if self._owns_executor:
+            self.executor.shutdown(wait=False)
+
+    async def stream(self, playerlist, player0_win_probability_function, n_replications, seed=None, confidence=0.95,
+                     **kwargs):
+        """
+        Simulates a competition n_replications times on the executor, yielding the results so far each time a chunk
+        of replications finishes. If an identical request (the same players, function, n_replications, seed,
+        confidence and kwargs) is already in flight, its simulation is shared rather than started again. Chunk i draws
+        from the random stream spawned i-th from the seed, as simulate_competition_parallel does, so the final counts
+        for a seed are the same as simulate_competition_parallel's with the same chunk_size, whatever the executor and
+        the order the chunks finish in. If every request waiting on a simulation stops, the simulation is cancelled.
+
+        :param playerlist: A list of dictionary objects that represent a player.
+        :param player0_win_probability_function: A function that takes TMatch, player0, player1 as inputs and returns
+        a probability
+        :param n_replications: Number of competitions to simulate
+        :param seed: Seed for numpy.random.SeedSequence. If None, fresh entropy is used
+        :param confidence: Confidence level of the intervals (see proportion_confidence_interval)
+        :param kwargs: Any other features that are used in the player0_win_probability_function
+        :return: yields dictionaries of n (replications so far), reach_counts ((rounds + 1) x n, as
+        simulate_competition_parallel returns), probabilities, lower, upper and is_complete (True for the last)
+        """
+        if n_replications < 1:
+            raise ValueError('n_replications has to be at least 1')
+        key = (player0_win_probability_function, _freeze(playerlist), n_replications, seed, confidence,
+               _freeze(kwargs))
+        job = self._jobs.get(key)
+        if job is not None:
+            self.coalesced += 1
+        else:
+            job = _Job(len(playerlist), n_replications, confidence)
+            job.task = asyncio.ensure_future(self._run(job, playerlist, player0_win_probability_function,
+                                                       n_replications, seed, kwargs))
+            self._jobs[key] = job
+            job.task.add_done_callback(lambda _: self._jobs.pop(key, None) if self._jobs.get(key) is job else None)
+
+        queue = asyncio.Queue()
+        if job.latest is not None:
+            queue.put_nowait(job.latest)
+        job.queues.append(queue)
+        try:
+            while True:
+                item = await queue.get()
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+                if item['is_complete']:
+                    return
+        finally:
+            job.queues.remove(queue)
+            if not job.queues and not job.task.done():
+                job.task.cancel()
+                # A request arriving before the cancellation goes through starts a new simulation
+                if self._jobs.get(key) is job:
+                    del self._jobs[key]
+
+    async def price(self, playerlist, player0_win_probability_function, n_replications, seed=None, confidence=0.95,
+                    **kwargs):
+        """The final results of stream, once every chunk has finished"""
+        result = None
+        async for result in self.stream(playerlist, player0_win_probability_function, n_replications, seed,
+                                        confidence, **kwargs):
+            pass
+        return result
+
+    async def _run(self, job, playerlist, player0_win_probability_function, n_replications, seed, kwargs):
+        loop = asyncio.get_running_loop()
+        chunk_sizes = [min(self.chunk_size, n_replications - start)
+                       for start in range(0, n_replications, self.chunk_size)]
+        seed_sequences = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+        pending = {}
+        next_chunk = 0
+        try:
+            while next_chunk < len(chunk_sizes) or pending:
+                # Chunks are submitted a few at a time, so other requests' chunks queue between them
+                while next_chunk < len(chunk_sizes) and len(pending) < self.chunks_in_flight:
+                    future = loop.run_in_executor(self.executor, _simulate_competition_chunk, playerlist,
+                                                  player0_win_probability_function, seed_sequences[next_chunk],
+                                                  chunk_sizes[next_chunk], kwargs)
+                    pending[future] = chunk_sizes[next_chunk]
+                    next_chunk += 1
+                done, _ = await asyncio.wait(list(pending), return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    job.add_chunk(pending.pop(future), future.result())
+        except asyncio.CancelledError:
+            for future in pending:
+                future.cancel()
+            raise
+        except Exception as error:
+            for future in pending:
+                future.cancel()
+            job.publish(error)
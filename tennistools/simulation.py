@@ -4,37 +4,650 @@
 ### function provides the probabilities of winning based on some kw args.
 #########################################################################################################
 
+import time
+from contextlib import contextmanager
+from functools import wraps
+from itertools import islice
+from operator import length_hint
+
 import numpy as np
-from tennistools import Tmatch
+from tennistools import Tmatch, Ttiebreak, MatchFormat, BEST_OF_FIVE
+from tennistools import instrumentation
+from tennistools.compiled import HAS_NUMBA, play_matches_compiled
+from tennistools.solver import outcome_tables
+from tennistools.state_machine import play_match_states, result_to_tmatch, _point_state_tables, _reduce_point_score
+
+# Whether random numbers are drawn as antithetic variates, 1 - u in place of u (see antithetic_draws)
+_is_antithetic = False
+
+
+@contextmanager
+def antithetic_draws():
+    """
+    Context manager in which every uniform random number the simulation functions draw is replaced by 1 - u, and every
+    random first server is swapped. Running the same simulation from the same random state inside and outside gives a
+    pair of negatively correlated results, whose average has a lower variance than two independent runs.
+    """
+    global _is_antithetic
+    previous = _is_antithetic
+    _is_antithetic = True
+    try:
+        yield
+    finally:
+        _is_antithetic = previous
+
+
+class UniformStream(object):
+    """
+    A stream of uniform random numbers from a numpy Generator, to pass as rng to the simulation functions in place of
+    the global numpy random state. Single numbers are handed out from blocks drawn in advance, so playing a point costs
+    a list lookup rather than a call into numpy. Arrays (e.g. for a batch of matches) are drawn from the Generator
+    directly. An antithetic stream hands out 1 - u in place of every number u of the stream of the same seed, so the
+    pair plays negatively correlated simulations without the antithetic_draws flag shared by every thread.
+
+    Attributes
+    ---------
+    generator: The numpy Generator the numbers are drawn from
+    block_size: Number of single numbers drawn at a time
+    is_antithetic: Whether the numbers are handed out as 1 - u
+
+    Methods
+    ---------
+    uniform(size): a uniform random number in [0, 1), or an array of them if size is given
+    take(n): array of the next n single numbers, the same numbers as n calls of uniform()
+    peek_block: array of the single numbers left in the current block, without moving on, for a compiled kernel to
+    draw from
+    advance(n_used): moves on past the first n_used numbers of peek_block
+    """
+
+    def __init__(self, rng=None, block_size=4096, is_antithetic=False):
+        self.generator = np.random.default_rng(rng)
+        self.block_size = block_size
+        self.is_antithetic = is_antithetic
+        self._set_block(np.zeros(0))
+
+    def _random(self, size):
+        uniforms = self.generator.random(size)
+        return 1 - uniforms if self.is_antithetic else uniforms
+
+    def _set_block(self, block):
+        # The block is kept as an array for peek_block and as a list, which is quicker to hand out one at a time
+        self._array = block
+        self._values = block.tolist()
+        self._block = iter(self._values)
+
+    def uniform(self, size=None):
+        if size is not None:
+            return self._random(size)
+        try:
+            return next(self._block)
+        except StopIteration:
+            self._set_block(self._random(self.block_size))
+            return next(self._block)
 
+    def take(self, n):
+        values = list(islice(self._block, n))
+        while len(values) < n:
+            self._set_block(self._random(self.block_size))
+            values.extend(islice(self._block, n - len(values)))
+        return np.array(values)
 
-def stochastical_simulation_next_point(tmatch, player0_win_probability_function, player0=None, player1=None, **kwargs):
-     """Stochastically play point where a function of point win probabilities is known"""
+    def peek_block(self):
+        if length_hint(self._block) == 0:
+            self._set_block(self._random(self.block_size))
+        return self._array[len(self._values) - length_hint(self._block):]
+
+    def advance(self, n_used):
+        next(islice(self._block, n_used, n_used), None)
+
+
+def random_stream(rng):
+    """
+    Returns the UniformStream the simulation functions draw from for their rng argument: None (the global numpy random
+    state) and a UniformStream are returned as they are, a seed, SeedSequence or Generator starts a new UniformStream
+    """
+    if rng is None or isinstance(rng, UniformStream):
+        return rng
+    return UniformStream(rng)
+
+
+def _uniform(size=None, rng=None):
+    """Uniform random numbers from rng, or the global numpy random state if it is None, as antithetic variates inside
+    antithetic_draws"""
+    uniforms = np.random.uniform(size=size) if rng is None else rng.uniform(size=size)
+    if _is_antithetic:
+        return 1 - uniforms
+    return uniforms
+
+
+def _is_player0_first_server(rng=None):
+    """Random first server of a match, drawn from the global random state as stochastic_simulation_match always has"""
+    if rng is not None:
+        return bool(_uniform(rng=rng) < 0.5)
+    return (np.random.binomial(1,0.5)==0) != _is_antithetic
+
+
+def stochastical_simulation_next_point(tmatch, player0_win_probability_function, player0=None, player1=None, rng=None,
+                                       **kwargs):
+     """Stochastically play point where a function of point win probabilities is known. rng is a UniformStream or
+     numpy Generator to draw from (see random_stream), the global numpy random state if None"""
+     if instrumentation.collector is not None:
+         return _instrumented_next_point(instrumentation.collector, tmatch, player0_win_probability_function,
+                                         player0, player1, rng, **kwargs)
      player0_win_probability = player0_win_probability_function(tmatch, player0, player1, **kwargs)
-     tmatch.play_point(np.random.uniform() < player0_win_probability)
+     tmatch.play_point(_uniform(rng=rng) < player0_win_probability)
+
+def _instrumented_next_point(collector, tmatch, player0_win_probability_function, player0=None, player1=None, rng=None,
+                             **kwargs):
+    """stochastical_simulation_next_point, timing each phase and counting what was played"""
+    current_set, current_game = tmatch.current_set, tmatch.current_set.current_game
+    start = time.perf_counter()
+    player0_win_probability = player0_win_probability_function(tmatch, player0, player1, **kwargs)
+    probability_time = time.perf_counter()
+    is_player0_point_winner = _uniform(rng=rng) < player0_win_probability
+    random_time = time.perf_counter()
+    tmatch.play_point(is_player0_point_winner)
+    end = time.perf_counter()
+
+    collector.add_time('probability_function', probability_time - start)
+    collector.add_time('random', random_time - probability_time)
+    collector.add_time('score_keeping', end - random_time)
+    collector.count('points')
+    if current_set.current_game is not current_game or tmatch.current_set is not current_set:
+        collector.count('tiebreaks' if isinstance(current_game, Ttiebreak) else 'games')
+    if tmatch.current_set is not current_set:
+        collector.count('sets')
 
-def stochastic_simulation_game(player0_win_probability_function, player0=None, player1=None, **kwargs):
+def stochastic_simulation_game(player0_win_probability_function, player0=None, player1=None, rng=None,
+                               match_format=None, **kwargs):
     """Create and randomly play a tennis match"""
+    rng = random_stream(rng)
     #random assign first server
-    tmatch = Tmatch(np.random.uniform() < 0.5)
+    tmatch = Tmatch(_uniform(rng=rng) < 0.5, match_format=match_format)
     while len(tmatch.current_set.game_history) == 0:
-        stochastical_simulation_next_point(tmatch, player0_win_probability_function, player0, player1, **kwargs)
+        stochastical_simulation_next_point(tmatch, player0_win_probability_function, player0, player1, rng, **kwargs)
     return tmatch
 
-def stochastic_simulation_set(player0_win_probability_function, player0=None, player1=None, **kwargs):
+def stochastic_simulation_set(player0_win_probability_function, player0=None, player1=None, rng=None,
+                              match_format=None, **kwargs):
     """Create and randomly play a tennis match"""
+    rng = random_stream(rng)
     #random assign first server
-    tmatch = Tmatch(is_player0_server=(np.random.uniform() < 0.5))
+    tmatch = Tmatch(is_player0_server=(_uniform(rng=rng) < 0.5), match_format=match_format)
     while len(tmatch.set_history) == 0:
-        stochastical_simulation_next_point(tmatch, player0_win_probability_function, player0, player1, **kwargs)
+        stochastical_simulation_next_point(tmatch, player0_win_probability_function, player0, player1, rng, **kwargs)
     return tmatch
 
-def stochastic_simulation_match(player0_win_probability_function, player0=None, player1=None, **kwargs):
-    """Create and randomly play a tennis match"""
+def stochastic_simulation_match(player0_win_probability_function, player0=None, player1=None, keep_history=True,
+                                rng=None, match_format=None, **kwargs):
+    """Create and randomly play a tennis match. If keep_history is False, only the running score is kept as the match
+    is played, so the returned match only holds the result (match_winner, get_match_score and set_scores). rng is a
+    seed, numpy Generator or UniformStream to draw the random numbers from (see random_stream), the global numpy
+    random state if None. The same seed always gives the same match. match_format is the tennistools.MatchFormat of
+    the match, BEST_OF_FIVE by default. With Numba installed, a serve probability function played from rng without
+    history runs in a compiled kernel (see tennistools.compiled), which gives the same match"""
+    rng = random_stream(rng)
+    if is_serve_probability_function(player0_win_probability_function) and instrumentation.collector is None:
+        if HAS_NUMBA and rng is not None and not keep_history:
+            serve_win_probabilities = player0_win_probability_function.serve_probabilities(player0, player1, **kwargs)
+            (result, is_player0_first_server), = play_matches_compiled(*serve_win_probabilities, rng, match_format,
+                                                                       _is_antithetic)
+            return result_to_tmatch(result, is_player0_first_server, match_format=match_format)
+        # The score is played through the state tables, and the Tmatch is only built at the end
+        is_player0_first_server = _is_player0_first_server(rng)
+        result = _play_match_states(player0_win_probability_function, player0, player1, is_player0_first_server, rng,
+                                    match_format, keep_history, **kwargs)
+        return result_to_tmatch(result, is_player0_first_server, keep_history, match_format)
+
     #random assign first server
-    tmatch = Tmatch(is_player0_server=np.random.binomial(1,0.5)==0)
+    tmatch = Tmatch(is_player0_server=_is_player0_first_server(rng), keep_history=keep_history,
+                    match_format=match_format)
 
     while not tmatch.is_match_over():
-        stochastical_simulation_next_point(tmatch, player0_win_probability_function, player0, player1, **kwargs)
+        stochastical_simulation_next_point(tmatch, player0_win_probability_function, player0, player1, rng, **kwargs)
+    if instrumentation.collector is not None:
+        instrumentation.collector.count('matches')
     return tmatch
 
+def _play_match_states(player0_win_probability_function, player0, player1, is_player0_first_server, rng,
+                       match_format, record_points, **kwargs):
+    """Plays a match of a serve probability function through the state tables, drawing one uniform per point from
+    the same stream as stochastical_simulation_next_point"""
+    if _is_antithetic:
+        uniform = lambda: _uniform(rng=rng)
+    else:
+        uniform = np.random.uniform if rng is None else rng.uniform
+    player0_serve_win_probability, player1_serve_win_probability = \
+        player0_win_probability_function.serve_probabilities(player0, player1, **kwargs)
+    return play_match_states(player0_serve_win_probability, player1_serve_win_probability, is_player0_first_server,
+                             uniform, match_format, record_points)
+
+def stochastic_simulation_match_states(player0_win_probability_function, player0=None, player1=None, rng=None,
+                                       match_format=None, record_points=False, **kwargs):
+    """
+    Randomly play a tennis match of a function created with serve_probability_function through the score state
+    tables (see tennistools.state_machine), without building a Tmatch. Gives the same match as
+    stochastic_simulation_match for the same random numbers.
+
+    :param rng: Seed, numpy Generator or UniformStream to draw the random numbers from (see random_stream), the global
+    numpy random state if None
+    :param match_format: The tennistools.MatchFormat of the match, BEST_OF_FIVE by default
+    :param record_points: Whether to keep the points played in the result
+    :return: tuple of the MatchStateResult (match_winner, set_scores, points_played, points) and whether player 0
+    served first, which can be turned into a Tmatch with tennistools.state_machine.result_to_tmatch
+    """
+    if not is_serve_probability_function(player0_win_probability_function):
+        raise ValueError('The score state tables can only play functions created with serve_probability_function')
+    rng = random_stream(rng)
+    #random assign first server
+    is_player0_first_server = _is_player0_first_server(rng)
+    result = _play_match_states(player0_win_probability_function, player0, player1, is_player0_first_server, rng,
+                                match_format, record_points, **kwargs)
+    return result, is_player0_first_server
+
+
+
+#########################################################################################################
+### Batch play functions
+### These functions play many independent matches at once, holding the score of every match in numpy
+### arrays. The probability of each point is either fixed by who is serving, or comes from a batch
+### probability function that is called once for all the matches in play (see batch_probability_function).
+#########################################################################################################
+
+def _stochastic_simulation_match_batch(n_matches, player0_win_probability_function, is_player0_first_server,
+                                       record_points=False, antithetic=False, rng=None, match_format=None,
+                                       **match_arrays):
+    """
+    Plays n_matches matches point by point, one numpy step per point for every match still in play.
+
+    :param n_matches: Number of matches to play
+    :param player0_win_probability_function: A function that takes the dictionary of score arrays of the matches still
+    in play and returns an array of probabilities that player 0 wins the next point in each of them
+    :param is_player0_first_server: Boolean array of length n_matches, whether player 0 serves first in each match
+    :param record_points: Whether to also return the points played. If True a fifth item is returned, an array
+    for each match of whether player 0 won each point
+    :param antithetic: If True, n_matches has to be even and the second half of the matches are antithetic to the first
+    half: match n_matches // 2 + i draws 1 - u where match i draws u, for every point
+    :param rng: UniformStream to draw the random numbers from (see random_stream), the global numpy random state if None
+    :param match_format: The tennistools.MatchFormat of the matches, BEST_OF_FIVE by default
+    :param match_arrays: Any other arrays of length n_matches used by player0_win_probability_function. They are
+    added to the dictionary of score arrays and kept aligned with the matches still in play
+    :return: tuple of match_winners (n_matches), set_scores (n_matches x 2), game_scores
+    (n_matches x max sets x 2, unplayed sets are 0-0) and points_played (n_matches)
+    """
+    if match_format is None:
+        match_format = BEST_OF_FIVE
+    tables = _point_state_tables(match_format)
+    next_state, is_game_over, is_server_changed = tables['next_state'], tables['is_game_over'], tables['is_server_changed']
+    set_over, is_tiebreak_score = tables['set_over'], tables['is_tiebreak_score']
+    sets_required = match_format.sets_required
+    has_match_tiebreak = match_format.match_tiebreak_points is not None
+
+    max_sets = 2 * sets_required - 1
+    match_winners = np.zeros(n_matches, dtype=int)
+    set_scores = np.zeros((n_matches, 2), dtype=int)
+    game_scores = np.zeros((n_matches, max_sets, 2), dtype=int)
+    points_played = np.zeros(n_matches, dtype=int)
+
+    # Score of the matches still in play. The points score is held as a point state (see _point_state_tables) and
+    # is_player0_game_server is the server at the start of the current game. Finished matches are parked in the
+    # match_over state and are only removed once enough of them have built up
+    state = {'match_index': np.arange(n_matches),
+             'point_state': np.zeros(n_matches, dtype=np.intp),
+             'is_player0_game_server': np.asarray(is_player0_first_server, dtype=bool).copy(),
+             'player0_games': np.zeros(n_matches, dtype=int), 'player1_games': np.zeros(n_matches, dtype=int),
+             'player0_sets': np.zeros(n_matches, dtype=int), 'player1_sets': np.zeros(n_matches, dtype=int)}
+    state.update(match_arrays)
+    matches_in_play = n_matches
+    point_match_index = []
+    point_winners = []
+    collector = instrumentation.collector
+    if collector is not None:
+        start = time.perf_counter()
+        other_phases_seconds = collector.seconds('probability_function') + collector.seconds('random')
+
+    if antithetic:
+        if n_matches % 2 == 1:
+            raise ValueError('Antithetic matches are played in pairs, so n_matches has to be even')
+
+        def draw_uniforms(match_index):
+            # One uniform per pair of matches each point, used as it is by the first and as 1 - u by the second
+            uniforms = _uniform(size=n_matches // 2, rng=rng)
+            return np.concatenate([uniforms, 1 - uniforms])[match_index]
+    else:
+        def draw_uniforms(match_index):
+            return _uniform(size=len(match_index), rng=rng)
+
+    # Every match plays one point per step until it is over, so the step a match finishes on is its number of points
+    step = 0
+    while matches_in_play > 0:
+        step += 1
+        state['is_player0_server'] = state['is_player0_game_server'] ^ is_server_changed[state['point_state']]
+        if collector is None:
+            is_player0_point_winner = draw_uniforms(state['match_index']) < player0_win_probability_function(state)
+        else:
+            is_player0_point_winner = _instrumented_point_winners(collector, player0_win_probability_function, state,
+                                                                  draw_uniforms, tables)
+        if record_points:
+            is_in_play = state['point_state'] != tables['match_over']
+            point_match_index.append(state['match_index'][is_in_play])
+            point_winners.append(is_player0_point_winner[is_in_play])
+
+        transition = 2 * state['point_state'] + is_player0_point_winner
+        state['point_state'] = next_state[transition]
+        games_over = np.flatnonzero(is_game_over[transition])
+        if len(games_over) == 0:
+            continue
+        if collector is not None:
+            tiebreaks = int(tables['is_tiebreak'][transition[games_over] // 2].sum())
+            collector.count('games', len(games_over) - tiebreaks)
+            collector.count('tiebreaks', tiebreaks)
+
+        # The winner of the last point of a game wins the game
+        is_player0_game_winner = is_player0_point_winner[games_over]
+        player0_games = state['player0_games'][games_over] + is_player0_game_winner
+        player1_games = state['player1_games'][games_over] + ~is_player0_game_winner
+        state['is_player0_game_server'][games_over] ^= True
+
+        is_set_over = set_over[player0_games, player1_games]
+        if has_match_tiebreak:
+            # A match tiebreak is the only game of its set
+            is_set_over |= (state['player0_sets'][games_over] == sets_required - 1) & \
+                           (state['player1_sets'][games_over] == sets_required - 1)
+        is_tiebreak = is_tiebreak_score[player0_games, player1_games]
+        state['point_state'][games_over[is_tiebreak]] = tables['tiebreak_start']
+
+        if is_set_over.any():
+            sets_over = games_over[is_set_over]
+            if collector is not None:
+                collector.count('sets', len(sets_over))
+            player0_sets = state['player0_sets'][sets_over]
+            player1_sets = state['player1_sets'][sets_over]
+            match_index = state['match_index'][sets_over]
+            game_scores[match_index, player0_sets + player1_sets, 0] = player0_games[is_set_over]
+            game_scores[match_index, player0_sets + player1_sets, 1] = player1_games[is_set_over]
+            is_player0_set_winner = is_player0_game_winner[is_set_over]
+            player0_sets += is_player0_set_winner
+            player1_sets += ~is_player0_set_winner
+            state['player0_sets'][sets_over] = player0_sets
+            state['player1_sets'][sets_over] = player1_sets
+            player0_games[is_set_over] = 0
+            player1_games[is_set_over] = 0
+
+            if has_match_tiebreak:
+                is_deciding_set = (player0_sets == sets_required - 1) & (player1_sets == sets_required - 1)
+                state['point_state'][sets_over[is_deciding_set]] = tables['match_tiebreak_start']
+            is_match_over = np.maximum(player0_sets, player1_sets) == sets_required
+            if is_match_over.any():
+                finished = match_index[is_match_over]
+                set_scores[finished, 0] = player0_sets[is_match_over]
+                set_scores[finished, 1] = player1_sets[is_match_over]
+                match_winners[finished] = (player1_sets[is_match_over] == sets_required).astype(int)
+                points_played[finished] = step
+                state['point_state'][sets_over[is_match_over]] = tables['match_over']
+                matches_in_play -= len(finished)
+                if collector is not None:
+                    collector.count('matches', len(finished))
+        state['player0_games'][games_over] = player0_games
+        state['player1_games'][games_over] = player1_games
+
+        if 5 * matches_in_play < 4 * len(state['match_index']):
+            in_play = state['point_state'] != tables['match_over']
+            state = {key: value[in_play] for key, value in state.items()}
+
+    if collector is not None:
+        other_phases_seconds = collector.seconds('probability_function') + collector.seconds('random') - \
+            other_phases_seconds
+        collector.add_time('score_keeping', time.perf_counter() - start - other_phases_seconds)
+
+    if record_points:
+        # Points were recorded step by step, a stable sort groups them by match and keeps them in order
+        point_match_index = np.concatenate(point_match_index)
+        order = np.argsort(point_match_index, kind='stable')
+        points_per_match = np.bincount(point_match_index, minlength=n_matches)
+        points = np.split(np.concatenate(point_winners)[order], np.cumsum(points_per_match)[:-1])
+        return match_winners, set_scores, game_scores, points_played, points
+    return match_winners, set_scores, game_scores, points_played
+
+
+def _instrumented_point_winners(collector, player0_win_probability_function, state, draw_uniforms, tables):
+    """Draws the winners of the next point of a batch of matches, timing each phase and counting the points"""
+    start = time.perf_counter()
+    player0_win_probability = player0_win_probability_function(state)
+    probability_time = time.perf_counter()
+    is_player0_point_winner = draw_uniforms(state['match_index']) < player0_win_probability
+    collector.add_time('probability_function', probability_time - start)
+    collector.add_time('random', time.perf_counter() - probability_time)
+    collector.count('points', int((state['point_state'] != tables['match_over']).sum()))
+    return is_player0_point_winner
+
+
+def stochastic_simulation_match_batch(player0_serve_win_probability, player1_serve_win_probability, n_matches,
+                                      antithetic=False, rng=None, match_format=None):
+    """
+    Create and randomly play n_matches independent tennis matches where the chance of winning a point depends only on
+    who is serving (e.g. probability_model1 in tennis_simulation_example.py)
+
+    :param player0_serve_win_probability: Probability player 0 wins a point on their serve. A float, or an array of
+    length n_matches to play different pairings in the same batch
+    :param player1_serve_win_probability: Probability player 1 wins a point on their serve. A float or an array
+    :param n_matches: Number of matches to play
+    :param antithetic: If True, the matches are played as antithetic pairs, the second half of the matches drawing
+    1 - u for every random number u of the first half (and with the other first server). n_matches has to be even and
+    the pairings have to be the same in both halves. Averages over the matches then have a lower variance
+    :param rng: Seed, numpy Generator or UniformStream to draw the random numbers from (see random_stream), the global
+    numpy random state if None
+    :param match_format: The tennistools.MatchFormat of the matches, BEST_OF_FIVE by default
+    :return: tuple of match_winners (0 or 1 for each match), set_scores (sets won by player 0, player 1 in each match)
+    and game_scores (games won by player 0, player 1 in each set, unplayed sets are 0-0)
+    """
+    rng = random_stream(rng)
+    #random assign first server
+    if antithetic:
+        is_player0_first_server = _uniform(size=n_matches // 2, rng=rng) < 0.5
+        is_player0_first_server = np.concatenate([is_player0_first_server, ~is_player0_first_server])
+    else:
+        is_player0_first_server = _uniform(size=n_matches, rng=rng) < 0.5
+    match_winners, set_scores, game_scores, _ = _stochastic_simulation_match_batch(
+        n_matches, _serve_win_probability, is_player0_first_server, antithetic=antithetic, rng=rng,
+        match_format=match_format,
+        **_serve_win_probability_arrays(player0_serve_win_probability, player1_serve_win_probability, n_matches))
+    return match_winners, set_scores, game_scores
+
+
+def _serve_win_probability_arrays(player0_serve_win_probability, player1_serve_win_probability, n_matches):
+    """Arrays used by _serve_win_probability for matches with fixed serve probabilities"""
+    player0_serve_win_probability = np.broadcast_to(np.asarray(player0_serve_win_probability, dtype=float), (n_matches,))
+    player1_serve_win_probability = np.broadcast_to(np.asarray(player1_serve_win_probability, dtype=float), (n_matches,))
+    player0_receive_win_probability = 1 - player1_serve_win_probability
+    return {'player0_receive_win_probability': player0_receive_win_probability,
+            'player0_serve_advantage': player0_serve_win_probability - player0_receive_win_probability}
+
+
+def _serve_win_probability(state):
+    """Probability player 0 wins the next point when it only depends on who is serving"""
+    # Arithmetic rather than np.where, which is slow on an unpredictable mask
+    return state['player0_receive_win_probability'] + state['is_player0_server'] * state['player0_serve_advantage']
+
+
+def stochastic_simulation_match_fast(player0_serve_win_probability, player1_serve_win_probability, rng=None,
+                                     match_format=None):
+    """
+    Create and randomly play a tennis match where the chance of winning a point depends only on who is serving, by
+    sampling each whole set score from a precomputed table (see tennistools.solver.outcome_tables) rather than playing
+    every point. The tables are cached for each pair of probabilities, so repeated pairings are cheap.
+
+    :param rng: Seed, numpy Generator or UniformStream to draw the random numbers from (see random_stream), the global
+    numpy random state if None
+    :param match_format: The tennistools.MatchFormat of the match, BEST_OF_FIVE by default. The set tables are for
+    advantage games and a tiebreak at 6-6, so only the number of sets can differ from BEST_OF_FIVE
+    :return: Tmatch played without history (match_winner, get_match_score and set_scores)
+    """
+    if match_format is not None and MatchFormat(sets_required=match_format.sets_required) != match_format:
+        raise ValueError('stochastic_simulation_match_fast only plays sets of the default format, not ' +
+                         repr(match_format))
+    set_tables = outcome_tables(player0_serve_win_probability, player1_serve_win_probability)['set']
+    rng = random_stream(rng)
+    #random assign first server
+    tmatch = Tmatch(is_player0_server=_is_player0_first_server(rng), keep_history=False, match_format=match_format)
+    while not tmatch.is_match_over():
+        table = set_tables[tmatch.is_player0_server]
+        outcome = min(np.searchsorted(table['cumulative'], _uniform(rng=rng), side='right'), len(table['scores']) - 1)
+        player0_games, player1_games = table['scores'][outcome].tolist()
+        tmatch.play_set(player0_games, player1_games)
+    if instrumentation.collector is not None:
+        instrumentation.collector.count('matches')
+        instrumentation.collector.count('sets', len(tmatch.set_scores))
+    return tmatch
+
+
+#########################################################################################################
+### Batch and serve probability functions
+### A point win probability function can optionally be written for a batch of matches. It is given arrays
+### describing the score of every match in play and returns an array of probabilities, so it is called once
+### per point for all the matches rather than once per point per match. Or, when the probability only depends
+### on who is serving, it can be written as the two serve win probabilities of a pairing, which lets matches
+### be played in batches or solved exactly. The simulation functions detect and use both automatically.
+#########################################################################################################
+
+def serve_probability_function(serve_function):
+    """
+    Decorator to write a point win probability function that only depends on who is serving (e.g.
+    probability_model1 in tennis_simulation_example.py).
+
+    The decorated function is called as serve_function(player0, player1, **kwargs) and returns a tuple of the
+    probability player 0 wins a point on their serve and the probability player 1 wins a point on their serve.
+
+    The returned function can still be used anywhere a point win probability function taking
+    (Tmatch, player0, player1, **kwargs) is expected. The serve function is available as its serve_probabilities
+    attribute.
+    """
+    @wraps(serve_function)
+    def player0_win_probability_function(tmatch, player0=None, player1=None, **kwargs):
+        player0_serve_win_probability, player1_serve_win_probability = serve_function(player0, player1, **kwargs)
+        if tmatch.current_set.current_game.is_player0_server:
+            return player0_serve_win_probability
+        return 1 - player1_serve_win_probability
+
+    player0_win_probability_function.serve_probabilities = serve_function
+    return player0_win_probability_function
+
+
+def is_serve_probability_function(player0_win_probability_function):
+    """Whether the function was created with serve_probability_function"""
+    return callable(getattr(player0_win_probability_function, 'serve_probabilities', None))
+
+
+def batch_probability_function(batch_function):
+    """
+    Decorator to write a point win probability function for a batch of matches.
+
+    The decorated function is called as batch_function(state, players0, players1, **kwargs) where state is a
+    dictionary of arrays with an entry for each match in play:
+        match_index: position of the match in players0 and players1
+        is_player0_server, is_tiebreak
+        player0_points, player1_points (long deuces and tiebreaks are reduced, e.g. 5-5 in a game is given as 3-3)
+        player0_games, player1_games, player0_sets, player1_sets
+    and it returns an array of the probability that player 0 wins the next point of each match.
+
+    The returned function can still be used anywhere a point win probability function taking
+    (Tmatch, player0, player1, **kwargs) is expected. The batch function is available as its batch attribute.
+    """
+    @wraps(batch_function)
+    def player0_win_probability_function(tmatch, player0=None, player1=None, **kwargs):
+        return float(batch_function(match_state_features(tmatch), [player0], [player1], **kwargs)[0])
+
+    player0_win_probability_function.batch = batch_function
+    return player0_win_probability_function
+
+
+def is_batch_probability_function(player0_win_probability_function):
+    """Whether the function was created with batch_probability_function"""
+    return callable(getattr(player0_win_probability_function, 'batch', None))
+
+
+def match_state_features(tmatch):
+    """Returns the dictionary of score arrays given to a batch probability function, for a single Tmatch"""
+    tgame = tmatch.current_set.current_game
+    is_tiebreak = isinstance(tgame, Ttiebreak)
+    if not is_tiebreak:
+        points_required = tgame.match_format.points_required
+    elif tgame.is_match_tiebreak:
+        points_required = tgame.match_format.match_tiebreak_points
+    else:
+        points_required = tgame.match_format.points_tiebreak_required
+    player0_points, player1_points = _reduce_point_score(tgame.player0_points, tgame.player1_points, points_required,
+                                                         is_tiebreak)
+    return {'match_index': np.zeros(1, dtype=int),
+            'is_player0_server': np.array([tgame.is_player0_server]), 'is_tiebreak': np.array([is_tiebreak]),
+            'player0_points': np.array([player0_points]), 'player1_points': np.array([player1_points]),
+            'player0_games': np.array([tmatch.current_set.player0_games]),
+            'player1_games': np.array([tmatch.current_set.player1_games]),
+            'player0_sets': np.array([tmatch.player0_sets]), 'player1_sets': np.array([tmatch.player1_sets])}
+
+
+def stochastic_simulation_matches(player0_win_probability_function, players0, players1, keep_history=True, rng=None,
+                                  match_format=None, **kwargs):
+    """
+    Create and randomly play a match between each pair of players in players0 and players1.
+
+    If player0_win_probability_function is a batch or serve probability function, all the matches are played together
+    and the probabilities are worked out once per point for all of them. Otherwise the matches are played one after
+    another with stochastic_simulation_match.
+    Without keep_history, batch results are built from the set scores rather than replaying every point.
+    rng is a seed, numpy Generator or UniformStream to draw the random numbers from (see random_stream), the global
+    numpy random state if None. match_format is the tennistools.MatchFormat of the matches, BEST_OF_FIVE by default.
+
+    :return: list of Tmatch, one per pair of players
+    """
+    rng = random_stream(rng)
+    if is_serve_probability_function(player0_win_probability_function):
+        serve_win_probabilities = np.array([player0_win_probability_function.serve_probabilities(player0, player1, **kwargs)
+                                            for player0, player1 in zip(players0, players1)], dtype=float).reshape(-1, 2)
+        player0_win_probability_batch = _serve_win_probability
+        match_arrays = _serve_win_probability_arrays(serve_win_probabilities[:, 0], serve_win_probabilities[:, 1],
+                                                     len(players0))
+    elif is_batch_probability_function(player0_win_probability_function):
+        tables = _point_state_tables(BEST_OF_FIVE if match_format is None else match_format)
+        batch_function = player0_win_probability_function.batch
+
+        def player0_win_probability_batch(state):
+            features = dict(state)
+            features['is_tiebreak'] = tables['is_tiebreak'][state['point_state']]
+            features['player0_points'] = tables['player0_points'][state['point_state']]
+            features['player1_points'] = tables['player1_points'][state['point_state']]
+            return batch_function(features, players0, players1, **kwargs)
+        match_arrays = {}
+    else:
+        return [stochastic_simulation_match(player0_win_probability_function, player0, player1, keep_history, rng,
+                                            match_format, **kwargs)
+                for player0, player1 in zip(players0, players1)]
+
+    #random assign first server
+    is_player0_first_server = _uniform(size=len(players0), rng=rng) < 0.5
+    results = _stochastic_simulation_match_batch(len(players0), player0_win_probability_batch,
+                                                 is_player0_first_server, record_points=keep_history, rng=rng,
+                                                 match_format=match_format, **match_arrays)
+    if not keep_history:
+        # Only the result is needed, so the matches are built from the set scores rather than replaying every point
+        _, set_scores, game_scores, points_played = results
+        tmatches = []
+        for is_player0_server, n_sets, match_game_scores, match_points_played in zip(
+                is_player0_first_server.tolist(), set_scores.sum(axis=1).tolist(), game_scores.tolist(),
+                points_played.tolist()):
+            tmatch = Tmatch(is_player0_server, keep_history=False, match_format=match_format)
+            for player0_games, player1_games in match_game_scores[:n_sets]:
+                tmatch.play_set(player0_games, player1_games)
+            tmatch.points_played = match_points_played
+            tmatches.append(tmatch)
+        return tmatches
+
+    # Replay the points to give the same Tmatch objects as playing the matches one at a time
+    points = results[-1]
+    tmatches = []
+    for is_player0_server, match_points in zip(is_player0_first_server, points):
+        tmatch = Tmatch(bool(is_player0_server), keep_history=keep_history, match_format=match_format)
+        for is_player0_point_winner in match_points.tolist():
+            tmatch.play_point(is_player0_point_winner)
+        tmatches.append(tmatch)
+    return tmatches
@@ -1,5 +1,7 @@
-from tennistools.simulation import stochastic_simulation_match
+from tennistools.simulation import stochastic_simulation_matches, _uniform, random_stream
+from tennistools.instrumentation import timed
 import math
+import numpy as np
 from itertools import chain, zip_longest
 
 
@@ -16,18 +18,62 @@ def calculate_bye_rounds(playerlist):
     return [x for x in chain.from_iterable(zip_longest(playerlist, byes_required*[{'name':None}])) if x is not None]
 
 
-def simulate_competition_round(playerlist, player0_win_probability_function, previous_match_history = None, **kwargs):
+def calculate_bracket_slots(n_players):
+    """Returns an array with the position in the playerlist of the player in each slot of the first round, using the
+    same layout as calculate_bye_rounds. Byes are given as -1"""
+    slots = calculate_bye_rounds(list(range(n_players)))
+    return np.array([-1 if isinstance(slot, dict) else slot for slot in slots], dtype=int)
+
+
+@timed('competition_round', 'rounds')
+def simulate_competition_round(playerlist, player0_win_probability_function, previous_match_history = None,
+                               results_only=False, match_probability_cache=None, rng=None, match_format=None,
+                               **kwargs):
     """
     Simulates a single round of a competition. Returns a list of winners and adds additional match instances to
      dictionary file that maintains history of the games.
 
     :param playerlist: list of player objects
-    :param player0_win_probability_function: A function that takes Tmatch, Player, Player as arguments and returns a probabilty
+    :param player0_win_probability_function: A function that takes Tmatch, Player, Player as arguments and returns a probabilty,
+    or a batch probability function (see tennistools.simulation.batch_probability_function)
     :param previous_match_history: A dictionary of dictionary of matches
+    :param results_only: If True, matches are played keeping only the running score and the history only records the
+    match_winner, set_scores and points_played of each match, not the match itself
+    :param match_probability_cache: A tennistools.match_cache.MatchProbabilityCache. If given, and it can calculate
+    probabilities for player0_win_probability_function (see MatchProbabilityCache.can_calculate), matches are not
+    played, each winner is drawn with a single random number from the cached probability of the pairing and the history
+    only records the match_winner and win_probability of each match. Otherwise the matches are played as usual
+    :param rng: A seed, numpy Generator or tennistools.simulation.UniformStream to draw the random numbers from, the
+    global numpy random state if None
+    :param match_format: The tennistools.MatchFormat of the matches, BEST_OF_FIVE by default
     :param kwargs: Any other features that are used in the player0_win_probabiltiy_function
     """
     if previous_match_history is None:
         previous_match_history = {}
+    rng = random_stream(rng)
+
+    if match_probability_cache is not None and \
+            match_probability_cache.can_calculate(player0_win_probability_function, match_format):
+        round_matches = {}
+        round_winners = []
+        for game_number, (player0, player1) in enumerate(zip(playerlist[::2], playerlist[1::2])):
+            if player1['name'] is None:
+                round_winners.append(player0)
+            else:
+                win_probability = match_probability_cache.get(player0_win_probability_function, player0, player1,
+                                                              match_format, **kwargs)
+                match_winner = int(_uniform(rng=rng) >= win_probability)
+                round_winners.append([player0, player1][match_winner])
+                round_matches[game_number] = {'player0':player0, 'player1':player1, 'match_winner':match_winner,
+                                              'win_probability':win_probability}
+        previous_match_history[len(previous_match_history)] = round_matches
+        return round_winners, previous_match_history
+
+    # Matches are played together so a batch probability function is called once per point for the whole round
+    pairs = [(player0, player1) for player0, player1 in zip(playerlist[::2], playerlist[1::2]) if player1['name'] is not None]
+    tmatches = iter(stochastic_simulation_matches(player0_win_probability_function, [pair[0] for pair in pairs],
+                                                  [pair[1] for pair in pairs], keep_history=not results_only, rng=rng,
+                                                  match_format=match_format, **kwargs))
 
     round_matches = {}
     round_winners = []
@@ -35,14 +81,21 @@ def simulate_competition_round(playerlist, player0_win_probability_function, pre
         if player1['name'] is None: #Dealing with any byes by awarding the win
             round_winners.append(player0)
         else:
-            tmatch = stochastic_simulation_match(player0_win_probability_function, player0=player0, player1=player1, **kwargs)
+            tmatch = next(tmatches)
             round_winners.append([player0, player1][tmatch.match_winner])
-            round_matches[game_number] = {'player0':player0, 'player1':player1, 'match':tmatch}
+            if results_only:
+                round_matches[game_number] = {'player0':player0, 'player1':player1, 'match_winner':tmatch.match_winner,
+                                              'set_scores':tmatch.set_scores, 'points_played':tmatch.points_played}
+            else:
+                round_matches[game_number] = {'player0':player0, 'player1':player1, 'match':tmatch,
+                                              'match_winner':tmatch.match_winner}
 
     previous_match_history[len(previous_match_history)] = round_matches
     return round_winners, previous_match_history
 
-def simulate_competition(playerlist, player0_win_probability_function, **kwargs):
+@timed('competition', 'competitions')
+def simulate_competition(playerlist, player0_win_probability_function, results_only=False,
+                         match_probability_cache=None, rng=None, match_format=None, **kwargs):
     """
     Simulates a full single elimination round of tennis. Iteratively calls play_round until there is only
     1 player (the winner) remaining.
@@ -50,13 +103,76 @@ def simulate_competition(playerlist, player0_win_probability_function, **kwargs)
     :param playerlist: A list of dictionary objects that represent a player.
     :param player0_win_probability_function: A function that takes TMatch, player0, player1 as inputs and returns
     a probability
+    :param results_only: If True, only the winner and set scores of each match are kept (see simulate_competition_round)
+    :param match_probability_cache: If given, winners are drawn from cached match win probabilities (see
+    simulate_competition_round)
+    :param rng: A seed, numpy Generator or tennistools.simulation.UniformStream to draw the random numbers from, the
+    global numpy random state if None. The same seed always gives the same competition
+    :param match_format: The tennistools.MatchFormat of the matches, BEST_OF_FIVE by default
     :param kwargs:
     :return:
     """
     previous_match_history = {}
+    rng = random_stream(rng)
     playerlist = calculate_bye_rounds(playerlist)
     while len(playerlist) > 1:
         playerlist, previous_match_history = simulate_competition_round(playerlist, player0_win_probability_function,
-                                                                        previous_match_history, **kwargs)
+                                                                        previous_match_history, results_only,
+                                                                        match_probability_cache, rng, match_format,
+                                                                        **kwargs)
+
+    return playerlist[0], previous_match_history
+
+def calculate_rounds_won(playerlist, match_history):
+    """
+    Returns an array with the number of rounds won by each player in a simulated competition, including any bye.
+    A player reached round r if they won at least r rounds, the winner won every round.
+
+    :param playerlist: The list of players given to simulate_competition
+    :param match_history: The match history returned by simulate_competition
+    """
+    position = {id(player): i for i, player in enumerate(playerlist)}
+    rounds_won = np.zeros(len(playerlist), dtype=int)
+    slots = calculate_bracket_slots(len(playerlist))
+    rounds_won[slots[::2][slots[1::2] < 0]] += 1
+    for round_matches in match_history.values():
+        for match in round_matches.values():
+            rounds_won[position[id([match['player0'], match['player1']][match['match_winner']])]] += 1
+    return rounds_won
+
+
+def calculate_competition_probabilities(playerlist, win_probability_matrix):
+    """
+    Calculates exactly, without simulation, the probability of each player reaching each round of the competition.
+    The probability of reaching a round is carried forward through the bracket one round at a time.
+
+    :param playerlist: A list of dictionary objects that represent a player, in the order given to simulate_competition
+    :param win_probability_matrix: n x n array where entry [i, j] is the probability player i beats player j
+    :return: array of shape (rounds + 1) x n. Row r is the probability of each player reaching round r (row 0 is the
+    first round), the last row is the probability of winning the competition
+    """
+    win_probability_matrix = np.asarray(win_probability_matrix, dtype=float)
+    slots = calculate_bracket_slots(len(playerlist))
+    is_player = slots >= 0
+    n_slots = len(slots)
+    rounds = int(math.log2(n_slots))
+
+    # Win probabilities between the slots, a bye never wins
+    slot_players = np.where(is_player, slots, 0)
+    slot_win_probability = win_probability_matrix[np.ix_(slot_players, slot_players)] * np.outer(is_player, is_player)
+
+    reach = np.zeros((rounds + 1, n_slots))
+    reach[0] = is_player
+    slot_numbers = np.arange(n_slots)
+    for round_number in range(rounds):
+        # The opponent comes from the neighbouring block of 2^round_number slots. If that block only holds byes
+        # (opponent_reach is 0) the player goes through
+        block = slot_numbers // 2 ** round_number
+        is_opponent = (block[:, None] ^ 1) == block[None, :]
+        opponent_reach = is_opponent @ reach[round_number]
+        beat_opponent = (slot_win_probability * is_opponent) @ reach[round_number]
+        reach[round_number + 1] = reach[round_number] * (beat_opponent + 1 - opponent_reach)
 
-    return playerlist[0], previous_match_history
\ No newline at end of file
+    probabilities = np.zeros((rounds + 1, len(playerlist)))
+    probabilities[:, slots[is_player]] = reach[:, is_player]
+    return probabilities
@@ -0,0 +1,424 @@
+#########################################################################################################
+### Exact solver
+### When the chance of winning a point depends only on who is serving, the chance of winning a game,
+### tiebreak, set and match can be calculated exactly by working forward (or backward) over the scores,
+### using the same rules as Tgame, Ttiebreak, Tset and Tmatch. No simulation is needed.
+###
+### player0_serve_win_probability: probability player 0 wins a point when player 0 is serving
+### player1_serve_win_probability: probability player 1 wins a point when player 1 is serving
+#########################################################################################################
+
+from collections import defaultdict
+from functools import lru_cache
+
+import numpy as np
+
+from tennistools import SETS_REQUIRED, GAMES_REQUIRED, POINTS_REQUIRED, POINTS_TIEBREAK_REQUIRED
+
+
+# Long deuces and tiebreaks are cut off once the remaining probability is below this
+_TAIL_TOLERANCE = 1e-16
+
+# The caches are keyed on the serve probabilities, so they are bounded for callers whose probabilities keep changing
+# (e.g. live pricing). A pair of serve probabilities takes around 16 game, 130 tiebreak and a few set entries
+_GAME_CACHE_SIZE = 8192
+_TIEBREAK_CACHE_SIZE = 32768
+_SET_CACHE_SIZE = 4096
+_MATCH_CACHE_SIZE = 1024
+
+
+def _is_set_over(player0_games, player1_games):
+    """Same rule as Tset.is_set_over"""
+    maxgames = max(player0_games, player1_games)
+    mingames = min(player0_games, player1_games)
+    return (maxgames == GAMES_REQUIRED and maxgames >= mingames + 2) or maxgames == GAMES_REQUIRED + 1
+
+
+@lru_cache(maxsize=_GAME_CACHE_SIZE)
+def game_win_probability(server_win_probability, server_points=0, receiver_points=0):
+    """Returns the probability the server wins a (non tiebreak) game from the given score"""
+    p = server_win_probability
+    q = 1 - p
+    if server_points >= POINTS_REQUIRED and server_points >= receiver_points + 2:
+        return 1.0
+    if receiver_points >= POINTS_REQUIRED and receiver_points >= server_points + 2:
+        return 0.0
+    if server_points >= POINTS_REQUIRED - 1 and receiver_points >= POINTS_REQUIRED - 1:
+        # From deuce the server has to win two points in a row before the receiver does
+        deuce = p * p / (p * p + q * q)
+        if server_points == receiver_points:
+            return deuce
+        elif server_points > receiver_points:
+            return p + q * deuce
+        else:
+            return p * deuce
+    return p * game_win_probability(p, server_points + 1, receiver_points) + \
+        q * game_win_probability(p, server_points, receiver_points + 1)
+
+
+def game_score_distribution(server_win_probability):
+    """Returns a dictionary of the probability of each final score of a (non tiebreak) game, as (server points,
+    receiver points). Games that go to deuce more often than is ever likely (probability below 1e-16) are left out"""
+    p = server_win_probability
+    q = 1 - p
+    distribution = {}
+    for points_lost in range(POINTS_REQUIRED - 1):
+        # The winner takes the last point and any POINTS_REQUIRED - 1 of the points before it
+        ways = _binomial(POINTS_REQUIRED - 1 + points_lost, points_lost)
+        distribution[(POINTS_REQUIRED, points_lost)] = ways * p ** POINTS_REQUIRED * q ** points_lost
+        distribution[(points_lost, POINTS_REQUIRED)] = ways * q ** POINTS_REQUIRED * p ** points_lost
+    deuce = _binomial(2 * POINTS_REQUIRED - 2, POINTS_REQUIRED - 1) * (p * q) ** (POINTS_REQUIRED - 1)
+    _add_deuce_scores(distribution, deuce, p * p, q * q, POINTS_REQUIRED - 1)
+    return distribution
+
+
+def _binomial(n, k):
+    ways = 1
+    for i in range(k):
+        ways = ways * (n - i) // (i + 1)
+    return ways
+
+
+def _add_deuce_scores(distribution, level, win_both, lose_both, points):
+    """Adds the scores reached from a level score, where the next two points either win, lose or level it again"""
+    if win_both + lose_both == 0:
+        raise ValueError('Each player always wins their serve, so a level score is never broken')
+    level_again = 1 - win_both - lose_both
+    while abs(level) > _TAIL_TOLERANCE:
+        distribution[(points + 2, points)] = level * win_both
+        distribution[(points, points + 2)] = level * lose_both
+        level = level * level_again
+        points += 1
+
+
+@lru_cache(maxsize=_TIEBREAK_CACHE_SIZE)
+def tiebreak_win_probability(player0_serve_win_probability, player1_serve_win_probability, is_player0_server,
+                             player0_points=0, player1_points=0):
+    """
+    Returns the probability player 0 wins a tiebreak from the given score
+
+    :param is_player0_server: Whether player 0 served the first point of the tiebreak. As in Ttiebreak, the serve
+    changes after the first point and then every two points
+    """
+    a = player0_serve_win_probability
+    b = 1 - player1_serve_win_probability
+    maxpoints = max(player0_points, player1_points)
+    if maxpoints >= POINTS_TIEBREAK_REQUIRED and abs(player0_points - player1_points) >= 2:
+        return 1.0 if player0_points > player1_points else 0.0
+    if player0_points == player1_points and player0_points >= POINTS_TIEBREAK_REQUIRED - 1:
+        # At level scores each player serves one of the next two points, which decide the tiebreak or level it again
+        return a * b / (a * b + (1 - a) * (1 - b))
+
+    points_played = player0_points + player1_points
+    is_player0_serving = is_player0_server != (((points_played + 1) // 2) % 2 == 1)
+    p = a if is_player0_serving else b
+    return p * tiebreak_win_probability(a, player1_serve_win_probability, is_player0_server,
+                                        player0_points + 1, player1_points) + \
+        (1 - p) * tiebreak_win_probability(a, player1_serve_win_probability, is_player0_server,
+                                           player0_points, player1_points + 1)
+
+
+def tiebreak_score_distribution(player0_serve_win_probability, player1_serve_win_probability, is_player0_server):
+    """Returns a dictionary of the probability of each final score of a tiebreak, as (player 0 points, player 1
+    points). is_player0_server is whether player 0 serves the first point. Tiebreaks that are still level after more
+    points than is ever likely (probability below 1e-16) are left out"""
+    a = player0_serve_win_probability
+    b = 1 - player1_serve_win_probability
+    level_points = POINTS_TIEBREAK_REQUIRED - 1
+    distribution = {}
+    in_play = {(0, 0): 1.0}
+    while in_play:
+        next_in_play = defaultdict(float)
+        for (points0, points1), probability in in_play.items():
+            if max(points0, points1) >= POINTS_TIEBREAK_REQUIRED and abs(points0 - points1) >= 2:
+                distribution[(points0, points1)] = probability
+                continue
+            if points0 == level_points and points1 == level_points:
+                _add_deuce_scores(distribution, probability, a * b, (1 - a) * (1 - b), level_points)
+                continue
+            points_played = points0 + points1
+            p = a if is_player0_server != (((points_played + 1) // 2) % 2 == 1) else b
+            next_in_play[(points0 + 1, points1)] += probability * p
+            next_in_play[(points0, points1 + 1)] += probability * (1 - p)
+        in_play = next_in_play
+    return distribution
+
+
+@lru_cache(maxsize=_SET_CACHE_SIZE)
+def _set_score_distribution(player0_serve_win_probability, player1_serve_win_probability, is_player0_server,
+                            player0_games, player1_games):
+    player0_hold = game_win_probability(player0_serve_win_probability)
+    player0_break = 1 - game_win_probability(player1_serve_win_probability)
+    games_played = player0_games + player1_games
+
+    distribution = defaultdict(float)
+    in_play = {(player0_games, player1_games): 1.0}
+    while in_play:
+        next_in_play = defaultdict(float)
+        for (games0, games1), probability in in_play.items():
+            if _is_set_over(games0, games1):
+                distribution[(games0, games1)] += probability
+                continue
+            is_player0_serving = is_player0_server != ((games0 + games1 - games_played) % 2 == 1)
+            if games0 == GAMES_REQUIRED and games1 == GAMES_REQUIRED:
+                player0_win = tiebreak_win_probability(player0_serve_win_probability, player1_serve_win_probability,
+                                                       is_player0_serving)
+            else:
+                player0_win = player0_hold if is_player0_serving else player0_break
+            next_in_play[(games0 + 1, games1)] += probability * player0_win
+            next_in_play[(games0, games1 + 1)] += probability * (1 - player0_win)
+        in_play = next_in_play
+    return tuple(distribution.items())
+
+
+def set_score_distribution(player0_serve_win_probability, player1_serve_win_probability, is_player0_server,
+                           player0_games=0, player1_games=0):
+    """
+    Returns a dictionary of the probability of each final set score, e.g. {(6, 4): 0.12, ...}
+
+    :param is_player0_server: Whether player 0 serves the next game of the set
+    :param player0_games: Games won so far in the set by player 0
+    :param player1_games: Games won so far in the set by player 1
+    """
+    return dict(_set_score_distribution(player0_serve_win_probability, player1_serve_win_probability,
+                                        is_player0_server, player0_games, player1_games))
+
+
+def set_win_probability(player0_serve_win_probability, player1_serve_win_probability, is_player0_server,
+                        player0_games=0, player1_games=0):
+    """Returns the probability player 0 wins the set. See set_score_distribution"""
+    distribution = _set_score_distribution(player0_serve_win_probability, player1_serve_win_probability,
+                                           is_player0_server, player0_games, player1_games)
+    return sum(probability for (games0, games1), probability in distribution if games0 > games1)
+
+
+@lru_cache(maxsize=_MATCH_CACHE_SIZE)
+def _match_score_distribution(player0_serve_win_probability, player1_serve_win_probability, is_player0_server,
+                              player0_sets, player1_sets):
+    distribution = defaultdict(float)
+    in_play = {(player0_sets, player1_sets, is_player0_server): 1.0}
+    while in_play:
+        next_in_play = defaultdict(float)
+        for (sets0, sets1, is_player0_serving), probability in in_play.items():
+            if max(sets0, sets1) == SETS_REQUIRED:
+                distribution[(sets0, sets1)] += probability
+                continue
+            for (games0, games1), set_probability in _set_score_distribution(
+                    player0_serve_win_probability, player1_serve_win_probability, is_player0_serving, 0, 0):
+                # The serve changes after every game, including a tiebreak, and carries into the next set
+                is_player0_next_server = is_player0_serving != ((games0 + games1) % 2 == 1)
+                next_score = (sets0 + 1, sets1) if games0 > games1 else (sets0, sets1 + 1)
+                next_in_play[next_score + (is_player0_next_server,)] += probability * set_probability
+        in_play = next_in_play
+    return tuple(distribution.items())
+
+
+def match_score_distribution(player0_serve_win_probability, player1_serve_win_probability, is_player0_server=None,
+                             player0_sets=0, player1_sets=0):
+    """
+    Returns a dictionary of the probability of each final match score in sets, e.g. {(3, 1): 0.21, ...}
+
+    :param is_player0_server: Whether player 0 serves the first game of the next set. If None the first server is
+    picked at random, as in stochastic_simulation_match
+    :param player0_sets: Sets won so far by player 0
+    :param player1_sets: Sets won so far by player 1
+    """
+    if is_player0_server is None:
+        distribution = defaultdict(float)
+        for is_player0_first_server in [True, False]:
+            for score, probability in _match_score_distribution(player0_serve_win_probability,
+                                                                player1_serve_win_probability,
+                                                                is_player0_first_server, player0_sets, player1_sets):
+                distribution[score] += probability / 2
+        return dict(distribution)
+    return dict(_match_score_distribution(player0_serve_win_probability, player1_serve_win_probability,
+                                          is_player0_server, player0_sets, player1_sets))
+
+
+def match_win_probability(player0_serve_win_probability, player1_serve_win_probability, is_player0_server=None,
+                          player0_sets=0, player1_sets=0):
+    """Returns the probability player 0 wins the match. See match_score_distribution"""
+    distribution = match_score_distribution(player0_serve_win_probability, player1_serve_win_probability,
+                                            is_player0_server, player0_sets, player1_sets)
+    return sum(probability for (sets0, sets1), probability in distribution.items() if sets0 > sets1)
+
+
+def _outcome_table(distribution):
+    scores = np.array(list(distribution.keys()), dtype=int)
+    probabilities = np.array(list(distribution.values()), dtype=float)
+    table = {'scores': scores, 'probabilities': probabilities, 'cumulative': np.cumsum(probabilities)}
+    for array in table.values():
+        array.flags.writeable = False
+    return table
+
+
+@lru_cache(maxsize=_MATCH_CACHE_SIZE)
+def outcome_tables(player0_serve_win_probability, player1_serve_win_probability):
+    """
+    Returns tables of the final scores of a game, a tiebreak and a set, and their probabilities, to sample results
+    without playing every point. The tables are cached for each pair of serve probabilities.
+
+    :return: dictionary with 'game', 'tiebreak' and 'set' entries. Each is a dictionary keyed by whether player 0
+    serves (first) of a table with 'scores' (array of player 0, player 1 points or games), 'probabilities' and
+    'cumulative' (cumulative probabilities, for sampling with numpy.searchsorted)
+    """
+    tables = {'game': {}, 'tiebreak': {}, 'set': {}}
+    for is_player0_server in [True, False]:
+        server_win_probability = player0_serve_win_probability if is_player0_server else player1_serve_win_probability
+        game = game_score_distribution(server_win_probability)
+        if not is_player0_server:
+            game = {(receiver_points, server_points): probability
+                    for (server_points, receiver_points), probability in game.items()}
+        tables['game'][is_player0_server] = _outcome_table(game)
+        tables['tiebreak'][is_player0_server] = _outcome_table(tiebreak_score_distribution(
+            player0_serve_win_probability, player1_serve_win_probability, is_player0_server))
+        tables['set'][is_player0_server] = _outcome_table(dict(_set_score_distribution(
+            player0_serve_win_probability, player1_serve_win_probability, is_player0_server, 0, 0)))
+    return tables
+
+
+@lru_cache(maxsize=_MATCH_CACHE_SIZE)
+def _match_win_from_game_start(player0_serve_win_probability, player1_serve_win_probability):
+    """Returns a function of (player0_sets, player1_sets, player0_games, player1_games, is_player0_server) giving the
+    probability player 0 wins the match from the start of a game. Each score is worked out once and remembered"""
+    player0_hold = game_win_probability(player0_serve_win_probability)
+    player0_break = 1 - game_win_probability(player1_serve_win_probability)
+    table = {}
+
+    def match_win(sets0, sets1, games0, games1, is_player0_serving):
+        if _is_set_over(games0, games1):
+            sets0, sets1 = (sets0 + 1, sets1) if games0 > games1 else (sets0, sets1 + 1)
+            games0 = games1 = 0
+        if max(sets0, sets1) == SETS_REQUIRED:
+            return 1.0 if sets0 > sets1 else 0.0
+        key = (sets0, sets1, games0, games1, is_player0_serving)
+        if key not in table:
+            if games0 == GAMES_REQUIRED and games1 == GAMES_REQUIRED:
+                player0_win = tiebreak_win_probability(player0_serve_win_probability, player1_serve_win_probability,
+                                                       is_player0_serving)
+            else:
+                player0_win = player0_hold if is_player0_serving else player0_break
+            # The serve changes after every game, including a tiebreak, and carries into the next set
+            table[key] = player0_win * match_win(sets0, sets1, games0 + 1, games1, not is_player0_serving) + \
+                (1 - player0_win) * match_win(sets0, sets1, games0, games1 + 1, not is_player0_serving)
+        return table[key]
+
+    return match_win
+
+
+def match_win_probability_from_score(player0_serve_win_probability, player1_serve_win_probability, player0_sets,
+                                     player1_sets, player0_games, player1_games, player0_points, player1_points,
+                                     is_player0_server):
+    """
+    Returns the probability player 0 wins the match from a score part way through a game. Results from the start of
+    each game are remembered for the most recent 1024 pairs of serve probabilities, so once a pair has been seen only
+    the current game is worked out, in microseconds, which is quick enough to call after every point. The first call
+    for a new pair works out the whole match and takes around a millisecond.
+
+    :param player0_points: Points won so far in the current game (or tiebreak) by player 0
+    :param player1_points: Points won so far in the current game (or tiebreak) by player 1
+    :param is_player0_server: Whether player 0 served the first point of the current game (or tiebreak)
+    """
+    if max(player0_sets, player1_sets) == SETS_REQUIRED:
+        return 1.0 if player0_sets > player1_sets else 0.0
+    if player0_games == GAMES_REQUIRED and player1_games == GAMES_REQUIRED:
+        player0_game_win = tiebreak_win_probability(player0_serve_win_probability, player1_serve_win_probability,
+                                                    is_player0_server, player0_points, player1_points)
+    elif is_player0_server:
+        player0_game_win = game_win_probability(player0_serve_win_probability, player0_points, player1_points)
+    else:
+        player0_game_win = 1 - game_win_probability(player1_serve_win_probability, player1_points, player0_points)
+
+    match_win = _match_win_from_game_start(player0_serve_win_probability, player1_serve_win_probability)
+    return player0_game_win * match_win(player0_sets, player1_sets, player0_games + 1, player1_games,
+                                        not is_player0_server) + \
+        (1 - player0_game_win) * match_win(player0_sets, player1_sets, player0_games, player1_games + 1,
+                                           not is_player0_server)
+
+
+def _game_win_probabilities(server_win_probabilities):
+    """Array version of game_win_probability from the start of a game"""
+    p = server_win_probabilities
+    q = 1 - p
+    win = 0
+    for points_lost in range(POINTS_REQUIRED - 1):
+        win = win + _binomial(POINTS_REQUIRED - 1 + points_lost, points_lost) * p ** POINTS_REQUIRED * q ** points_lost
+    deuce = _binomial(2 * POINTS_REQUIRED - 2, POINTS_REQUIRED - 1) * (p * q) ** (POINTS_REQUIRED - 1)
+    return win + deuce * p * p / (p * p + q * q)
+
+
+def _tiebreak_win_probabilities(player0_serve_win_probabilities, player1_serve_win_probabilities, is_player0_server):
+    """Array version of tiebreak_win_probability from the start of a tiebreak"""
+    a = player0_serve_win_probabilities
+    b = 1 - player1_serve_win_probabilities
+    win = 0
+    in_play = {(0, 0): 1}
+    while in_play:
+        next_in_play = defaultdict(int)
+        for (points0, points1), probability in in_play.items():
+            if max(points0, points1) >= POINTS_TIEBREAK_REQUIRED and abs(points0 - points1) >= 2:
+                if points0 > points1:
+                    win = win + probability
+                continue
+            if points0 == points1 and points0 >= POINTS_TIEBREAK_REQUIRED - 1:
+                win = win + probability * a * b / (a * b + (1 - a) * (1 - b))
+                continue
+            p = a if is_player0_server != (((points0 + points1 + 1) // 2) % 2 == 1) else b
+            next_in_play[(points0 + 1, points1)] += probability * p
+            next_in_play[(points0, points1 + 1)] += probability * (1 - p)
+        in_play = next_in_play
+    return win
+
+
+def match_win_probabilities(player0_serve_win_probabilities, player1_serve_win_probabilities):
+    """
+    Array version of match_win_probability (with a random first server), for many pairs of serve probabilities at
+    once, e.g. every pairing of a draw. It is plain arithmetic on the arrays, so it also takes complex arrays (see
+    tennistools.sensitivity).
+
+    :param player0_serve_win_probabilities: Array of probabilities player 0 wins a point on their serve
+    :param player1_serve_win_probabilities: Array of probabilities player 1 wins a point on their serve, the same shape
+    :return: Array of the probability player 0 wins each match
+    """
+    player0_hold = _game_win_probabilities(player0_serve_win_probabilities)
+    player0_break = 1 - _game_win_probabilities(player1_serve_win_probabilities)
+    tiebreak = {is_player0_server: _tiebreak_win_probabilities(player0_serve_win_probabilities,
+                                                               player1_serve_win_probabilities, is_player0_server)
+                for is_player0_server in [True, False]}
+
+    # Probability of each result of a set given who serves first, keyed by whether player 0 wins it and whether an odd
+    # number of games is played (so the other player serves first in the next set)
+    set_results = {}
+    for is_player0_server in [True, False]:
+        results = defaultdict(int)
+        in_play = {(0, 0): 1}
+        while in_play:
+            next_in_play = defaultdict(int)
+            for (games0, games1), probability in in_play.items():
+                if _is_set_over(games0, games1):
+                    results[(games0 > games1, (games0 + games1) % 2 == 1)] += probability
+                    continue
+                is_player0_serving = is_player0_server != ((games0 + games1) % 2 == 1)
+                if games0 == GAMES_REQUIRED and games1 == GAMES_REQUIRED:
+                    player0_win = tiebreak[is_player0_serving]
+                else:
+                    player0_win = player0_hold if is_player0_serving else player0_break
+                next_in_play[(games0 + 1, games1)] += probability * player0_win
+                next_in_play[(games0, games1 + 1)] += probability * (1 - player0_win)
+            in_play = next_in_play
+        set_results[is_player0_server] = results
+
+    win = 0
+    in_play = {(0, 0, True): 0.5, (0, 0, False): 0.5}
+    while in_play:
+        next_in_play = defaultdict(int)
+        for (sets0, sets1, is_player0_serving), probability in in_play.items():
+            if max(sets0, sets1) == SETS_REQUIRED:
+                if sets0 > sets1:
+                    win = win + probability
+                continue
+            for (is_player0_set_winner, is_odd), set_probability in set_results[is_player0_serving].items():
+                next_score = (sets0 + 1, sets1) if is_player0_set_winner else (sets0, sets1 + 1)
+                next_in_play[next_score + (is_player0_serving != is_odd,)] += probability * set_probability
+        in_play = next_in_play
+    return win
@@ -0,0 +1,235 @@
+#########################################################################################################
+### Score state machine
+### Every score of a match (sets, games, points, who serves and whether it is a tiebreak) is numbered as a
+### state, and tables give the state after player 0 or player 1 wins the next point. Playing a point is then
+### a single list lookup rather than a chain of Tmatch, Tset and Tgame method calls. The point states of a
+### game are also used by the batch engine in tennistools.simulation, one numpy step per point.
+#########################################################################################################
+
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+from tennistools import Tmatch, BEST_OF_FIVE
+
+# Kinds of game in the point states
+_GAME, _TIEBREAK, _MATCH_TIEBREAK = 0, 1, 2
+
+
+def _reduce_point_score(player0_points, player1_points, points_required, is_tiebreak):
+    """Maps a score to the smallest score with the same future, e.g. 5-5 in a game is deuce (3-3).
+    Tiebreaks are reduced two points at a time so the serve rotation is unchanged"""
+    if is_tiebreak:
+        while min(player0_points, player1_points) >= points_required + 1:
+            player0_points, player1_points = player0_points - 2, player1_points - 2
+    else:
+        while min(player0_points, player1_points) >= points_required:
+            player0_points, player1_points = player0_points - 1, player1_points - 1
+    return player0_points, player1_points
+
+
+@lru_cache(maxsize=None)
+def _point_state_tables(match_format=BEST_OF_FIVE):
+    """
+    Enumerates every (reduced) score of a game, a tiebreak and (if the format has one) a match tiebreak as a point
+    state and returns lookup tables of:
+    next_state[2*state + is_player0_point_winner], is_game_over[2*state + is_player0_point_winner],
+    is_server_changed[state] (whether the serve has changed since the start of the game, only in tiebreaks),
+    player0_points[state], player1_points[state], is_tiebreak[state] and kind[state] (_GAME, _TIEBREAK or
+    _MATCH_TIEBREAK), along with the set_over, is_tiebreak_score
+    and match_over tables of the format as arrays.
+    State 0 is the start of a game, the states at tiebreak_start and match_tiebreak_start are the start of a tiebreak
+    and a match tiebreak, and the state at match_over never changes and never finishes a game.
+    """
+    points_required = {_GAME: match_format.points_required, _TIEBREAK: match_format.points_tiebreak_required,
+                       _MATCH_TIEBREAK: match_format.match_tiebreak_points}
+    # A no-ad game is won by the first to points_required
+    margin = {_GAME: 1 if match_format.is_no_ad else 2, _TIEBREAK: 2, _MATCH_TIEBREAK: 2}
+    scores = [(0, 0, _GAME), (0, 0, _TIEBREAK)]
+    if match_format.match_tiebreak_points is not None:
+        scores.append((0, 0, _MATCH_TIEBREAK))
+    index = {score: i for i, score in enumerate(scores)}
+    transitions = []
+    for player0_points, player1_points, kind in scores: #scores grows as new states are found
+        for is_player0_point_winner in [False, True]:
+            new_points = (player0_points + is_player0_point_winner, player1_points + (not is_player0_point_winner))
+            if max(new_points) >= points_required[kind] and abs(new_points[0] - new_points[1]) >= margin[kind]:
+                transitions.append((0, True))
+                continue
+            new_score = _reduce_point_score(*new_points, points_required[kind], kind != _GAME) + (kind,)
+            if new_score not in index:
+                index[new_score] = len(scores)
+                scores.append(new_score)
+            transitions.append((index[new_score], False))
+
+    match_over = len(scores)
+    transitions += [(match_over, False), (match_over, False)]
+    scores.append((0, 0, _GAME))
+    points_played = np.array([player0 + player1 for player0, player1, _ in scores])
+    is_tiebreak = np.array([kind != _GAME for _, _, kind in scores])
+    return {'next_state': np.array([state for state, _ in transitions]),
+            'is_game_over': np.array([is_game_over for _, is_game_over in transitions]),
+            'is_server_changed': is_tiebreak & (((points_played + 1) // 2) % 2 == 1),
+            'player0_points': np.array([player0 for player0, _, _ in scores]),
+            'player1_points': np.array([player1 for _, player1, _ in scores]),
+            'is_tiebreak': is_tiebreak,
+            'kind': np.array([kind for _, _, kind in scores]),
+            'tiebreak_start': 1,
+            'match_tiebreak_start': 2 if match_format.match_tiebreak_points is not None else None,
+            'match_over': match_over,
+            'set_over': np.array(match_format.set_over),
+            'is_tiebreak_score': np.array(match_format.is_tiebreak_score),
+            'match_format': match_format}
+
+
+@lru_cache(maxsize=None)
+def match_state_tables(match_format=BEST_OF_FIVE):
+    """
+    Numbers every score of a match in the format as a state and returns lookup tables (lists, which are quicker to
+    index one at a time than numpy arrays) of:
+        next_state[2*state + is_player0_point_winner]: the state after the point
+        set_score[2*state + is_player0_point_winner]: the games won by player 0, player 1 in the set if the point
+        finished a set, otherwise None
+        is_player0_serving[state]: whether player 0 serves the next point
+        scores[state]: the score as (player0_sets, player1_sets, player0_games, player1_games, point_state,
+        is_player0_game_server), where point_state is the state of the current game (see _point_state_tables) and
+        is_player0_game_server whether player 0 served its first point
+        start[is_player0_first_server]: the state at the start of the match
+        match_over: the first finished state. The states match_over and match_over + 1 are player 0 and player 1
+        having won, and never change
+    """
+    point_tables = _point_state_tables(match_format)
+    point_next_state = point_tables['next_state'].tolist()
+    is_point_game_over = point_tables['is_game_over'].tolist()
+    is_server_changed = point_tables['is_server_changed'].tolist()
+    has_match_tiebreak = match_format.match_tiebreak_points is not None
+
+    def first_point_state(sets0, sets1):
+        if has_match_tiebreak and match_format.is_deciding_set(sets0, sets1):
+            return point_tables['match_tiebreak_start']
+        return 0
+
+    starts = [(0, 0, 0, 0, first_point_state(0, 0), is_player0_first_server)
+              for is_player0_first_server in [False, True]]
+    scores = list(starts)
+    index = {score: i for i, score in enumerate(scores)}
+    transitions = []
+    for sets0, sets1, games0, games1, point_state, is_player0_game_server in scores: #scores grows as states are found
+        for is_player0_point_winner in [False, True]:
+            point_transition = 2 * point_state + is_player0_point_winner
+            set_score = None
+            if not is_point_game_over[point_transition]:
+                next_score = (sets0, sets1, games0, games1, point_next_state[point_transition], is_player0_game_server)
+            else:
+                next_games0, next_games1 = games0 + is_player0_point_winner, games1 + (not is_player0_point_winner)
+                # In a deciding set played as a match tiebreak the tiebreak is the whole set
+                if first_point_state(sets0, sets1) != 0 or match_format.set_over[next_games0][next_games1]:
+                    set_score = (next_games0, next_games1)
+                    next_sets0, next_sets1 = sets0 + is_player0_point_winner, sets1 + (not is_player0_point_winner)
+                    if match_format.match_over[next_sets0][next_sets1]:
+                        transitions.append((-1 if is_player0_point_winner else -2, set_score))
+                        continue
+                    next_score = (next_sets0, next_sets1, 0, 0, first_point_state(next_sets0, next_sets1),
+                                  not is_player0_game_server)
+                else:
+                    next_point_state = point_tables['tiebreak_start'] if \
+                        match_format.is_tiebreak_score[next_games0][next_games1] else 0
+                    next_score = (sets0, sets1, next_games0, next_games1, next_point_state, not is_player0_game_server)
+            if next_score not in index:
+                index[next_score] = len(scores)
+                scores.append(next_score)
+            transitions.append((index[next_score], set_score))
+
+    match_over = len(scores)
+    # Finished matches are numbered after every score in play
+    next_state = [match_over + (state == -2) if state < 0 else state for state, _ in transitions]
+    next_state += [match_over, match_over, match_over + 1, match_over + 1]
+    set_score = [score for _, score in transitions] + [None] * 4
+    is_player0_serving = [is_player0_game_server != is_server_changed[point_state]
+                          for _, _, _, _, point_state, is_player0_game_server in scores] + [False, False]
+    return {'next_state': next_state, 'set_score': set_score, 'is_player0_serving': is_player0_serving,
+            'scores': scores, 'start': [index[starts[0]], index[starts[1]]], 'match_over': match_over}
+
+
+# The result of a match played with play_match_states. points is a list of whether player 0 won each point, or None
+# if the points were not recorded
+MatchStateResult = namedtuple('MatchStateResult', ['match_winner', 'set_scores', 'points_played', 'points'])
+
+
+def play_match_states(player0_serve_win_probability, player1_serve_win_probability, is_player0_first_server, uniform,
+                      match_format=None, record_points=False):
+    """
+    Plays a match point by point through the state tables of match_state_tables, where the chance of winning a point
+    depends only on who is serving.
+
+    :param player0_serve_win_probability: Probability player 0 wins a point on their serve
+    :param player1_serve_win_probability: Probability player 1 wins a point on their serve
+    :param is_player0_first_server: Whether player 0 serves first
+    :param uniform: Function of no arguments returning a uniform random number, called once per point. Player 0 wins
+    the point if it is below their probability of winning it, as in stochastical_simulation_next_point
+    :param match_format: The tennistools.MatchFormat of the match, BEST_OF_FIVE by default
+    :param record_points: Whether to keep the points played, so the match can be rebuilt with its history
+    :return: MatchStateResult of match_winner, set_scores, points_played and points
+    """
+    tables = match_state_tables(BEST_OF_FIVE if match_format is None else match_format)
+    next_state, set_score, is_player0_serving = tables['next_state'], tables['set_score'], tables['is_player0_serving']
+    match_over = tables['match_over']
+    player0_receive_win_probability = 1 - player1_serve_win_probability
+
+    state = tables['start'][bool(is_player0_first_server)]
+    set_scores = []
+    points = [] if record_points else None
+    points_played = 0
+    while state < match_over:
+        is_player0_point_winner = uniform() < (player0_serve_win_probability if is_player0_serving[state]
+                                               else player0_receive_win_probability)
+        transition = 2 * state + is_player0_point_winner
+        state = next_state[transition]
+        points_played += 1
+        if record_points:
+            points.append(is_player0_point_winner)
+        if set_score[transition] is not None:
+            set_scores.append(set_score[transition])
+    return MatchStateResult(state - match_over, set_scores, points_played, points)
+
+
+def result_to_tmatch(result, is_player0_first_server, keep_history=False, match_format=None):
+    """
+    Returns the Tmatch of a MatchStateResult. With keep_history the recorded points are played through the Tmatch, so
+    it is the same as a match played point by point. Otherwise it is built from the set scores and only holds the
+    result (match_winner, get_match_score, set_scores and points_played)
+    """
+    tmatch = Tmatch(bool(is_player0_first_server), keep_history=keep_history, match_format=match_format)
+    if keep_history:
+        if result.points is None:
+            raise ValueError('The points of the match were not recorded')
+        for is_player0_point_winner in result.points:
+            tmatch.play_point(is_player0_point_winner)
+        return tmatch
+    for player0_games, player1_games in result.set_scores:
+        tmatch.play_set(player0_games, player1_games)
+    tmatch.points_played = result.points_played
+    return tmatch
+
+
+def encode_state(tmatch):
+    """Returns the state of the score of a Tmatch in the tables of match_state_tables for its format"""
+    tables = match_state_tables(tmatch.match_format)
+    if tmatch.is_match_over():
+        return tables['match_over'] + tmatch.match_winner
+    point_tables = _point_state_tables(tmatch.match_format)
+    snapshot = tmatch.snapshot()
+    if not snapshot.is_tiebreak:
+        kind, points_required = _GAME, tmatch.match_format.points_required
+    elif tmatch.current_set.is_match_tiebreak_set:
+        kind, points_required = _MATCH_TIEBREAK, tmatch.match_format.match_tiebreak_points
+    else:
+        kind, points_required = _TIEBREAK, tmatch.match_format.points_tiebreak_required
+    player0_points, player1_points = _reduce_point_score(snapshot.player0_points, snapshot.player1_points,
+                                                         points_required, kind != _GAME)
+    point_state, = np.flatnonzero((point_tables['player0_points'] == player0_points) &
+                                  (point_tables['player1_points'] == player1_points) &
+                                  (point_tables['kind'] == kind))[:1]
+    return tables['scores'].index((snapshot.player0_sets, snapshot.player1_sets, snapshot.player0_games,
+                                   snapshot.player1_games, point_state, snapshot.is_player0_server))
@@ -0,0 +1,211 @@
+#########################################################################################################
+### Scenario sweeps
+### Runs a table of scenarios (e.g. different seedings, player parameters or rules), each simulated many
+### times, across a pool of processes. Every chunk of replications is saved to an SQLite file as soon as it
+### finishes, so a sweep that is interrupted carries on where it stopped when it is run again, without
+### redoing finished chunks. Once all the chunks of a scenario are in, its reach counts and probabilities are
+### written to a results table with one column per quantity.
+#########################################################################################################
+
+import math
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from tennistools.monte_carlo import _simulate_competition_chunk, proportion_confidence_interval
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sweep (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS scenarios (name TEXT PRIMARY KEY, n_players INTEGER NOT NULL,
+    n_replications INTEGER NOT NULL, chunk_size INTEGER NOT NULL, is_complete INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS chunks (scenario TEXT NOT NULL, chunk INTEGER NOT NULL, n INTEGER NOT NULL,
+    reach_counts BLOB NOT NULL, PRIMARY KEY (scenario, chunk));
+CREATE TABLE IF NOT EXISTS results (scenario TEXT NOT NULL, round INTEGER NOT NULL, player INTEGER NOT NULL,
+    reach_count INTEGER NOT NULL, n INTEGER NOT NULL, probability REAL NOT NULL, lower REAL NOT NULL,
+    upper REAL NOT NULL, PRIMARY KEY (scenario, round, player));
+'''
+
+
+class SweepStore(object):
+    """
+    A class to keep the chunks and results of a sweep in an SQLite file
+
+    Attributes
+    ---------
+    path: The SQLite file
+    seed: Entropy of the sweep's random streams, saved with the sweep so a resumed sweep uses the same streams
+
+    Methods
+    ---------
+    add_scenario(name, n_players, n_replications, chunk_size): records a scenario, or checks it matches one already
+    recorded
+    completed_chunks(name): set of the chunks of a scenario already saved
+    add_chunk(name, chunk, n, reach_counts): saves the reach counts of a chunk of n replications
+    finish_scenario(name, confidence): adds up the chunks of a scenario and writes its results
+    is_complete(name): whether the results of a scenario have been written
+    reach_counts(name): (rounds + 1) x n_players array of the counts of each player reaching each round
+    results(name): dictionary of the columns of the results of a scenario
+    scenario_names: names of the scenarios, in the order they were added
+    close: closes the file
+    """
+
+    def __init__(self, path, seed=None):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(_SCHEMA)
+        row = self._connection.execute("SELECT value FROM sweep WHERE key = 'seed'").fetchone()
+        if row is not None:
+            if seed is not None and int(row[0]) != seed:
+                raise ValueError('The sweep in ' + str(path) + ' was run with seed ' + row[0] + ', not ' + str(seed))
+            self.seed = int(row[0])
+        else:
+            self.seed = np.random.SeedSequence(seed).entropy
+            with self._connection:
+                self._connection.execute("INSERT INTO sweep VALUES ('seed', ?)", (str(self.seed),))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_scenario(self, name, n_players, n_replications, chunk_size):
+        row = self._connection.execute('SELECT n_players, n_replications, chunk_size FROM scenarios WHERE name = ?',
+                                       (name,)).fetchone()
+        if row is None:
+            with self._connection:
+                self._connection.execute('INSERT INTO scenarios (name, n_players, n_replications, chunk_size) '
+                                         'VALUES (?, ?, ?, ?)', (name, n_players, n_replications, chunk_size))
+        elif tuple(row) != (n_players, n_replications, chunk_size):
+            raise ValueError('Scenario ' + name + ' was recorded with (n_players, n_replications, chunk_size) ' +
+                             str(tuple(row)) + ', not ' + str((n_players, n_replications, chunk_size)))
+
+    def completed_chunks(self, name):
+        return {chunk for chunk, in self._connection.execute('SELECT chunk FROM chunks WHERE scenario = ?', (name,))}
+
+    def add_chunk(self, name, chunk, n, reach_counts):
+        with self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)',
+                                     (name, chunk, n, np.asarray(reach_counts, dtype=np.int64).tobytes()))
+
+    def _n_players(self, name):
+        return self._connection.execute('SELECT n_players FROM scenarios WHERE name = ?', (name,)).fetchone()[0]
+
+    def reach_counts(self, name):
+        n_players = self._n_players(name)
+        shape = (math.ceil(math.log2(n_players)) + 1, n_players)
+        reach_counts = np.zeros(shape, dtype=np.int64)
+        for blob, in self._connection.execute('SELECT reach_counts FROM chunks WHERE scenario = ?', (name,)):
+            reach_counts += np.frombuffer(blob, dtype=np.int64).reshape(shape)
+        return reach_counts
+
+    def finish_scenario(self, name, confidence=0.95):
+        n, = self._connection.execute('SELECT COALESCE(SUM(n), 0) FROM chunks WHERE scenario = ?', (name,)).fetchone()
+        reach_counts = self.reach_counts(name)
+        lower, upper = proportion_confidence_interval(reach_counts, n, confidence)
+        rounds, players = np.indices(reach_counts.shape)
+        rows = zip(rounds.ravel().tolist(), players.ravel().tolist(), reach_counts.ravel().tolist(),
+                   (reach_counts / n).ravel().tolist(), lower.ravel().tolist(), upper.ravel().tolist())
+        with self._connection:
+            self._connection.execute('DELETE FROM results WHERE scenario = ?', (name,))
+            self._connection.executemany('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                         [(name, round_number, player, count, n, probability, low, high)
+                                          for round_number, player, count, probability, low, high in rows])
+            self._connection.execute('UPDATE scenarios SET is_complete = 1 WHERE name = ?', (name,))
+
+    def is_complete(self, name):
+        row = self._connection.execute('SELECT is_complete FROM scenarios WHERE name = ?', (name,)).fetchone()
+        return row is not None and bool(row[0])
+
+    def results(self, name):
+        """Returns a dictionary of arrays of the columns round, player, reach_count, n, probability, lower and upper,
+        one entry per player per round"""
+        columns = ['round', 'player', 'reach_count', 'n', 'probability', 'lower', 'upper']
+        rows = self._connection.execute('SELECT ' + ', '.join('"' + column + '"' for column in columns) +
+                                        ' FROM results WHERE scenario = ? ORDER BY round, player', (name,)).fetchall()
+        return {column: np.array([row[i] for row in rows]) for i, column in enumerate(columns)}
+
+    def scenario_names(self):
+        return [name for name, in self._connection.execute('SELECT name FROM scenarios ORDER BY rowid')]
+
+    def close(self):
+        self._connection.close()
+
+
+def run_sweep(scenarios, player0_win_probability_function, path, n_replications, seed=None, n_workers=None,
+              chunk_size=100, confidence=0.95, **kwargs):
+    """
+    Simulates every scenario of a table n_replications times across a pool of processes, saving each chunk of
+    replications to an SQLite file as it finishes. Running it again with the same path carries on from the saved
+    chunks, so an interrupted sweep only redoes the chunks that were in progress.
+
+    Chunk i of every scenario uses the random stream spawned i-th from the seed, as simulate_competition_parallel does,
+    so the scenarios are compared with common random numbers and a scenario gives the same counts as
+    simulate_competition_parallel with the same seed and chunk_size. If seed is None, fresh entropy is saved with the
+    sweep and used again when it is resumed.
+
+    :param scenarios: A list of dictionaries of name (unique), playerlist and optionally kwargs, any other features
+    used in the player0_win_probability_function or simulate_competition for that scenario (e.g. a
+    match_probability_cache), which take the place of the same kwargs of the sweep
+    :param player0_win_probability_function: A function that takes TMatch, player0, player1 as inputs and returns
+    a probability. It is sent to the worker processes so has to be picklable (e.g. not a lambda)
+    :param path: SQLite file to keep the sweep in (see SweepStore)
+    :param n_replications: Number of competitions to simulate for each scenario
+    :param seed: Seed for numpy.random.SeedSequence, has to match the seed the sweep was started with
+    :param n_workers: Number of processes. If None, one per CPU. If 1, the simulations run in this process
+    :param chunk_size: Number of competitions in a chunk, the unit of work that is saved
+    :param confidence: Confidence level of the intervals in the results (see proportion_confidence_interval)
+    :param kwargs: Any other features that are used in the player0_win_probability_function
+    :return: dictionary of scenario name to its (rounds + 1) x n reach counts
+    """
+    names = [scenario['name'] for scenario in scenarios]
+    if len(set(names)) != len(names):
+        raise ValueError('Scenario names have to be unique')
+    chunk_sizes = [min(chunk_size, n_replications - start) for start in range(0, n_replications, chunk_size)]
+
+    with SweepStore(path, seed) as store:
+        seed_sequences = np.random.SeedSequence(store.seed).spawn(len(chunk_sizes))
+        work = []
+        for scenario in scenarios:
+            playerlist = scenario['playerlist']
+            store.add_scenario(scenario['name'], len(playerlist), n_replications, chunk_size)
+            if store.is_complete(scenario['name']):
+                continue
+            scenario_kwargs = dict(kwargs, **scenario.get('kwargs', {}))
+            completed_chunks = store.completed_chunks(scenario['name'])
+            work.extend(((scenario['name'], chunk, n),
+                         (playerlist, player0_win_probability_function, seed_sequences[chunk], n, scenario_kwargs))
+                        for chunk, n in enumerate(chunk_sizes) if chunk not in completed_chunks)
+
+        remaining_chunks = {}
+        for (name, _, _), _ in work:
+            remaining_chunks[name] = remaining_chunks.get(name, 0) + 1
+        unfinished = [name for name in names if not store.is_complete(name) and name not in remaining_chunks]
+
+        def save(name, chunk, n, reach_counts):
+            store.add_chunk(name, chunk, n, reach_counts)
+            remaining_chunks[name] -= 1
+            if remaining_chunks[name] == 0:
+                store.finish_scenario(name, confidence)
+
+        if n_workers == 1:
+            for key, arguments in work:
+                save(*key, _simulate_competition_chunk(*arguments))
+        elif work:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = {executor.submit(_simulate_competition_chunk, *arguments): key for key, arguments in work}
+                for future in as_completed(futures):
+                    save(*futures[future], future.result())
+        # Scenarios whose chunks were all saved before the results were written
+        for name in unfinished:
+            store.finish_scenario(name, confidence)
+
+        return {name: store.reach_counts(name) for name in names}
+
+
+def load_sweep(path):
+    """Returns a dictionary of scenario name to the results of each complete scenario of a sweep (see
+    SweepStore.results)"""
+    with SweepStore(path) as store:
+        return {name: store.results(name) for name in store.scenario_names() if store.is_complete(name)}
@@ -1,5 +1,5 @@
 from unittest import TestCase
-from tennistools import Tgame, Tset, Tmatch
+from tennistools import Tgame, Ttiebreak, Tset, Tmatch, MatchFormat, BEST_OF_FIVE, BEST_OF_THREE, DOUBLES
 
 
 class TestTGame(TestCase):
@@ -147,3 +147,175 @@ class TestMatch(TestCase):
         assert tmatch.get_match_score()==(3,0)
         assert tmatch.match_winner == 0
 
+
+    def test_running_scores_match_history(self):
+        """Running counters agree with the scores rebuilt from the game, set and point histories"""
+        tmatch = Tmatch()
+        for point in range(2000):
+            tmatch.play_point(point % 3 != 0 or point % 7 == 0)
+            if tmatch.is_match_over():
+                break
+        for tset in tmatch.set_history + [tmatch.current_set]:
+            for game in tset.game_history + [tset.current_game]:
+                assert game.get_current_score() == (game.score_history.count(0), game.score_history.count(1))
+            winners = [game.game_winner for game in tset.game_history]
+            assert tset.get_current_score() == (winners.count(0), winners.count(1))
+        winners = [tset.set_winner for tset in tmatch.set_history]
+        assert tmatch.get_match_score() == (winners.count(0), winners.count(1))
+
+
+    def test_results_only(self):
+        """Without history the match keeps the same score and the set scores, but no sets, games or points"""
+        full_match = Tmatch(True)
+        light_match = Tmatch(True, keep_history=False)
+        for point in range(2000):
+            for tmatch in [full_match, light_match]:
+                tmatch.play_point(point % 3 != 0 or point % 7 == 0)
+            if full_match.is_match_over():
+                break
+        assert light_match.match_winner == full_match.match_winner
+        assert light_match.get_match_score() == full_match.get_match_score()
+        assert light_match.set_scores == [tset.get_current_score() for tset in full_match.set_history]
+        assert light_match.set_history == []
+        assert light_match.current_set.game_history == []
+        assert light_match.current_set.current_game.score_history == []
+
+
+    def test_play_set(self):
+        """Whole sets can be added, with the serve carried on as if every game had been played"""
+        tmatch = Tmatch(True, keep_history=False)
+        tmatch.play_set(6, 3)
+        assert tmatch.is_player0_server is False
+        tmatch.play_set(7, 6)
+        assert tmatch.is_player0_server is True
+        tmatch.play_set(6, 4)
+        assert tmatch.set_scores == [(6, 3), (7, 6), (6, 4)]
+        assert tmatch.match_winner == 0
+
+
+    def test_clone(self):
+        """A clone plays on separately and shares the completed sets"""
+        tmatch = Tmatch(True)
+        for point in range(60):
+            tmatch.play_point(point % 3 != 0)
+        assert len(tmatch.set_history) >= 1 and not tmatch.is_match_over()
+        clone = tmatch.clone()
+        assert clone.set_history[0] is tmatch.set_history[0]
+        assert str(clone) == str(tmatch)
+        score = (tmatch.get_match_score(), tmatch.current_set.get_current_score(),
+                 tmatch.current_set.current_game.get_current_score(), len(tmatch.current_set.game_history))
+        while not clone.is_match_over():
+            clone.play_point(False)
+        assert (tmatch.get_match_score(), tmatch.current_set.get_current_score(),
+                tmatch.current_set.current_game.get_current_score(), len(tmatch.current_set.game_history)) == score
+        assert tmatch.match_winner is None and clone.match_winner == 1
+
+    def test_snapshot(self):
+        """A match restored from a snapshot plays on exactly as the original, including through tiebreaks"""
+        tmatch = Tmatch(False)
+        restored_tiebreak = False
+        for point_number in range(1000):
+            snapshot = tmatch.snapshot()
+            restored = Tmatch.from_snapshot(snapshot)
+            assert restored.snapshot() == snapshot
+            assert restored.current_set.current_game.is_player0_server == \
+                tmatch.current_set.current_game.is_player0_server
+            restored_tiebreak = restored_tiebreak or isinstance(restored.current_set.current_game, Ttiebreak)
+            # Every game is held to 6-6, the tiebreak points alternate for a while, then player 0 wins every point
+            if tmatch.current_set.get_current_score() != (6, 6):
+                point = tmatch.current_set.current_game.is_player0_server
+            else:
+                point = point_number % 2 == 0 if sum(tmatch.current_set.current_game.get_current_score()) < 14 else True
+            if tmatch.player0_sets + tmatch.player1_sets > 0:
+                point = True
+            tmatch.play_point(point)
+            restored.play_point(point)
+            assert restored.snapshot() == tmatch.snapshot()
+            if tmatch.is_match_over():
+                break
+        assert restored.match_winner == tmatch.match_winner == 0
+        assert restored_tiebreak
+        assert tmatch.set_scores[0] in [(7, 6), (6, 7)]
+        with self.assertRaises(AttributeError):
+            snapshot.player0_sets = 0
+
+
+class TestTtiebreak(TestCase):
+
+    def test_tiebreak_winner(self):
+        """The player who wins the tiebreak points wins the tiebreak and the set"""
+        tset = Tset(True)
+        for player0win in [True, False] * 6:
+            for _ in range(4):
+                tset.play_point(is_player0_point_winner=player0win)
+        assert isinstance(tset.current_game, Ttiebreak)
+        for _ in range(7):
+            tset.play_point(True)
+        assert tset.game_history[-1].get_current_score() == (7, 0)
+        assert tset.game_history[-1].game_winner == 0
+        assert tset.get_current_score() == (7, 6)
+        assert tset.set_winner == 0
+
+
+class TestMatchFormat(TestCase):
+
+    def test_default(self):
+        """The default format is best of five sets with advantage games"""
+        assert Tmatch().match_format == BEST_OF_FIVE == MatchFormat()
+        assert hash(MatchFormat(sets_required=2)) == hash(BEST_OF_THREE)
+        assert BEST_OF_FIVE.set_over[7][5] and not BEST_OF_FIVE.set_over[6][5] and BEST_OF_FIVE.is_tiebreak_score[6][6]
+
+    def test_long_deuce(self):
+        """Scores past the table are looked up from the level score"""
+        tgame = Tgame(True)
+        for _ in range(10):
+            tgame.play_point(True)
+            tgame.play_point(False)
+        assert not tgame.is_game_over()
+        tgame.play_point(True)
+        tgame.play_point(True)
+        assert tgame.game_winner == 0 and tgame.get_current_score() == (12, 10)
+
+    def test_no_ad(self):
+        """A no-ad game is decided by the point at deuce"""
+        tgame = Tgame(True, match_format=DOUBLES)
+        for point in [True, False] * 3 + [False]:
+            tgame.play_point(point)
+        assert tgame.is_game_over() and tgame.game_winner == 1 and tgame.get_current_score() == (3, 4)
+
+    def test_best_of_three(self):
+        """Two sets win the match"""
+        tmatch = Tmatch(True, match_format=BEST_OF_THREE)
+        while not tmatch.is_match_over():
+            tmatch.play_point(True)
+        assert tmatch.set_scores == [(6, 0), (6, 0)] and tmatch.match_winner == 0
+
+    def test_match_tiebreak(self):
+        """In doubles a set all match is decided by a tiebreak to 10, which is the deciding set"""
+        tmatch = Tmatch(True, keep_history=True, match_format=DOUBLES)
+        tmatch.play_set(6, 4)
+        tmatch.play_set(3, 6)
+        assert tmatch.current_set.is_match_tiebreak_set
+        assert isinstance(tmatch.current_set.current_game, Ttiebreak)
+        for point in [True, False] * 9:
+            tmatch.play_point(point)
+        assert not tmatch.is_match_over()
+        tmatch.play_point(False)
+        tmatch.play_point(False)
+        assert tmatch.match_winner == 1
+        assert tmatch.set_scores == [(6, 4), (3, 6), (0, 1)]
+        assert tmatch.set_history[-1].game_history[0].get_current_score() == (9, 11)
+
+    def test_snapshot_match_tiebreak(self):
+        """A snapshot in a match tiebreak is restored as a match tiebreak"""
+        tmatch = Tmatch(False, match_format=DOUBLES)
+        tmatch.play_set(4, 6)
+        tmatch.play_set(7, 6)
+        for point in [True] * 8:
+            tmatch.play_point(point)
+        restored = Tmatch.from_snapshot(tmatch.snapshot(), match_format=DOUBLES)
+        assert restored.current_set.current_game.is_match_tiebreak
+        restored.play_point(True)
+        assert not restored.is_match_over()
+        restored.play_point(True)
+        assert restored.match_winner == 0
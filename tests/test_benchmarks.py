@@ -0,0 +1,34 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from tennistools.benchmarks import run_benchmarks, save_results, load_results, compare_results, main
+
+
+class TestBenchmarks(TestCase):
+
+    def test_run_save_and_compare(self):
+        benchmarks = run_benchmarks(n_points=500, n_matches=2, n_competition_matches=7, draw_sizes=[8], repeat=1)
+        assert sorted(benchmarks['results']) == ['competition_8', 'matches', 'points']
+        for result in benchmarks['results'].values():
+            assert result['rate'] > 0
+            assert result['peak_memory_bytes'] > 0
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            save_results(benchmarks, path)
+            baseline = load_results(path)
+        assert all(not row['is_regression'] for row in compare_results(benchmarks, baseline))
+
+        #A baseline twice as fast is a regression
+        for result in baseline['results'].values():
+            result['rate'] *= 2
+        comparison = compare_results(benchmarks, baseline, tolerance=0.2)
+        assert len(comparison) == 3
+        assert all(row['is_regression'] and abs(row['ratio'] - 0.5) < 1e-9 for row in comparison)
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            assert main(['--output', path, '--points', '500', '--matches', '2', '--competition-matches', '7', '--draw-sizes', '8', '--repeat', '1']) == 0
+            assert main(['--baseline', path, '--points', '500', '--matches', '2', '--competition-matches', '7', '--draw-sizes', '8', '--repeat', '1', '--tolerance', '0.9']) == 0
@@ -0,0 +1,71 @@
+from contextlib import nullcontext
+from unittest import TestCase
+
+from tennistools import BEST_OF_FIVE, DOUBLES
+from tennistools.compiled import play_matches_compiled
+from tennistools.match_cache import MatchProbabilityCache
+from tennistools.monte_carlo import simulate_competition_cached
+from tennistools.simulation import serve_probability_function, stochastic_simulation_match, antithetic_draws, \
+    UniformStream
+from tennistools.state_machine import result_to_tmatch
+
+
+@serve_probability_function
+def serve_strength(player0, player1):
+    return player0['serve'], player1['serve']
+
+
+class TestCompiled(TestCase):
+
+    def test_uniform_stream(self):
+        #take, peek_block and advance hand out the same numbers as uniform
+        stream, expected = UniformStream(1, block_size=5), UniformStream(1, block_size=5)
+        numbers = [stream.uniform() for _ in range(3)] + stream.take(6).tolist()
+        block = stream.peek_block()
+        stream.advance(2)
+        numbers += block[:2].tolist() + [stream.uniform() for _ in range(4)]
+        assert numbers == [expected.uniform() for _ in range(len(numbers))]
+        #An antithetic stream hands out 1 - u for every number u of the stream of the same seed
+        stream, antithetic = UniformStream(1, block_size=5), UniformStream(1, block_size=5, is_antithetic=True)
+        numbers = [stream.uniform() for _ in range(3)] + stream.take(6).tolist() + stream.uniform(4).tolist()
+        antithetic_numbers = [antithetic.uniform() for _ in range(3)] + antithetic.take(6).tolist() + \
+            antithetic.uniform(4).tolist()
+        assert antithetic_numbers == [1 - number for number in numbers]
+
+    def test_matches_same_as_python(self):
+        #The kernel plays the same matches as stochastic_simulation_match, also across blocks of random numbers
+        serves = [(0.6, 0.62), (0.7, 0.55), (0.5, 0.5)]
+        for match_format in [BEST_OF_FIVE, DOUBLES]:
+            for is_antithetic in [False, True]:
+                stream = UniformStream(2, block_size=97)
+                results = play_matches_compiled([serve0 for serve0, _ in serves], [serve1 for _, serve1 in serves],
+                                                stream, match_format, is_antithetic)
+                after = stream.uniform()
+
+                stream = UniformStream(2, block_size=97)
+                with antithetic_draws() if is_antithetic else nullcontext():
+                    tmatches = [stochastic_simulation_match(serve_strength, {'serve': serve0}, {'serve': serve1},
+                                                            keep_history=False, rng=stream, match_format=match_format)
+                                for serve0, serve1 in serves]
+                assert after == stream.uniform()
+                for (result, is_player0_first_server), tmatch in zip(results, tmatches):
+                    assert result.match_winner == tmatch.match_winner
+                    assert result.set_scores == tmatch.set_scores
+                    assert result.points_played == tmatch.points_played
+                    assert result_to_tmatch(result, is_player0_first_server).is_player0_server == \
+                        tmatch.is_player0_server
+
+    def test_competitions_same_as_python(self):
+        playerlist = [{'name': 'player' + str(i), 'serve': 0.56 + 0.02 * i} for i in range(6)]
+        cache = MatchProbabilityCache()
+        reach_counts = simulate_competition_cached(playerlist, serve_strength, cache, 30, 5, is_compiled=True)
+        expected = simulate_competition_cached(playerlist, serve_strength, cache, 30, 5, is_compiled=False)
+        assert (reach_counts == expected).all()
+        assert (reach_counts[0] == 30).all() and reach_counts[-1].sum() == 30
+        # Byes go through to the second round
+        assert reach_counts[1, 0] == 30 and reach_counts[1, 1] == 30
+        assert (simulate_competition_cached(playerlist, serve_strength, cache, 30,
+                                            UniformStream(5, is_antithetic=True), is_compiled=True) ==
+                simulate_competition_cached(playerlist, serve_strength, cache, 30,
+                                            UniformStream(5, is_antithetic=True), is_compiled=False)).all()
+        self.assertRaises(ValueError, simulate_competition_cached, playerlist, serve_strength, cache, 30, None)
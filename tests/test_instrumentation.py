@@ -0,0 +1,73 @@
+import os
+import pstats
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from tennistools import instrumentation
+from tennistools.instrumentation import instrumented, Instrumentation
+from tennistools.simulation import stochastic_simulation_match, stochastic_simulation_match_batch, \
+    stochastic_simulation_matches, serve_probability_function
+from tennistools.single_elimination_competition import simulate_competition
+
+
+def server_wins(tmatch, player0, player1):
+    return 0.6 if tmatch.current_set.current_game.is_player0_server else 0.4
+
+
+@serve_probability_function
+def serve_strength(player0, player1):
+    return 0.6, 0.6
+
+
+class TestInstrumentation(TestCase):
+
+    def test_match_counters(self):
+        np.random.seed(2)
+        with instrumented() as collector:
+            tmatch = stochastic_simulation_match(server_wins)
+        counters = collector.as_dict()['counters']
+        assert counters['matches'] == 1
+        assert counters['sets'] == len(tmatch.set_scores)
+        assert counters['games'] + counters.get('tiebreaks', 0) == sum(map(sum, tmatch.set_scores))
+        assert counters['points'] == sum(len(game.score_history) for tset in tmatch.set_history
+                                         for game in tset.game_history)
+        timings = collector.as_dict()['timings']
+        assert timings['probability_function']['calls'] == counters['points']
+        assert set(timings) == {'probability_function', 'random', 'score_keeping'}
+        assert instrumentation.collector is None
+
+    def test_batch_counters(self):
+        np.random.seed(4)
+        with instrumented() as collector:
+            _, set_scores, game_scores = stochastic_simulation_match_batch(0.6, 0.6, 100)
+        counters = collector.counters
+        assert counters['matches'] == 100
+        assert counters['sets'] == set_scores.sum()
+        assert counters['games'] + counters['tiebreaks'] == game_scores.sum()
+        assert counters['tiebreaks'] == ((game_scores == 7).any(axis=2) & (game_scores == 6).any(axis=2)).sum()
+        assert collector.seconds('score_keeping') > 0
+
+    def test_competition_and_report(self):
+        np.random.seed(6)
+        playerlist = [{'name': 'player' + str(i)} for i in range(5)]
+        with instrumented() as collector:
+            simulate_competition(playerlist, serve_strength, results_only=True)
+        assert collector.counters['competitions'] == 1
+        assert collector.counters['rounds'] == 3
+        assert collector.counters['matches'] == 4
+        assert collector.seconds('competition') >= collector.seconds('competition_round')
+
+        stats = pstats.Stats(collector)
+        assert ('tennistools', 0, 'competition_round') in stats.stats
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'simulation.prof')
+            collector.dump_stats(path)
+            assert pstats.Stats(path).stats == stats.stats
+
+    def test_disabled(self):
+        collector = Instrumentation()
+        stochastic_simulation_matches(server_wins, [None] * 2, [None] * 2)
+        assert collector.as_dict() == {'counters': {}, 'timings': {}}
+        assert instrumentation.collector is None
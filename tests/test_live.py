@@ -0,0 +1,74 @@
+from unittest import TestCase
+
+import numpy as np
+
+from tennistools import Tmatch, DOUBLES
+from tennistools.live import score_state, tmatch_from_score, live_win_probability
+from tennistools.simulation import serve_probability_function
+from tennistools.solver import match_win_probability
+
+
+@serve_probability_function
+def serve_strength(player0, player1):
+    return 0.64, 0.6
+
+
+def serve_strength_points(tmatch, player0, player1):
+    return 0.64 if tmatch.current_set.current_game.is_player0_server else 0.4
+
+
+class TestLiveWinProbability(TestCase):
+
+    def test_score_round_trip(self):
+        #Rebuilding a match from its score gives the same score and server at every point, including tiebreaks
+        np.random.seed(8)
+        tmatch = Tmatch(is_player0_server=False)
+        while not tmatch.is_match_over():
+            score = score_state(tmatch)
+            rebuilt = tmatch_from_score(score)
+            assert score_state(rebuilt) == score
+            assert rebuilt.current_set.current_game.is_player0_server == tmatch.current_set.current_game.is_player0_server
+            assert type(rebuilt.current_set.current_game) == type(tmatch.current_set.current_game)
+            is_player0_point_winner = np.random.uniform() < 0.5
+            tmatch.play_point(is_player0_point_winner)
+            rebuilt.play_point(is_player0_point_winner)
+            assert score_state(rebuilt) == score_state(tmatch)
+        assert rebuilt.match_winner == tmatch.match_winner
+
+    def test_exact_is_consistent_point_to_point(self):
+        #The probability before a point is the average of the probabilities after it, weighted by who wins it
+        np.random.seed(9)
+        tmatch = Tmatch()
+        while not tmatch.is_match_over():
+            probability = live_win_probability(serve_strength, tmatch)
+            point_probability = serve_strength(tmatch)
+            after = []
+            for is_player0_point_winner in [True, False]:
+                next_match = tmatch_from_score(score_state(tmatch))
+                next_match.play_point(is_player0_point_winner)
+                after.append(live_win_probability(serve_strength, next_match))
+            assert abs(probability - point_probability * after[0] - (1 - point_probability) * after[1]) < 1e-12
+            tmatch.play_point(np.random.uniform() < point_probability)
+        assert live_win_probability(serve_strength, tmatch) == (1.0 if tmatch.match_winner == 0 else 0.0)
+
+    def test_score_round_trip_match_tiebreak(self):
+        #In doubles a set all score is rebuilt in the match tiebreak, and is sampled rather than solved
+        rebuilt = tmatch_from_score((1, 1, 0, 0, 9, 8, True), match_format=DOUBLES)
+        assert rebuilt.current_set.current_game.is_match_tiebreak
+        rebuilt.play_point(True)
+        assert rebuilt.match_winner == 0
+        np.random.seed(4)
+        assert live_win_probability(serve_strength, (1, 1, 0, 0, 9, 0, True), n_samples=50, match_format=DOUBLES) == 1.0
+
+    def test_score_tuple(self):
+        assert abs(live_win_probability(serve_strength, (0, 0, 0, 0, 0, 0, True)) -
+                   match_win_probability(0.64, 0.6, True)) < 1e-12
+        assert abs(live_win_probability(serve_strength, (2, 1, 0, 0, 0, 0, False)) -
+                   match_win_probability(0.64, 0.6, False, 2, 1)) < 1e-12
+
+    def test_sampled(self):
+        np.random.seed(10)
+        score = (1, 2, 5, 6, 2, 3, True) #player 0 serving to stay in the match, 30-40 down
+        exact = live_win_probability(serve_strength, score)
+        sampled = live_win_probability(serve_strength_points, score, n_samples=2000)
+        assert abs(sampled - exact) < 0.03
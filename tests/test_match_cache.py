@@ -0,0 +1,126 @@
+from unittest import TestCase
+
+import numpy as np
+
+from tennistools import BEST_OF_FIVE, BEST_OF_THREE
+from tennistools.match_cache import MatchProbabilityCache
+from tennistools.simulation import serve_probability_function, stochastic_simulation_matches
+from tennistools.single_elimination_competition import simulate_competition, calculate_rounds_won
+from tennistools.solver import match_win_probability
+
+
+@serve_probability_function
+def serve_strength(player0, player1):
+    return player0['serve'], player1['serve']
+
+
+def even_points(match, player0, player1):
+    return 0.5
+
+
+class TestServeProbabilityFunction(TestCase):
+
+    def test_point_probability(self):
+        from tennistools import Tmatch
+        tmatch = Tmatch(is_player0_server=True)
+        assert serve_strength(tmatch, {'serve': 0.7}, {'serve': 0.6}) == 0.7
+        tmatch.current_set.current_game.is_player0_server = False
+        assert abs(serve_strength(tmatch, {'serve': 0.7}, {'serve': 0.6}) - 0.4) < 1e-12
+
+    def test_batch_matches(self):
+        #Played in a batch, the serve probabilities are used for the right server
+        np.random.seed(3)
+        n = 2000
+        tmatches = stochastic_simulation_matches(serve_strength, [{'serve': 0.65}] * n, [{'serve': 0.6}] * n,
+                                                 keep_history=False)
+        win_fraction = sum(tmatch.match_winner == 0 for tmatch in tmatches) / n
+        assert abs(win_fraction - match_win_probability(0.65, 0.6)) < 0.04
+
+
+class TestMatchProbabilityCache(TestCase):
+
+    def test_exact_and_hits(self):
+        cache = MatchProbabilityCache()
+        player0, player1 = {'name': 'a', 'serve': 0.65}, {'name': 'b', 'serve': 0.6}
+        probability = cache.get(serve_strength, player0, player1)
+        assert probability == match_win_probability(0.65, 0.6)
+        assert cache.get(serve_strength, dict(player0), dict(player1)) == probability
+        assert cache.cache_info() == {'hits': 1, 'misses': 1, 'maxsize': 65536, 'currsize': 1}
+
+    def test_get_many(self):
+        #Pairings not in the cache are solved together, and a repeated pairing is only solved once
+        cache = MatchProbabilityCache(maxsize=2)
+        players = [{'serve': serve} for serve in (0.6, 0.62, 0.64)]
+        cache.get(serve_strength, players[0], players[1])
+        probabilities = cache.get_many(serve_strength, [players[0], players[1], players[1]],
+                                       [players[1], players[2], players[2]])
+        assert probabilities[0] == cache.get(serve_strength, players[0], players[1])
+        assert abs(probabilities[1] - match_win_probability(0.62, 0.64)) < 1e-12
+        assert probabilities[2] == probabilities[1]
+        assert cache.cache_info() == {'hits': 2, 'misses': 2, 'maxsize': 2, 'currsize': 2}
+        with self.assertRaises(ValueError):
+            cache.get_many(even_points, [players[0]], [players[1]])
+
+    def test_lru_eviction(self):
+        cache = MatchProbabilityCache(maxsize=2)
+        players = [{'serve': serve} for serve in (0.6, 0.62, 0.64)]
+        cache.get(serve_strength, players[0], players[1])
+        cache.get(serve_strength, players[1], players[2])
+        cache.get(serve_strength, players[0], players[1]) #now the most recently used
+        cache.get(serve_strength, players[2], players[0]) #drops players[1] v players[2]
+        assert len(cache) == 2
+        cache.get(serve_strength, players[0], players[1])
+        cache.get(serve_strength, players[1], players[2])
+        assert cache.cache_info()['hits'] == 2
+        assert cache.cache_info()['misses'] == 4
+
+    def test_sampled(self):
+        #Without a serve function the probability is estimated from simulated matches
+        np.random.seed(1)
+        cache = MatchProbabilityCache(allow_sampled=True, n_samples=200)
+        probability = cache.get(even_points, {'name': 'a'}, {'name': 'b'})
+        assert 0.35 < probability < 0.65
+
+    def test_sampled_needs_opt_in(self):
+        cache = MatchProbabilityCache()
+        assert not cache.can_calculate(even_points)
+        with self.assertRaises(ValueError):
+            cache.get(even_points, {'name': 'a'}, {'name': 'b'})
+        #A competition plays the matches instead
+        np.random.seed(2)
+        _, match_history = simulate_competition([{'name': 'a'}, {'name': 'b'}], even_points,
+                                                match_probability_cache=cache)
+        assert 'match' in match_history[0][0]
+        assert cache.cache_info()['misses'] == 0
+
+    def test_competition(self):
+        np.random.seed(5)
+        playerlist = [{'name': 'player' + str(i), 'serve': 0.55 + 0.02 * i} for i in range(6)]
+        cache = MatchProbabilityCache()
+        reach_counts = np.zeros(len(playerlist), dtype=int)
+        for _ in range(50):
+            winner, match_history = simulate_competition(playerlist, serve_strength, match_probability_cache=cache)
+            rounds_won = calculate_rounds_won(playerlist, match_history)
+            assert rounds_won[playerlist.index(winner)] == 3
+            reach_counts += rounds_won == 3
+        assert reach_counts.sum() == 50
+        #At most 15 different pairings, every other match is a cache hit
+        assert cache.cache_info()['misses'] <= 15
+        assert cache.cache_info()['hits'] + cache.cache_info()['misses'] == 50 * 5 #5 matches with 2 byes
+
+    def test_match_formats(self):
+        #Only best of five set matches are solved exactly, other formats are sampled in their own format
+        np.random.seed(6)
+        player0, player1 = {'name': 'a', 'serve': 0.65}, {'name': 'b', 'serve': 0.6}
+        cache = MatchProbabilityCache()
+        assert cache.can_calculate(serve_strength, BEST_OF_FIVE)
+        assert not cache.can_calculate(serve_strength, BEST_OF_THREE)
+        _, match_history = simulate_competition([player0, player1], serve_strength, match_probability_cache=cache,
+                                                match_format=BEST_OF_THREE)
+        assert max(match_history[0][0]['match'].get_match_score()) == 2
+
+        cache = MatchProbabilityCache(allow_sampled=True, n_samples=400)
+        best_of_three = cache.get(serve_strength, player0, player1, BEST_OF_THREE)
+        assert cache.get(serve_strength, player0, player1) == match_win_probability(0.65, 0.6)
+        assert len(cache) == 2
+        assert abs(best_of_three - match_win_probability(0.65, 0.6)) < 0.15
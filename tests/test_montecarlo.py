@@ -0,0 +1,202 @@
+from unittest import TestCase
+
+import numpy as np
+
+from tennistools.match_cache import MatchProbabilityCache
+from tennistools.monte_carlo import simulate_competition_parallel, iterate_competitions, CompetitionAggregator, \
+    RunningMoments, simulate_competition_adaptive, proportion_confidence_interval, compare_scenarios, \
+    simulate_competition_stratified, simulate_competition_vectorized, cached_win_probability_matrix
+from tennistools.simulation import serve_probability_function
+from tennistools.single_elimination_competition import calculate_competition_probabilities
+from tennistools.solver import match_win_probability
+
+
+def even_points(match, player0, player1):
+    """Module level so it can be sent to worker processes"""
+    return 0.5
+
+
+@serve_probability_function
+def serve_strength(player0, player1):
+    return player0['serve'], player1['serve']
+
+
+class TestSimulateCompetitionParallel(TestCase):
+
+    playerlist = [{'name': 'player1'}, {'name': 'player2'}, {'name': 'player3'}]
+
+    def test_reach_counts(self):
+        #Every replication has 3 players in the first round, 2 in the final and 1 winner
+        reach_counts = simulate_competition_parallel(self.playerlist, even_points, 10, seed=1, n_workers=1)
+        assert reach_counts.shape == (3, 3)
+        assert reach_counts.sum(axis=1).tolist() == [30, 20, 10]
+        assert reach_counts[1, 0] == 10 #player 1 has a bye into the final
+
+    def test_same_results_for_any_number_of_workers(self):
+        #The seed fixes the results, however the work is split
+        serial = simulate_competition_parallel(self.playerlist, even_points, 12, seed=7, n_workers=1, chunk_size=5)
+        parallel = simulate_competition_parallel(self.playerlist, even_points, 12, seed=7, n_workers=2, chunk_size=5)
+        assert serial.tolist() == parallel.tolist()
+
+
+class TestIterateCompetitions(TestCase):
+
+    playerlist = [{'name': 'player1'}, {'name': 'player2'}, {'name': 'player3'}, {'name': 'player4'}]
+
+    def test_records(self):
+        records = list(iterate_competitions(self.playerlist, even_points, 3, seed=2))
+        assert len(records) == 3
+        for record in records:
+            assert record['rounds_won'].tolist().count(2) == 1
+            assert record['rounds_won'][record['winner']] == 2
+            assert 3 * 3 * 6 <= record['games'] <= 3 * 5 * 13
+            assert record['points'] >= 4 * record['games']
+
+    def test_seed_does_not_change_caller_random_numbers(self):
+        np.random.seed(1)
+        expected = np.random.uniform(size=3)
+        np.random.seed(1)
+        records = iterate_competitions(self.playerlist, even_points, seed=5)
+        first = next(records)
+        uniforms = [np.random.uniform()]
+        second = next(records)
+        uniforms += np.random.uniform(size=2).tolist()
+        assert uniforms == expected.tolist()
+        #The same seed gives the same replications
+        again = iterate_competitions(self.playerlist, even_points, 2, seed=5)
+        assert [record['points'] for record in again] == [first['points'], second['points']]
+
+    def test_aggregator(self):
+        aggregator = CompetitionAggregator(len(self.playerlist))
+        aggregator.update_all(iterate_competitions(self.playerlist, even_points, 20, seed=3))
+        assert aggregator.n == 20
+        assert aggregator.reach_counts.sum(axis=1).tolist() == [80, 40, 20]
+        assert aggregator.win_counts.sum() == 20
+        assert abs(aggregator.win_probabilities.sum() - 1) < 1e-12
+        lower, upper = aggregator.win_confidence_intervals()
+        assert (lower <= aggregator.win_probabilities).all() and (aggregator.win_probabilities <= upper).all()
+        assert aggregator.games.n == 20 and aggregator.games.variance > 0
+        #The same as simulate_competition_parallel with the same random stream
+        parallel = simulate_competition_parallel(self.playerlist, even_points, 20, seed=3, n_workers=1, chunk_size=20)
+        sequence = np.random.SeedSequence(3).spawn(1)[0]
+        streamed = CompetitionAggregator(len(self.playerlist)).update_all(
+            iterate_competitions(self.playerlist, even_points, 20, seed=sequence))
+        assert streamed.reach_counts.tolist() == parallel.tolist()
+
+
+class TestSimulateCompetitionAdaptive(TestCase):
+
+    playerlist = [{'name': 'player1'}, {'name': 'player2'}]
+
+    def test_stops_at_tolerance(self):
+        aggregator, is_converged = simulate_competition_adaptive(self.playerlist, even_points, tolerance=0.3,
+                                                                 batch_size=5, seed=1)
+        assert is_converged
+        assert aggregator.n % 5 == 0
+        #Two even players need about (2 * 1.96 * 0.5 / 0.3) ** 2 = 43 replications
+        assert 35 <= aggregator.n <= 55
+        lower, upper = aggregator.win_confidence_intervals()
+        assert (upper - lower).max() < 0.3
+
+    def test_max_replications(self):
+        aggregator, is_converged = simulate_competition_adaptive(self.playerlist, even_points, tolerance=0.01,
+                                                                 batch_size=4, max_replications=10, seed=1)
+        assert not is_converged
+        assert aggregator.n == 10
+
+
+class TestVarianceReduction(TestCase):
+
+    playerlist = [{'name': 'player' + str(i), 'serve': 0.58 + 0.01 * i} for i in range(6)]
+
+    def test_common_random_numbers(self):
+        #Replication i is the same however many replications come before it
+        records = list(iterate_competitions(self.playerlist, serve_strength, 4, seed=3, common_random_numbers=True))
+        fresh = iterate_competitions(self.playerlist, serve_strength, 4, seed=3, common_random_numbers=True)
+        assert [record['points'] for record in fresh] == [record['points'] for record in records]
+        with self.assertRaises(ValueError):
+            next(iterate_competitions(self.playerlist, serve_strength, common_random_numbers=True))
+
+    def test_compare_scenarios(self):
+        #Identical scenarios have no difference at all, and a stronger player gains in every paired replication
+        stronger = [dict(player) for player in self.playerlist]
+        stronger[5]['serve'] += 0.02
+        cache = MatchProbabilityCache()
+        aggregators, differences = compare_scenarios([self.playerlist, self.playerlist, stronger], serve_strength,
+                                                     100, seed=1, match_probability_cache=cache)
+        assert [aggregator.n for aggregator in aggregators] == [100] * 3
+        assert differences[1].n == 100 and not differences[1].mean.any() and not differences[1].variance.any()
+        assert differences[2].mean[-1, 5] > 0
+        assert differences[2].variance[-1, 5] < 0.5 * 2 * aggregators[0].win_probabilities[5]
+
+    def test_antithetic_pairs(self):
+        #With even players each pair of replications has opposite winners
+        playerlist = [{'name': 'a', 'serve': 0.6}, {'name': 'b', 'serve': 0.6}]
+        records = list(iterate_competitions(playerlist, serve_strength, 20, seed=2, antithetic=True,
+                                            match_probability_cache=MatchProbabilityCache()))
+        winners = [record['winner'] for record in records]
+        assert all(first != second for first, second in zip(winners[::2], winners[1::2]))
+        _, differences = compare_scenarios([playerlist, playerlist], serve_strength, 20, seed=2, antithetic=True)
+        assert differences[0].n == 10
+        #Without a seed the pairs come from fresh entropy, and the global random state is not used
+        np.random.seed(1)
+        records = list(iterate_competitions(playerlist, serve_strength, 20, antithetic=True,
+                                            match_probability_cache=MatchProbabilityCache()))
+        winners = [record['winner'] for record in records]
+        assert all(first != second for first, second in zip(winners[::2], winners[1::2]))
+        assert np.random.uniform() == np.random.RandomState(1).uniform()
+
+    def test_stratified(self):
+        cache = MatchProbabilityCache()
+        reach_counts = simulate_competition_stratified(self.playerlist, serve_strength, cache, 2000, rng=4)
+        assert reach_counts.sum(axis=1).tolist() == [6 * 2000, 4 * 2000, 2 * 2000, 2000]
+        matrix = [[match_win_probability(player0['serve'], player1['serve']) for player1 in self.playerlist]
+                  for player0 in self.playerlist]
+        exact = calculate_competition_probabilities(self.playerlist, matrix)
+        assert np.abs(reach_counts / 2000 - exact).max() < 0.03
+        with self.assertRaises(ValueError):
+            simulate_competition_stratified(self.playerlist, even_points, cache, 10)
+
+
+class TestSimulateCompetitionVectorized(TestCase):
+
+    playerlist = [{'name': 'player' + str(i), 'serve': 0.55 + 0.02 * i} for i in range(6)]
+
+    def test_reach_counts(self):
+        matrix = cached_win_probability_matrix(self.playerlist, serve_strength, MatchProbabilityCache())
+        reach_counts = simulate_competition_vectorized(self.playerlist, matrix, 5000, rng=2, batch_size=1000)
+        assert reach_counts.sum(axis=1).tolist() == [6 * 5000, 4 * 5000, 2 * 5000, 5000]
+        assert reach_counts[1, 0] == 5000 and reach_counts[1, 1] == 5000 #byes
+        #The matrix is mirrored, and agrees with solving each pairing on its own
+        assert np.allclose(matrix + matrix.T, 1)
+        assert abs(matrix[1, 4] - match_win_probability(0.57, 0.63)) < 1e-12
+        exact = calculate_competition_probabilities(self.playerlist, matrix)
+        assert np.abs(reach_counts / 5000 - exact).max() < 0.03
+        assert (simulate_competition_vectorized(self.playerlist, matrix, 5000, rng=2, batch_size=1000) ==
+                reach_counts).all()
+
+    def test_certain_winner(self):
+        #Player 5 beats everyone
+        matrix = np.full((6, 6), 0.5)
+        matrix[:, 5] = 0
+        reach_counts = simulate_competition_vectorized(self.playerlist, matrix, 100)
+        assert reach_counts[-1, 5] == 100
+
+
+class TestStatistics(TestCase):
+
+    def test_running_moments(self):
+        values = np.random.RandomState(0).normal(10, 2, size=1000)
+        moments = RunningMoments()
+        for value in values:
+            moments.update(value)
+        assert abs(moments.mean - values.mean()) < 1e-9
+        assert abs(moments.variance - values.var(ddof=1)) < 1e-9
+        lower, upper = moments.confidence_interval(0.95)
+        assert abs((upper - lower) / 2 - 1.959964 * values.std(ddof=1) / np.sqrt(1000)) < 1e-5
+
+    def test_proportion_confidence_interval(self):
+        lower, upper = proportion_confidence_interval(np.array([0, 50, 100]), 100)
+        assert lower[0] == 0 and upper[0] > 0
+        assert lower[1] < 0.5 < upper[1]
+        assert lower[2] < 1 and abs(upper[2] - 1) < 1e-12
@@ -0,0 +1,87 @@
+from unittest import TestCase
+import os
+import tempfile
+
+from tennistools import Tmatch, BEST_OF_FIVE, BEST_OF_THREE, DOUBLES
+from tennistools.point_log import PointLog
+from tennistools.simulation import stochastic_simulation_match
+
+
+def play_recording_servers(is_player0_first_server, point_winners):
+    """Plays the points into a Tmatch, recording the server of each point as it is played"""
+    tmatch = Tmatch(is_player0_first_server)
+    servers = []
+    for is_player0_point_winner in point_winners:
+        servers.append(int(tmatch.current_set.current_game.is_player0_server))
+        tmatch.play_point(is_player0_point_winner)
+    return tmatch, servers
+
+
+class TestPointLog(TestCase):
+
+    def test_round_trip(self):
+        """Matches replayed from the log have the same scores as the originals"""
+        tmatches = [stochastic_simulation_match(lambda match, p1, p2: 0.5) for _ in range(5)]
+        point_log = PointLog.from_tmatches(tmatches)
+        assert len(point_log) == 5
+        for original, replayed in zip(tmatches, point_log.to_tmatches()):
+            assert replayed.match_winner == original.match_winner
+            assert replayed.set_scores == original.set_scores
+            assert [[game.score_history for game in tset.game_history] for tset in replayed.set_history] == \
+                   [[game.score_history for game in tset.game_history] for tset in original.set_history]
+
+    def test_match_formats(self):
+        """Best of three and doubles matches replay in their own format, also after saving"""
+        tmatches = [stochastic_simulation_match(lambda match, p1, p2: 0.5, rng=seed, match_format=match_format)
+                    for seed, match_format in enumerate([BEST_OF_THREE, DOUBLES, BEST_OF_FIVE, DOUBLES])]
+        point_log = PointLog.from_tmatches(tmatches)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'log.npz')
+            point_log.save(path)
+            for log in [point_log, PointLog.load(path)]:
+                for original, replayed in zip(tmatches, log.to_tmatches()):
+                    assert replayed.match_format == original.match_format
+                    assert replayed.match_winner == original.match_winner is not None
+                    assert replayed.set_scores == original.set_scores
+
+    def test_offsets(self):
+        """A 6-0 6-0 6-0 match has 72 points in 18 games in 3 sets"""
+        point_log = PointLog.from_tmatches([stochastic_simulation_match(lambda match, p1, p2: 1.0)])
+        assert len(point_log.point_winners) == 72
+        assert (point_log.point_winners == 0).all()
+        assert point_log.game_offsets.tolist() == list(range(0, 73, 4))
+        assert point_log.set_offsets.tolist() == [0, 6, 12, 18]
+        assert point_log.match_offsets.tolist() == [0, 3]
+
+    def test_servers_in_tiebreak(self):
+        """The server of every point, including in a tiebreak, is the server when the point was played"""
+        point_winners = ([True] * 4 + [False] * 4) * 6 + [True, False, False, True, True, True, False, True, True]
+        tmatch, servers = play_recording_servers(False, point_winners)
+        point_log = PointLog.from_tmatches([tmatch])
+        assert point_log.is_player0_server.tolist() == servers
+        assert point_log.is_player0_first_server.tolist() == [0]
+
+    def test_match_in_play(self):
+        """Points of the game and set still in play are logged"""
+        tmatch, _ = play_recording_servers(True, [True] * 30)
+        replayed = PointLog.from_tmatches([tmatch]).get_tmatch(0)
+        assert replayed.get_match_score() == (1, 0)
+        assert replayed.current_set.get_current_score() == (1, 0)
+        assert replayed.current_set.current_game.get_current_score() == (2, 0)
+
+    def test_match_without_history(self):
+        """Matches played without history cannot be logged"""
+        with self.assertRaises(ValueError):
+            PointLog.from_tmatches([Tmatch(keep_history=False)])
+
+    def test_save_and_load(self):
+        """Saved logs load back the same, as a .npz file or memory-mapped from a directory"""
+        point_log = PointLog.from_tmatches([stochastic_simulation_match(lambda match, p1, p2: 0.5) for _ in range(3)])
+        with tempfile.TemporaryDirectory() as directory:
+            for path, mmap_mode in [(os.path.join(directory, 'log.npz'), None), (os.path.join(directory, 'log'), 'r')]:
+                point_log.save(path)
+                loaded = PointLog.load(path, mmap_mode=mmap_mode)
+                assert loaded.point_winners.tolist() == point_log.point_winners.tolist()
+                assert loaded.game_offsets.tolist() == point_log.game_offsets.tolist()
+                assert [t.set_scores for t in loaded.to_tmatches()] == [t.set_scores for t in point_log.to_tmatches()]
+                del loaded
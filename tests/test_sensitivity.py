@@ -0,0 +1,72 @@
+from unittest import TestCase
+
+import numpy as np
+
+from tennistools.sensitivity import attack_defence_model, match_win_probability_gradient, match_win_sensitivities, \
+    competition_sensitivities
+from tennistools.single_elimination_competition import calculate_competition_probabilities
+from tennistools.solver import match_win_probability
+
+
+def exact_competition_probabilities(playerlist):
+    win_probability_matrix = [[match_win_probability(*attack_defence_model.serve_probabilities(player0, player1))
+                               for player1 in playerlist] for player0 in playerlist]
+    return calculate_competition_probabilities(playerlist, win_probability_matrix)
+
+
+class TestMatchSensitivities(TestCase):
+
+    def test_gradient(self):
+        """Derivatives agree with finite differences of the exact solver"""
+        win_probability, by_player0_serve, by_player1_serve = match_win_probability_gradient(0.62, 0.6)
+        assert abs(win_probability - match_win_probability(0.62, 0.6)) < 1e-12
+        h = 1e-6
+        assert abs(by_player0_serve - (match_win_probability(0.62 + h, 0.6) - match_win_probability(0.62 - h, 0.6))
+                   / (2 * h)) < 1e-6
+        assert abs(by_player1_serve - (match_win_probability(0.62, 0.6 + h) - match_win_probability(0.62, 0.6 - h))
+                   / (2 * h)) < 1e-6
+
+    def test_match_sensitivities(self):
+        """Attack helps, the opponent's attack hurts, and the game is symmetric for equal players"""
+        player = {'attack': 1.8, 'defence': 1.5}
+        sensitivities = match_win_sensitivities(player, player)
+        assert abs(sensitivities['win_probability'] - 0.5) < 1e-12
+        assert sensitivities['player0_attack'] > 0 and sensitivities['player1_attack'] < 0
+        assert abs(sensitivities['player0_attack'] + sensitivities['player1_attack']) < 1e-12
+        assert sensitivities['player1_defence'] == -sensitivities['player0_attack']
+
+
+class TestCompetitionSensitivities(TestCase):
+
+    playerlist = [{'name': 'player' + str(i), 'attack': 1.5 + 0.1 * i, 'defence': 1.6 - 0.05 * i} for i in range(6)]
+
+    def test_probabilities(self):
+        """The probabilities are those of calculate_competition_probabilities"""
+        probabilities, _, _ = competition_sensitivities(self.playerlist)
+        assert np.abs(probabilities - exact_competition_probabilities(self.playerlist)).max() < 1e-12
+
+    def test_finite_differences(self):
+        """Every sensitivity agrees with moving one parameter of one player, including players with a bye"""
+        _, attack_sensitivities, defence_sensitivities = competition_sensitivities(self.playerlist)
+        h = 1e-5
+        for key, sensitivities in [('attack', attack_sensitivities), ('defence', defence_sensitivities)]:
+            for k in range(len(self.playerlist)):
+                up = [dict(player) for player in self.playerlist]
+                down = [dict(player) for player in self.playerlist]
+                up[k][key] += h
+                down[k][key] -= h
+                finite_difference = (exact_competition_probabilities(up) -
+                                     exact_competition_probabilities(down)) / (2 * h)
+                assert np.abs(finite_difference - sensitivities[:, :, k]).max() < 1e-7
+
+    def test_large_draw(self):
+        """A 128 player draw in one pass, the chances of winning always add up to one"""
+        rng = np.random.default_rng(0)
+        playerlist = [{'attack': attack, 'defence': defence}
+                      for attack, defence in zip(rng.uniform(1.4, 2.1, 128), rng.uniform(1.3, 1.7, 128))]
+        probabilities, attack_sensitivities, defence_sensitivities = competition_sensitivities(playerlist)
+        assert attack_sensitivities.shape == (8, 128, 128)
+        assert abs(probabilities[-1].sum() - 1) < 1e-12
+        assert np.abs(attack_sensitivities[-1].sum(axis=0)).max() < 1e-12
+        assert np.abs(defence_sensitivities[-1].sum(axis=0)).max() < 1e-12
+        assert (np.diag(attack_sensitivities[-1]) > 0).all()
@@ -0,0 +1,105 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from tennistools.monte_carlo import simulate_competition_parallel
+from tennistools.service import SimulationService
+from tennistools.simulation import serve_probability_function
+
+
+@serve_probability_function
+def serve_strength(player0, player1):
+    return player0['serve'], player1['serve']
+
+
+def failing_model(tmatch, player0, player1):
+    raise RuntimeError('model failed')
+
+
+class TestSimulationService(TestCase):
+
+    playerlist = [{'name': 'player' + str(i), 'serve': 0.58 + 0.01 * i} for i in range(5)]
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.service = SimulationService(self.executor, chunk_size=10, chunks_in_flight=2)
+
+    def tearDown(self):
+        self.service.close()
+        self.executor.shutdown()
+
+    def test_price(self):
+        #The final counts for a seed do not depend on the executor, and are those of simulate_competition_parallel
+        result = asyncio.run(self.service.price(self.playerlist, serve_strength, 35, seed=2))
+        assert result['is_complete'] and result['n'] == 35
+        expected = simulate_competition_parallel(self.playerlist, serve_strength, 35, seed=2, n_workers=1,
+                                                 chunk_size=self.service.chunk_size)
+        assert (result['reach_counts'] == expected).all()
+        assert (result['lower'] <= result['probabilities']).all() and (result['probabilities'] <= result['upper']).all()
+        assert self.service.in_flight() == 0
+
+    def test_stream(self):
+        async def collect():
+            return [partial async for partial in self.service.stream(self.playerlist, serve_strength, 35, seed=2)]
+        partials = asyncio.run(collect())
+        assert [partial['n'] for partial in partials] == sorted(partial['n'] for partial in partials)
+        assert len(partials) == 4 and partials[-1]['n'] == 35
+        assert [partial['is_complete'] for partial in partials] == [False, False, False, True]
+        assert (partials[-1]['reach_counts'][0] == 35).all()
+
+    def test_coalesce(self):
+        #Identical requests in flight together share one simulation, a different seed does not
+        async def prices():
+            return await asyncio.gather(self.service.price(self.playerlist, serve_strength, 40, seed=1),
+                                        self.service.price(self.playerlist, serve_strength, 40, seed=1),
+                                        self.service.price(self.playerlist, serve_strength, 40, seed=3))
+        first, second, third = asyncio.run(prices())
+        assert self.service.coalesced == 1
+        assert (first['reach_counts'] == second['reach_counts']).all()
+        assert third['n'] == 40
+
+    def test_event_loop_not_blocked(self):
+        async def price_and_tick():
+            ticks = 0
+            task = asyncio.ensure_future(self.service.price(self.playerlist, serve_strength, 60, seed=1))
+            while not task.done():
+                ticks += 1
+                await asyncio.sleep(0.001)
+            return ticks, task.result()
+        ticks, result = asyncio.run(price_and_tick())
+        assert ticks > 1 and result['n'] == 60
+
+    def test_small_request_not_held_up(self):
+        #A large request only has a few chunks queued at a time, so a small one arriving after it finishes first
+        async def prices():
+            finished = []
+
+            async def price(n_replications):
+                await self.service.price(self.playerlist, serve_strength, n_replications, seed=1)
+                finished.append(n_replications)
+            large = asyncio.ensure_future(price(400))
+            await asyncio.sleep(0)
+            await asyncio.gather(large, price(10))
+            return finished
+        assert asyncio.run(prices()) == [10, 400]
+
+    def test_process_pool(self):
+        with SimulationService(max_workers=2, chunk_size=10) as service:
+            result = asyncio.run(service.price(self.playerlist, serve_strength, 25, seed=2))
+        assert (result['reach_counts'] ==
+                asyncio.run(self.service.price(self.playerlist, serve_strength, 25, seed=2))['reach_counts']).all()
+
+    def test_cancel(self):
+        #Stopping the only request waiting on a simulation cancels it
+        async def first_partial():
+            async for partial in self.service.stream(self.playerlist, serve_strength, 200, seed=1):
+                return partial
+        partial = asyncio.run(first_partial())
+        assert partial['n'] == 10 and not partial['is_complete']
+        assert self.service.in_flight() == 0
+
+    def test_errors(self):
+        with self.assertRaises(RuntimeError):
+            asyncio.run(self.service.price(self.playerlist, failing_model, 20))
+        with self.assertRaises(ValueError):
+            asyncio.run(self.service.price(self.playerlist, serve_strength, 0))
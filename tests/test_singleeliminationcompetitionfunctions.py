@@ -3,9 +3,11 @@ import math
 
 from tennistools import Tmatch
 from tennistools.simulation import stochastic_simulation_match, stochastic_simulation_set, \
-    stochastic_simulation_game, stochastical_simulation_next_point
+    stochastic_simulation_game, stochastical_simulation_next_point, batch_probability_function
+import numpy as np
 
-from tennistools.single_elimination_competition import calculate_bye_rounds, simulate_competition_round, simulate_competition
+from tennistools.single_elimination_competition import calculate_bye_rounds, simulate_competition_round, simulate_competition, \
+    calculate_bracket_slots, calculate_competition_probabilities, calculate_rounds_won
 
 class TestCompetitionFunctions(TestCase):
 
@@ -40,3 +42,75 @@ class TestCompetitionFunctions(TestCase):
         assert len(match_history) == 2 #e.g. Two rounds of tennis played
         assert len(match_history[0])==2 #e.g. 2 match played in round 0 (semi finals)
         assert len(match_history[1])==1 #e.g. 1 match played in round 1(finals)
+
+    def test_play_competition_results_only(self):
+        #Only the winner and set scores of each match are kept
+        playerlist = [{'name': 'player1'}, {'name': 'player2'}, {'name': 'player3'}, {'name': 'player4'}]
+        winner, match_history = simulate_competition(playerlist, lambda match, p1, p2: 1.0, results_only=True)
+        assert winner == {'name': 'player1'}
+        final = match_history[1][0]
+        assert 'match' not in final
+        assert final['match_winner'] == 0
+        assert final['set_scores'] == [(6, 0), (6, 0), (6, 0)]
+
+    def test_play_competition_batch_probability_function(self):
+        #A batch probability function plays each round together
+        playerlist = [{'name': 'player1'}, {'name': 'player2'}, {'name': 'player3'}, {'name': 'player4'}]
+        round_sizes = []
+
+        @batch_probability_function
+        def player0_always_wins(state, players0, players1):
+            round_sizes.append(len(players0))
+            return np.ones(len(state['match_index']))
+
+        winner, match_history = simulate_competition(playerlist, player0_always_wins)
+        assert winner == {'name': 'player1'}
+        assert match_history[1][0]['match'].set_scores == [(6, 0), (6, 0), (6, 0)]
+        assert set(round_sizes) == {2, 1}
+
+    def test_play_competition_seeded(self):
+        #The same seed plays the same competition
+        playerlist = [{'name': 'player' + str(i)} for i in range(5)]
+        winner, match_history = simulate_competition(playerlist, lambda match, p1, p2: 0.5, rng=21)
+        same_winner, same_match_history = simulate_competition(playerlist, lambda match, p1, p2: 0.5, rng=21)
+        assert winner is same_winner
+        assert [[match['match'].set_scores for match in round_matches.values()]
+                for round_matches in match_history.values()] == \
+               [[match['match'].set_scores for match in round_matches.values()]
+                for round_matches in same_match_history.values()]
+
+    def test_rounds_won(self):
+        #Player1 has a bye then wins the final, player2 beats player3 and loses the final
+        playerlist = [{'name': 'player1'}, {'name': 'player2'}, {'name': 'player3'}]
+        winner, match_history = simulate_competition(playerlist, lambda match, p1, p2: 1.0)
+        assert calculate_rounds_won(playerlist, match_history).tolist() == [2, 1, 0]
+
+
+class TestCompetitionProbabilities(TestCase):
+
+    def test_bracket_slots(self):
+        #Slots follow calculate_bye_rounds, with byes as -1
+        assert calculate_bracket_slots(3).tolist() == [0, -1, 1, 2]
+        assert calculate_bracket_slots(4).tolist() == [0, 1, 2, 3]
+
+    def test_even_competition(self):
+        #Every match even, player 0 has a bye into the final
+        playerlist = [{'name': 'player1'}, {'name': 'player2'}, {'name': 'player3'}]
+        probabilities = calculate_competition_probabilities(playerlist, [[0.5] * 3] * 3)
+        assert probabilities.tolist() == [[1.0, 1.0, 1.0], [1.0, 0.5, 0.5], [0.5, 0.25, 0.25]]
+
+    def test_certain_winner(self):
+        #Player 3 beats everyone
+        playerlist = [{'name': 'player1'}, {'name': 'player2'}, {'name': 'player3'}, {'name': 'player4'}]
+        win_probability_matrix = [[0.5, 0.5, 0.5, 0.0], [0.5, 0.5, 0.5, 0.0], [0.5, 0.5, 0.5, 0.0],
+                                  [1.0, 1.0, 1.0, 0.5]]
+        probabilities = calculate_competition_probabilities(playerlist, win_probability_matrix)
+        assert probabilities[-1].tolist() == [0.0, 0.0, 0.0, 1.0]
+        assert probabilities[1].tolist() == [0.5, 0.5, 0.0, 1.0]
+
+    def test_players_per_round(self):
+        #Expected number of players in each round is the size of that round
+        playerlist = [{'name': f'player{i}'} for i in range(11)]
+        win_probability_matrix = [[0.5 + 0.04 * (j - i) for j in range(11)] for i in range(11)]
+        probabilities = calculate_competition_probabilities(playerlist, win_probability_matrix)
+        assert [round(total, 9) for total in probabilities.sum(axis=1)] == [11, 8, 4, 2, 1]
@@ -0,0 +1,121 @@
+from unittest import TestCase
+
+from tennistools.solver import game_win_probability, tiebreak_win_probability, set_score_distribution, \
+    set_win_probability, match_score_distribution, match_win_probability, game_score_distribution, \
+    tiebreak_score_distribution, outcome_tables, match_win_probabilities
+from tennistools.simulation import stochastic_simulation_match_batch
+import numpy as np
+
+
+class TestGameWinProbability(TestCase):
+
+    def test_even_players(self):
+        """Evenly matched points give an even game"""
+        assert abs(game_win_probability(0.5) - 0.5) < 1e-12
+
+    def test_known_value(self):
+        """Matches the closed form p^4(1 + 4q + 10q^2) + 20p^3q^3 p^2/(p^2 + q^2)"""
+        p, q = 0.6, 0.4
+        expected = p**4 * (1 + 4*q + 10*q**2) + 20 * p**3 * q**3 * p**2 / (p**2 + q**2)
+        assert abs(game_win_probability(p) - expected) < 1e-12
+
+    def test_from_score(self):
+        """Finished and deuce scores"""
+        assert game_win_probability(0.6, 4, 2) == 1.0
+        assert game_win_probability(0.6, 1, 4) == 0.0
+        assert abs(game_win_probability(0.6, 5, 5) - game_win_probability(0.6, 3, 3)) < 1e-12
+
+
+class TestTiebreakWinProbability(TestCase):
+
+    def test_even_players(self):
+        """Players with the same serve strength are even, whoever serves first"""
+        assert abs(tiebreak_win_probability(0.6, 0.6, True) - 0.5) < 1e-12
+        assert abs(tiebreak_win_probability(0.6, 0.6, False) - 0.5) < 1e-12
+
+    def test_certain_points(self):
+        """A player who wins every point wins the tiebreak"""
+        assert tiebreak_win_probability(1.0, 0.0, True) == 1.0
+
+
+class TestSetScoreDistribution(TestCase):
+
+    def test_distribution_sums_to_one(self):
+        """Distribution covers every final set score"""
+        distribution = set_score_distribution(0.65, 0.62, True)
+        assert abs(sum(distribution.values()) - 1) < 1e-12
+        assert len(distribution) == 14
+
+    def test_certain_points(self):
+        """A player who wins every point wins 6-0"""
+        assert set_score_distribution(1.0, 0.0, True)[(6, 0)] == 1.0
+
+    def test_set_win_probability(self):
+        """Set win probability is the sum over the scores player 0 wins"""
+        distribution = set_score_distribution(0.65, 0.62, False, 3, 2)
+        expected = sum(p for (games0, games1), p in distribution.items() if games0 > games1)
+        assert abs(set_win_probability(0.65, 0.62, False, 3, 2) - expected) < 1e-12
+
+
+class TestMatchWinProbability(TestCase):
+
+    def test_even_players(self):
+        """Players with the same serve strength are even"""
+        assert abs(match_win_probability(0.62, 0.62) - 0.5) < 1e-12
+
+    def test_distribution(self):
+        """Match scores are 3-0, 3-1, 3-2 either way and sum to one"""
+        distribution = match_score_distribution(0.65, 0.62)
+        assert set(distribution) == {(3, 0), (3, 1), (3, 2), (0, 3), (1, 3), (2, 3)}
+        assert abs(sum(distribution.values()) - 1) < 1e-12
+
+    def test_matches_simulation(self):
+        """Agrees with simulated matches, well inside the sampling error"""
+        match_winners, _, _ = stochastic_simulation_match_batch(0.65, 0.62, 20000)
+        assert abs((match_winners == 0).mean() - match_win_probability(0.65, 0.62)) < 0.02
+
+    def test_arrays(self):
+        """The array version agrees with match_win_probability for every pair"""
+        player0_serve = np.array([0.5, 0.62, 0.7, 0.9])
+        player1_serve = np.array([0.55, 0.62, 0.6, 0.3])
+        expected = [match_win_probability(a, b) for a, b in zip(player0_serve, player1_serve)]
+        assert np.abs(match_win_probabilities(player0_serve, player1_serve) - expected).max() < 1e-12
+
+
+class TestOutcomeTables(TestCase):
+
+    def test_game_score_distribution(self):
+        """Game scores sum to one and agree with the game win probability"""
+        distribution = game_score_distribution(0.6)
+        assert abs(sum(distribution.values()) - 1) < 1e-12
+        assert abs(sum(p for (server, receiver), p in distribution.items() if server > receiver)
+                   - game_win_probability(0.6)) < 1e-12
+        assert abs(distribution[(4, 0)] - 0.6 ** 4) < 1e-12
+
+    def test_tiebreak_score_distribution(self):
+        """Tiebreak scores sum to one and agree with the tiebreak win probability"""
+        distribution = tiebreak_score_distribution(0.65, 0.6, False)
+        assert abs(sum(distribution.values()) - 1) < 1e-12
+        assert abs(sum(p for (points0, points1), p in distribution.items() if points0 > points1)
+                   - tiebreak_win_probability(0.65, 0.6, False)) < 1e-12
+
+    def test_never_ending_tiebreak(self):
+        """A tiebreak where both players always win their serve never finishes"""
+        with self.assertRaises(ValueError):
+            tiebreak_score_distribution(1.0, 1.0, True)
+
+    def test_tables(self):
+        """Tables are given from player 0's point of view for either server, and are cached"""
+        tables = outcome_tables(0.6, 0.7)
+        player1_serving = dict(zip(map(tuple, tables['game'][False]['scores']), tables['game'][False]['probabilities']))
+        assert abs(player1_serving[(0, 4)] - 0.7 ** 4) < 1e-12
+        assert abs(tables['set'][True]['cumulative'][-1] - 1) < 1e-12
+        assert outcome_tables(0.6, 0.7) is tables
+
+    def test_caches_are_bounded(self):
+        """Many different serve probabilities do not grow the caches without limit"""
+        for i in range(300):
+            match_win_probability(0.6 + i * 1e-6, 0.62)
+        for cached_function in [game_win_probability, tiebreak_win_probability, outcome_tables]:
+            info = cached_function.cache_info()
+            assert info.maxsize is not None and info.currsize <= info.maxsize
@@ -0,0 +1,93 @@
+from unittest import TestCase
+
+import numpy as np
+
+from tennistools import Tmatch, BEST_OF_FIVE, BEST_OF_THREE, DOUBLES, MatchFormat
+from tennistools.simulation import serve_probability_function, stochastic_simulation_match, \
+    stochastic_simulation_match_states, antithetic_draws
+from tennistools.state_machine import match_state_tables, play_match_states, result_to_tmatch, encode_state
+
+FORMATS = [BEST_OF_FIVE, BEST_OF_THREE, DOUBLES, MatchFormat(sets_required=2, is_no_ad=True)]
+
+
+@serve_probability_function
+def serve_strength(player0, player1):
+    return player0['serve'], player1['serve']
+
+
+def point_by_point(tmatch, player0, player1):
+    """serve_strength as a plain point win probability function, so matches are played through Tmatch"""
+    if tmatch.current_set.current_game.is_player0_server:
+        return player0['serve']
+    return 1 - player1['serve']
+
+
+class TestStateMachine(TestCase):
+
+    def test_tables(self):
+        for match_format in FORMATS:
+            tables = match_state_tables(match_format)
+            match_over = tables['match_over']
+            assert len(tables['next_state']) == 2 * (match_over + 2)
+            assert len(tables['is_player0_serving']) == match_over + 2
+            # Finished matches never change
+            assert tables['next_state'][2 * match_over:] == [match_over, match_over, match_over + 1, match_over + 1]
+            assert tables['is_player0_serving'][tables['start'][True]]
+            assert not tables['is_player0_serving'][tables['start'][False]]
+
+    def test_same_as_tmatch(self):
+        #Playing the same points through the tables and through a Tmatch gives the same states and result
+        rng = np.random.default_rng(0)
+        for match_format in FORMATS:
+            tables = match_state_tables(match_format)
+            for _ in range(20):
+                is_player0_first_server = bool(rng.uniform() < 0.5)
+                result = play_match_states(0.6, 0.55, is_player0_first_server, rng.uniform, match_format,
+                                           record_points=True)
+                tmatch = Tmatch(is_player0_first_server, match_format=match_format)
+                for is_player0_point_winner in result.points:
+                    state = encode_state(tmatch)
+                    assert tables['is_player0_serving'][state] == tmatch.current_set.current_game.is_player0_server
+                    tmatch.play_point(is_player0_point_winner)
+                    assert encode_state(tmatch) == tables['next_state'][2 * state + is_player0_point_winner]
+                assert tmatch.match_winner == result.match_winner
+                assert tmatch.set_scores == result.set_scores
+                assert tmatch.points_played == result.points_played
+
+    def test_result_to_tmatch(self):
+        result = play_match_states(0.65, 0.6, True, np.random.default_rng(1).uniform, record_points=True)
+        tmatch = result_to_tmatch(result, True, keep_history=True)
+        assert tmatch.keep_history and len(tmatch.set_history) == len(result.set_scores)
+        assert sum(len(tgame.score_history) for tset in tmatch.set_history for tgame in tset.game_history) == \
+            result.points_played
+        tmatch = result_to_tmatch(result, True)
+        assert tmatch.set_scores == result.set_scores and tmatch.points_played == result.points_played
+        result = play_match_states(0.65, 0.6, True, np.random.default_rng(1).uniform)
+        assert result.points is None
+        self.assertRaises(ValueError, result_to_tmatch, result, True, True)
+
+    def test_simulation_unchanged(self):
+        #Serve probability functions give the same matches as playing every point through a Tmatch
+        player0, player1 = {'serve': 0.62}, {'serve': 0.6}
+        for match_format in [BEST_OF_FIVE, DOUBLES]:
+            for seed in range(5):
+                tmatch = stochastic_simulation_match(serve_strength, player0, player1, rng=seed,
+                                                     match_format=match_format)
+                expected = stochastic_simulation_match(point_by_point, player0, player1, rng=seed,
+                                                       match_format=match_format)
+                assert tmatch.set_scores == expected.set_scores and tmatch.match_winner == expected.match_winner
+                assert str(tmatch) == str(expected)
+        np.random.seed(3)
+        with antithetic_draws():
+            tmatch = stochastic_simulation_match(serve_strength, player0, player1, keep_history=False)
+        np.random.seed(3)
+        with antithetic_draws():
+            expected = stochastic_simulation_match(point_by_point, player0, player1, keep_history=False)
+        assert tmatch.set_scores == expected.set_scores and tmatch.points_played == expected.points_played
+
+    def test_match_states(self):
+        result, is_player0_first_server = stochastic_simulation_match_states(serve_strength, {'serve': 0.62},
+                                                                             {'serve': 0.6}, rng=4)
+        tmatch = stochastic_simulation_match(serve_strength, {'serve': 0.62}, {'serve': 0.6}, rng=4)
+        assert result.set_scores == tmatch.set_scores and result.match_winner == tmatch.match_winner
+        self.assertRaises(ValueError, stochastic_simulation_match_states, point_by_point)
@@ -1,9 +1,12 @@
 from unittest import TestCase
 import math
 
-from tennistools import Tmatch
+from tennistools import Tmatch, BEST_OF_THREE, DOUBLES
 from tennistools.simulation import stochastic_simulation_match, stochastic_simulation_set, \
-    stochastic_simulation_game, stochastical_simulation_next_point
+    stochastic_simulation_game, stochastical_simulation_next_point, stochastic_simulation_match_batch, \
+    batch_probability_function, is_batch_probability_function, match_state_features, stochastic_simulation_matches, \
+    stochastic_simulation_match_fast, antithetic_draws, UniformStream, random_stream, serve_probability_function
+import numpy as np
 
 #from tennistools.single_elimination_competition import calculate_bye_rounds, play_round, play_competition
 
@@ -146,6 +149,13 @@ class TestStochastic_Tennis_simulations_Match(TestCase):
         assert tmatch.is_match_over() == True
         assert tmatch.match_winner == 0
 
+    def test_play_match_without_history(self):
+        """Only the result is kept"""
+        tmatch = stochastic_simulation_match(lambda match, p1, p2: 1.0, keep_history=False)
+        assert tmatch.match_winner == 0
+        assert tmatch.set_scores == [(6, 0), (6, 0), (6, 0)]
+        assert tmatch.set_history == []
+
     def test_play_match_stochastically(self):
         """Ensuring the match can play with a simple fixed probability of winning each point"""
         tmatch = stochastic_simulation_match(lambda match, p1, p2: 0.5)  # player 0 wins 100%
@@ -173,6 +183,213 @@ class TestStochastic_Tennis_simulations_Match(TestCase):
         assert max(tmatch.set_history[-1].get_current_score()) in [6,7]
         assert tmatch.set_history[-1].is_set_over() == True
         assert tmatch.set_history[-1].set_winner in [0,1]
+
+class TestStochastic_Tennis_simulations_Random_Streams(TestCase):
+
+    def test_uniform_stream(self):
+        """Single numbers come from blocks of the Generator in order"""
+        stream = UniformStream(3, block_size=4)
+        assert [stream.uniform() for _ in range(6)] == np.random.default_rng(3).random(8)[:6].tolist()
+        assert stream.uniform(size=3).shape == (3,)
+        assert random_stream(stream) is stream
+        assert random_stream(None) is None
+
+    def test_seeded_matches_are_reproducible(self):
+        """The same seed gives the same match, without touching the global random state"""
+        np.random.seed(0)
+        global_state = np.random.get_state()[1].copy()
+        tmatch = stochastic_simulation_match(lambda match, p1, p2: 0.5, rng=11)
+        same_tmatch = stochastic_simulation_match(lambda match, p1, p2: 0.5, rng=np.random.default_rng(11))
+        assert tmatch.set_scores == same_tmatch.set_scores
+        assert tmatch.points_played == same_tmatch.points_played
+        assert (np.random.get_state()[1] == global_state).all()
+        assert stochastic_simulation_match_fast(0.6, 0.6, rng=4).set_scores == \
+               stochastic_simulation_match_fast(0.6, 0.6, rng=4).set_scores
+        assert stochastic_simulation_match_batch(0.6, 0.6, 50, rng=4)[1].tolist() == \
+               stochastic_simulation_match_batch(0.6, 0.6, 50, rng=4)[1].tolist()
+
+    def test_shared_stream(self):
+        """Points drawn from a shared stream carry on where the last match stopped"""
+        stream = UniformStream(8)
+        first = stochastic_simulation_match(lambda match, p1, p2: 0.5, rng=stream)
+        second = stochastic_simulation_match(lambda match, p1, p2: 0.5, rng=stream)
+        tmatch = Tmatch(True)
+        stochastical_simulation_next_point(tmatch, lambda match, p1, p2: 0.5, rng=np.random.default_rng(8))
+        assert tmatch.points_played == 1
+        assert (first.set_scores, first.points_played) != (second.set_scores, second.points_played)
+
+
+class TestStochastic_Tennis_simulations_Match_Formats(TestCase):
+
+    def test_play_match(self):
+        """Matches are played in the format given"""
+        tmatch = stochastic_simulation_match(lambda match, p1, p2: 1.0, match_format=BEST_OF_THREE)
+        assert tmatch.set_scores == [(6, 0), (6, 0)]
+        tmatch = stochastic_simulation_match(lambda match, p1, p2: 0.5, keep_history=False, match_format=DOUBLES, rng=2)
+        assert max(tmatch.get_match_score()) == 2
+
+    def test_batch_matches_point_by_point(self):
+        """The batch engine keeps score as Tmatch does, including no-ad games and match tiebreaks"""
+        @serve_probability_function
+        def serve_strength(player0, player1):
+            return player0, player1
+
+        players0, players1 = [0.62] * 300, [0.6] * 300
+        for match_format in [BEST_OF_THREE, DOUBLES]:
+            replayed = stochastic_simulation_matches(serve_strength, players0, players1, rng=3,
+                                                     match_format=match_format)
+            results = stochastic_simulation_matches(serve_strength, players0, players1, keep_history=False, rng=3,
+                                                    match_format=match_format)
+            assert [tmatch.set_scores for tmatch in replayed] == [tmatch.set_scores for tmatch in results]
+            assert [tmatch.points_played for tmatch in replayed] == [tmatch.points_played for tmatch in results]
+            assert all(max(tmatch.get_match_score()) == 2 for tmatch in results)
+        assert any(len(tmatch.set_scores) == 3 and sum(tmatch.set_scores[-1]) == 1 for tmatch in results)
+
+
+class TestStochastic_Tennis_simulations_Match_Fast(TestCase):
+
+    def test_play_match(self):
+        """Match with 100% likelihood gives answer as expected"""
+        tmatch = stochastic_simulation_match_fast(1.0, 0.0)
+        assert tmatch.match_winner == 0
+        assert tmatch.set_scores == [(6, 0), (6, 0), (6, 0)]
+
+    def test_play_match_stochastically(self):
+        """Sampled set scores give a finished match"""
+        tmatch = stochastic_simulation_match_fast(0.6, 0.6)
+        assert max(tmatch.get_match_score()) == 3
+        assert tmatch.is_match_over() == True
+        assert len(tmatch.set_scores) in range(3, 6)
+
+    def test_match_format(self):
+        """Best of three sets plays to two sets, formats with other sets cannot be sampled"""
+        tmatch = stochastic_simulation_match_fast(0.6, 0.6, rng=1, match_format=BEST_OF_THREE)
+        assert max(tmatch.get_match_score()) == 2 and len(tmatch.set_scores) in (2, 3)
+        with self.assertRaises(ValueError):
+            stochastic_simulation_match_fast(0.6, 0.6, match_format=DOUBLES)
+
+class TestStochastic_Tennis_simulations_Batch(TestCase):
+
+    def test_play_matches(self):
+        """Matches with 100% likelihood give answers as expected"""
+        match_winners, set_scores, game_scores = stochastic_simulation_match_batch(1.0, 0.0, 10)
+        assert (match_winners == 0).all()
+        assert (set_scores == [3, 0]).all()
+        assert (game_scores[:, :3] == [6, 0]).all()
+        assert (game_scores[:, 3:] == 0).all()
+
+    def test_play_matches_stochastically(self):
+        """Every match finishes with a valid score"""
+        match_winners, set_scores, game_scores = stochastic_simulation_match_batch(0.6, 0.6, 1000)
+        assert (set_scores.max(axis=1) == 3).all()
+        assert (set_scores[:, 1] == 3).tolist() == (match_winners == 1).tolist()
+        sets_played = set_scores.sum(axis=1)
+        for games, n_sets in zip(game_scores, sets_played):
+            for player0_games, player1_games in games[:n_sets]:
+                assert (max(player0_games, player1_games) == 6 and abs(player0_games - player1_games) >= 2) or \
+                       sorted([player0_games, player1_games]) in [[5, 7], [6, 7]]
+            assert (games[n_sets:] == 0).all()
+
+    def test_play_matches_with_different_pairings(self):
+        """Each match uses its own serve probabilities"""
+        match_winners, _, _ = stochastic_simulation_match_batch([1.0, 0.0], [0.0, 1.0], 2)
+        assert match_winners.tolist() == [0, 1]
+
+    def test_play_matches_antithetic(self):
+        """The second half of an antithetic batch mirrors the first, so even players win opposite halves"""
+        np.random.seed(6)
+        match_winners, set_scores, _ = stochastic_simulation_match_batch(0.6, 0.6, 200, antithetic=True)
+        assert (set_scores.max(axis=1) == 3).all()
+        assert abs(match_winners.mean() - 0.5) < 0.1
+        with self.assertRaises(ValueError):
+            stochastic_simulation_match_batch(0.6, 0.6, 11, antithetic=True)
+
+
+@batch_probability_function
+def batch_winscore(state, players0, players1):
+    """Batch version of winscore: player strengths are looked up for every match in play"""
+    attack0 = np.array([player['attack'] for player in players0])[state['match_index']]
+    defence0 = np.array([player['defence'] for player in players0])[state['match_index']]
+    attack1 = np.array([player['attack'] for player in players1])[state['match_index']]
+    defence1 = np.array([player['defence'] for player in players1])[state['match_index']]
+    return np.where(state['is_player0_server'], 1 / (1 + np.exp(-(attack0 - defence1))),
+                    1 - 1 / (1 + np.exp(-(attack1 - defence0))))
+
+
+class TestStochastic_Tennis_simulations_Batch_Probability_Function(TestCase):
+
+    player0 = {'name': 'player 0', 'attack': 2.0, 'defence': 1.6}  # <--stronger player
+    player1 = {'name': 'player 1', 'attack': 1.6, 'defence': 1.6}
+
+    def test_detected(self):
+        """Decorated functions are recognised as batch probability functions"""
+        assert is_batch_probability_function(batch_winscore)
+        assert not is_batch_probability_function(lambda match, p1, p2: 0.5)
+
+    def test_per_point_use(self):
+        """A batch probability function can still be called for a single Tmatch"""
+        tmatch = Tmatch(True)
+        expected = 1 / (1 + math.exp(-(2.0 - 1.6)))
+        assert abs(batch_winscore(tmatch, self.player0, self.player1) - expected) < 1e-12
+
+    def test_match_state_features(self):
+        """Features describe the current score, with long deuces reduced"""
+        tmatch = Tmatch(False)
+        for player0_won_point in [True] * 4 + [True, False] * 5:
+            tmatch.play_point(player0_won_point)
+        features = match_state_features(tmatch)
+        assert features['player0_games'].tolist() == [1]
+        assert features['is_player0_server'].tolist() == [True]
+        assert (features['player0_points'].tolist(), features['player1_points'].tolist()) == ([3], [3])
+
+    def test_called_once_per_point_for_all_matches(self):
+        """Matches are played together, with one call per point for every match in play"""
+        calls = []
+
+        @batch_probability_function
+        def certain_winner(state, players0, players1):
+            calls.append(len(state['match_index']))
+            return np.ones(len(state['match_index']))
+
+        tmatches = stochastic_simulation_matches(certain_winner, [None] * 20, [None] * 20)
+        assert [tmatch.set_scores for tmatch in tmatches] == [[(6, 0), (6, 0), (6, 0)]] * 20
+        assert calls == [20] * 72
+
+    def test_play_matches_with_policy(self):
+        """Matches played in a batch finish with a winner"""
+        tmatches = stochastic_simulation_matches(batch_winscore, [self.player0] * 10, [self.player1] * 10)
+        for tmatch in tmatches:
+            assert tmatch.is_match_over()
+            assert max(tmatch.get_match_score()) == 3
+            assert len(tmatch.set_history) in range(3, 6)
+
+    def test_antithetic_draws(self):
+        """Inside antithetic_draws the same random state gives the complement of every point and first server"""
+        np.random.seed(5)
+        tmatch = stochastic_simulation_match(lambda match, player0, player1: 0.5)
+        np.random.seed(5)
+        with antithetic_draws():
+            antithetic_match = stochastic_simulation_match(lambda match, player0, player1: 0.5)
+        assert antithetic_match.set_history[0].is_player0_server != tmatch.set_history[0].is_player0_server
+        points = tmatch.set_history[0].game_history[0].score_history
+        antithetic_points = antithetic_match.set_history[0].game_history[0].score_history
+        common = min(len(points), len(antithetic_points))
+        assert [1 - point for point in points[:common]] == antithetic_points[:common]
+
+    def test_results_only_matches_full_replay(self):
+        """Without history the results come straight from the batch, and match those replayed point by point"""
+        np.random.seed(12)
+        full = stochastic_simulation_matches(batch_winscore, [self.player0] * 30, [self.player1] * 30)
+        np.random.seed(12)
+        light = stochastic_simulation_matches(batch_winscore, [self.player0] * 30, [self.player1] * 30,
+                                              keep_history=False)
+        for full_match, light_match in zip(full, light):
+            assert light_match.match_winner == full_match.match_winner
+            assert light_match.set_scores == full_match.set_scores
+            assert light_match.points_played == full_match.points_played
+            assert light_match.is_player0_server == full_match.is_player0_server
+            assert light_match.set_history == []
+
     #
     # def test_play_set_randomly(self):
     #     """Ensuring the match can play with a simple fixed probability of winning each point"""
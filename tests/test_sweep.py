@@ -0,0 +1,81 @@
+import os
+import sqlite3
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from tennistools.instrumentation import instrumented
+from tennistools.monte_carlo import simulate_competition_parallel
+from tennistools.simulation import serve_probability_function
+from tennistools.sweep import run_sweep, load_sweep, SweepStore
+
+
+@serve_probability_function
+def serve_strength(player0, player1):
+    """Module level so it can be sent to worker processes"""
+    return player0['serve'], player1['serve']
+
+
+class TestSweep(TestCase):
+
+    playerlist = [{'name': 'player' + str(i), 'serve': 0.58 + 0.01 * i} for i in range(5)]
+    scenarios = [{'name': 'base', 'playerlist': playerlist},
+                 {'name': 'stronger', 'playerlist': playerlist[:4] + [{'name': 'player4', 'serve': 0.7}]}]
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'sweep.sqlite')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_matches_parallel(self):
+        #A scenario gives the counts of simulate_competition_parallel with the same seed and chunks
+        reach_counts = run_sweep(self.scenarios, serve_strength, self.path, 25, seed=3, n_workers=1, chunk_size=10)
+        assert (reach_counts['base'] == simulate_competition_parallel(self.playerlist, serve_strength, 25, seed=3,
+                                                                      n_workers=1, chunk_size=10)).all()
+        results = load_sweep(self.path)
+        assert set(results) == {'base', 'stronger'}
+        wins = results['stronger']['round'] == 3
+        assert results['stronger']['reach_count'][wins].sum() == 25
+        assert (results['stronger']['n'] == 25).all()
+        assert (results['stronger']['lower'] <= results['stronger']['probability']).all()
+
+    def test_resume(self):
+        #Only the chunks that were not saved are simulated again, and the result is the same
+        reach_counts = run_sweep(self.scenarios, serve_strength, self.path, 25, seed=3, n_workers=1, chunk_size=10)
+        connection = sqlite3.connect(self.path)
+        with connection:
+            connection.execute("DELETE FROM chunks WHERE scenario = 'stronger' AND chunk = 2")
+            connection.execute("DELETE FROM results WHERE scenario = 'stronger'")
+            connection.execute("UPDATE scenarios SET is_complete = 0 WHERE name = 'stronger'")
+        connection.close()
+
+        with instrumented() as collector:
+            resumed_reach_counts = run_sweep(self.scenarios, serve_strength, self.path, 25, n_workers=1, chunk_size=10)
+        assert collector.counters['competitions'] == 5
+        for name in reach_counts:
+            assert (resumed_reach_counts[name] == reach_counts[name]).all()
+        assert len(load_sweep(self.path)['stronger']['probability']) == 4 * 5
+
+    def test_mismatch(self):
+        #A resumed sweep has to use the same seed and scenarios
+        run_sweep(self.scenarios[:1], serve_strength, self.path, 10, seed=3, n_workers=1)
+        with self.assertRaises(ValueError):
+            run_sweep(self.scenarios[:1], serve_strength, self.path, 10, seed=4, n_workers=1)
+        with self.assertRaises(ValueError):
+            run_sweep(self.scenarios[:1], serve_strength, self.path, 20, seed=3, n_workers=1)
+        with self.assertRaises(ValueError):
+            run_sweep(self.scenarios[:1] * 2, serve_strength, self.path, 10, seed=3, n_workers=1)
+        with SweepStore(self.path) as store:
+            assert store.seed == 3
+            assert store.scenario_names() == ['base']
+
+    def test_workers(self):
+        #The counts do not depend on the number of processes
+        parallel = run_sweep(self.scenarios, serve_strength, self.path, 20, seed=5, n_workers=2, chunk_size=10)
+        serial = run_sweep(self.scenarios, serve_strength, os.path.join(self.directory.name, 'serial.sqlite'), 20,
+                           seed=5, n_workers=1, chunk_size=10)
+        for name in serial:
+            assert np.array_equal(parallel[name], serial[name])